@@ -1,7 +1,13 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_file
+from flask import (Flask, render_template, request, jsonify, session, redirect, url_for, send_file,
+                   Response, stream_with_context)
 import os
+import json
+import shutil
+import sqlite3
+import tempfile
 from datetime import datetime
 from functools import wraps
+import threading
 from werkzeug.utils import secure_filename
 import mimetypes
 
@@ -9,6 +15,12 @@ import mimetypes
 try:
     from models import EnhancedKnowledgeBase, UserManager, EnhancedAIAssistant
     from file_manager import FileManager
+    from ingest_queue import IngestionQueue
+    from storage_sweeper import StorageSweeper
+    from zip_stream import stream_zip
+    from response_cache import ResponseCache
+    from llm_client import LLMClient, make_backend
+    from conversation_store import ConversationStore
     from config import Config
     IMPORTS_SUCCESS = True
 except ImportError as e:
@@ -22,79 +34,138 @@ except ImportError as e:
         HOST = '0.0.0.0'
         PORT = 5000
 
-import sqlite3
-
 app = Flask(__name__)
 app.config.from_object(Config)
 
+# Components are built on first use, so a cold start only pays for what its
+# first request needs: /login never opens the file index or loads Gemini
+file_manager = None
+ingest_queue = None
+storage_sweeper = None
+knowledge_base = None
+user_manager = None
+ai_assistant = None
+_components_lock = threading.RLock()
+# Request temp files; init_app() falls back to ./temp
+temp_dir = '/tmp/temp'
+
+
+def _build(name, factory):
+    """Construct a component, or log why not and return None to retry on next use"""
+    if not IMPORTS_SUCCESS:
+        return None
+    try:
+        print(f"Initializing {name}...")
+        component = factory()
+        print(f"✅ {name} initialized")
+        return component
+    except Exception as e:
+        print(f"❌ {name} initialization error: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+
+def get_user_manager():
+    global user_manager
+    if user_manager is None:
+        with _components_lock:
+            if user_manager is None:
+                user_manager = _build("UserManager", UserManager)
+    return user_manager
+
+
+def get_file_manager():
+    global file_manager
+    if file_manager is None:
+        with _components_lock:
+            if file_manager is None:
+                file_manager = _build("FileManager", lambda: FileManager(
+                    excel_max_rows=Config.EXCEL_MAX_ROWS_PER_SHEET, use_vectors=Config.VECTOR_SEARCH))
+                if file_manager is not None:
+                    # Sweeps run for as long as the file index is in use
+                    get_storage_sweeper()
+    return file_manager
+
+
+def get_storage_sweeper():
+    global storage_sweeper
+    if storage_sweeper is None:
+        with _components_lock:
+            if storage_sweeper is None and get_file_manager() is not None:
+                # Serverless hosts get no background thread, only /maintenance/sweep
+                storage_sweeper = _build("StorageSweeper", lambda: StorageSweeper(
+                    file_manager,
+                    interval_seconds=Config.SWEEP_INTERVAL if Config.INGEST_ASYNC else 0,
+                    temp_dir=temp_dir,
+                    min_age_seconds=Config.SWEEP_MIN_AGE))
+    return storage_sweeper
+
+
+def get_ingest_queue():
+    global ingest_queue
+    if ingest_queue is None:
+        with _components_lock:
+            if ingest_queue is None and get_file_manager() is not None:
+                ingest_queue = _build("IngestionQueue", lambda: IngestionQueue(
+                    file_manager,
+                    max_workers=Config.INGEST_WORKERS,
+                    run_async=Config.INGEST_ASYNC,
+                    bulk_workers=Config.BULK_UPLOAD_WORKERS))
+    return ingest_queue
+
+
+def get_knowledge_base():
+    global knowledge_base
+    if knowledge_base is None:
+        with _components_lock:
+            if knowledge_base is None and get_file_manager() is not None:
+                knowledge_base = _build("KnowledgeBase", lambda: EnhancedKnowledgeBase(
+                    file_manager, static_data_path=Config.STATIC_DATA_PATH))
+    return knowledge_base
+
+
+def get_ai_assistant():
+    global ai_assistant
+    if ai_assistant is None:
+        with _components_lock:
+            if ai_assistant is None and get_knowledge_base() is not None:
+                # Conversations are kept next to the users they belong to
+                users = get_user_manager()
+                ai_assistant = _build("AI Assistant", lambda: EnhancedAIAssistant(
+                    knowledge_base, Config.GEMINI_API_KEY,
+                    context_token_budget=Config.CONTEXT_TOKEN_BUDGET,
+                    response_cache=ResponseCache(Config.RESPONSE_CACHE_SIZE, Config.RESPONSE_CACHE_TTL),
+                    llm_client=LLMClient(make_backend(Config.LLM_BACKEND, Config.GEMINI_API_KEY),
+                                         max_concurrency=Config.LLM_MAX_CONCURRENCY,
+                                         timeout=Config.LLM_TIMEOUT,
+                                         max_retries=Config.LLM_MAX_RETRIES),
+                    conversation_store=ConversationStore(users.db_path if users else None,
+                                                         max_users=Config.CONVERSATION_CACHE_USERS,
+                                                         ttl_seconds=Config.CONVERSATION_CACHE_TTL)
+                ))
+    return ai_assistant
+
+
 def init_app():
     """Initialize application for serverless environment"""
+    global temp_dir
     # Create necessary directories
     try:
         os.makedirs('/tmp/temp', exist_ok=True)
         os.makedirs('/tmp/documents', exist_ok=True)
     except:
+        temp_dir = 'temp'
         os.makedirs('temp', exist_ok=True)
         os.makedirs('documents', exist_ok=True)
-    
-    # Initialize components with better error handling
-    global file_manager, knowledge_base, user_manager, ai_assistant
-    
-    if IMPORTS_SUCCESS:
-        try:
-            # Initialize UserManager first
-            print("Initializing UserManager...")
-            user_manager = UserManager()
-            print("✅ UserManager initialized")
-            
-            # Initialize FileManager
-            print("Initializing FileManager...")
-            file_manager = FileManager()
-            print("✅ FileManager initialized")
-            
-            # Initialize KnowledgeBase
-            print("Initializing KnowledgeBase...")
-            knowledge_base = EnhancedKnowledgeBase(file_manager)
-            print("✅ KnowledgeBase initialized")
-            
-            # Initialize AI Assistant
-            print("Initializing AI Assistant...")
-            ai_assistant = EnhancedAIAssistant(knowledge_base, Config.GEMINI_API_KEY)
-            print("✅ AI Assistant initialized")
-            
-            print("🎉 All components initialized successfully!")
-            
-        except Exception as e:
-            print(f"❌ Component initialization error: {e}")
-            print(f"Error type: {type(e).__name__}")
-            import traceback
-            traceback.print_exc()
-            
-            # Try to initialize components one by one to isolate the issue
-            try:
-                print("Attempting UserManager only...")
-                user_manager = UserManager()
-                print("✅ UserManager OK")
-            except Exception as e1:
-                print(f"❌ UserManager failed: {e1}")
-                user_manager = None
-            
-            try:
-                print("Attempting FileManager only...")
-                file_manager = FileManager()
-                print("✅ FileManager OK")
-            except Exception as e2:
-                print(f"❌ FileManager failed: {e2}")
-                file_manager = None
-            
-            knowledge_base = None
-            ai_assistant = None
-    else:
-        file_manager = None
-        knowledge_base = None
-        user_manager = None
-        ai_assistant = None
+
+    if not IMPORTS_SUCCESS:
         print("⚠️ Running in fallback mode due to import errors")
+    elif Config.EAGER_INIT:
+        # Long-running servers can pay the start-up cost before the first request
+        get_user_manager()
+        get_ingest_queue()
+        get_ai_assistant()
 
 # Initialize for serverless
 init_app()
@@ -124,7 +195,7 @@ def admin_required(f):
 def index():
     # Check if components are loaded
     try:
-        if IMPORTS_SUCCESS and user_manager is not None:
+        if IMPORTS_SUCCESS and get_user_manager() is not None:
             # Full app mode - redirect to proper flow
             if 'user_id' in session:
                 return redirect(url_for('dashboard'))
@@ -158,7 +229,7 @@ def index():
             <div class="error">
                 <p><strong>Debug Info:</strong></p>
                 <p>IMPORTS_SUCCESS: ''' + str(IMPORTS_SUCCESS) + '''</p>
-                <p>user_manager: ''' + str(user_manager is not None) + '''</p>
+                <p>user_manager: ''' + str(get_user_manager() is not None) + '''</p>
             </div>
             <div style="text-align: center;">
                 <a href="/health" class="btn">Health Check</a>
@@ -231,10 +302,10 @@ def debug_info():
         'python_version': sys.version,
         'imports_success': IMPORTS_SUCCESS,
         'components': {
-            'user_manager': user_manager is not None,
-            'file_manager': file_manager is not None,
-            'knowledge_base': knowledge_base is not None,
-            'ai_assistant': ai_assistant is not None
+            'user_manager': get_user_manager() is not None,
+            'file_manager': get_file_manager() is not None,
+            'knowledge_base': get_knowledge_base() is not None,
+            'ai_assistant': get_ai_assistant() is not None
         },
         'config': {
             'secret_key_set': bool(app.secret_key),
@@ -269,15 +340,15 @@ def api_status():
         
         # Check each component
         component_status = {
-            'user_manager': user_manager is not None,
-            'file_manager': file_manager is not None,
-            'knowledge_base': knowledge_base is not None,
-            'ai_assistant': ai_assistant is not None
+            'user_manager': get_user_manager() is not None,
+            'file_manager': get_file_manager() is not None,
+            'knowledge_base': get_knowledge_base() is not None,
+            'ai_assistant': get_ai_assistant() is not None
         }
         
-        if user_manager:
+        if get_user_manager():
             try:
-                user_manager.initialize_db()
+                get_user_manager().initialize_db()
                 db_status = 'connected'
             except Exception as e:
                 db_status = f'error: {str(e)}'
@@ -289,7 +360,9 @@ def api_status():
             'database': db_status,
             'components': component_status,
             'imports_success': IMPORTS_SUCCESS,
-            'ai_model': 'gemini-2.5-flash' if ai_assistant else 'not_loaded',
+            'ai_model': 'gemini-2.5-flash' if get_ai_assistant() else 'not_loaded',
+            'response_cache': get_ai_assistant().response_cache.stats() if get_ai_assistant() else None,
+            'llm': get_ai_assistant().llm.stats() if get_ai_assistant() else None,
             'timestamp': datetime.now().isoformat()
         })
     except Exception as e:
@@ -303,7 +376,7 @@ def api_status():
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     # Check if user_manager is available
-    if user_manager is None:
+    if get_user_manager() is None:
         if request.method == 'POST':
             return jsonify({
                 'success': False, 
@@ -342,7 +415,7 @@ def login():
             username = data.get('username')
             password = data.get('password')
 
-            user = user_manager.authenticate(username, password)
+            user = get_user_manager().authenticate(username, password)
             if user:
                 session['user_id'] = user['id']
                 session['username'] = user['username']
@@ -365,8 +438,8 @@ def signup():
     name = data.get('name')
     role = data.get('role')
 
-    if user_manager.create_user(username, password, name, role):
-        user = user_manager.authenticate(username, password)
+    if get_user_manager().create_user(username, password, name, role):
+        user = get_user_manager().authenticate(username, password)
         session['user_id'] = user['id']
         session['username'] = user['username']
         session['name'] = user['name']
@@ -387,7 +460,7 @@ def dashboard():
     }
 
     # Get recent documents for dashboard
-    recent_files = file_manager.list_files()[:5]  # Last 5 files
+    recent_files = get_file_manager().list_files()[:5]  # Last 5 files
 
     return render_template('dashboard.html', user=user_info, recent_files=recent_files)
 
@@ -410,7 +483,7 @@ def chat():
         }
 
         # Generate AI response with enhanced capabilities
-        response = ai_assistant.generate_enhanced_response(message, user_info)
+        response = get_ai_assistant().generate_enhanced_response(message, user_info)
 
         return jsonify({
             'success': True,
@@ -426,6 +499,41 @@ def chat():
         }), 500
 
 
+@app.route('/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    """Stream the answer as Server-Sent Events: text pieces, then 'done' or 'error'"""
+    data = request.json or {}
+    message = data.get('message', '').strip()
+
+    if not message:
+        return jsonify({'error': 'Boş mesaj göndərilə bilməz'}), 400
+
+    user_info = {
+        'id': session['user_id'],
+        'username': session['username'],
+        'name': session['name'],
+        'role': session['role']
+    }
+
+    def events():
+        try:
+            ai_assistant = get_ai_assistant()
+            if ai_assistant is None:
+                raise RuntimeError("AI assistant is not available")
+            for text in ai_assistant.stream_enhanced_response(message, user_info):
+                yield f"data: {json.dumps({'text': text}, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            error = {'error': 'Texniki problem yarandı. Zəhmət olmasa yenidən cəhd edin.'}
+            yield f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n"
+            return
+        yield f"event: done\ndata: {json.dumps({'timestamp': datetime.now().isoformat()})}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
 @app.route('/upload', methods=['POST'])
 @login_required
 def upload_file():
@@ -443,35 +551,26 @@ def upload_file():
         description = request.form.get('description', '')
         tags = request.form.get('tags', '').split(',') if request.form.get('tags') else []
 
-        # Save file temporarily
+        # Stream the upload straight into content-addressed storage; it is
+        # hashed on the way in and never copied through a temp directory
         filename = secure_filename(file.filename)
-        temp_path = os.path.join('temp', filename)
-        os.makedirs('temp', exist_ok=True)
-        file.save(temp_path)
-
-        # Process with file manager
-        result = file_manager.upload_file(
-            temp_path,
-            category=category,
-            tags=tags,
-            description=description
-        )
+        blob_path = get_file_manager().receive_upload(file.stream, filename)
 
-        # Clean up temp file
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        # Extraction and indexing run in the background
+        job_id = get_ingest_queue().submit_files([{
+            'path': str(blob_path),
+            'filename': filename,
+            'category': category,
+            'tags': tags,
+            'description': description
+        }], owner=session['user_id'])
 
-        if result.get('success'):
-            return jsonify({
-                'success': True,
-                'message': f'{filename} uğurla yükləndi',
-                'file_info': result
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'error': result.get('error', 'Fayl yüklənə bilmədi')
-            }), 500
+        return jsonify({
+            'success': True,
+            'message': f'{filename} qəbul edildi, emal olunur',
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id)
+        }), 202
 
     except Exception as e:
         print(f"Upload error: {e}")
@@ -487,7 +586,7 @@ def list_files():
     """List all uploaded files"""
     try:
         category = request.args.get('category')
-        files = file_manager.list_files(category=category)
+        files = get_file_manager().list_files(category=category)
 
         return jsonify({
             'success': True,
@@ -507,7 +606,7 @@ def get_file_content(file_id):
     """Get file content by ID"""
     try:
         chunk_index = request.args.get('chunk', type=int)
-        content = file_manager.get_file_content(file_id, chunk_index)
+        content = get_file_manager().get_file_content(file_id, chunk_index)
 
         if content.get('error'):
             return jsonify({'error': content['error']}), 404
@@ -524,6 +623,69 @@ def get_file_content(file_id):
         }), 500
 
 
+@app.route('/files/<file_id>', methods=['DELETE'])
+@admin_required
+def delete_file(file_id):
+    """Delete a file with its chunks and search index entries (Admin only).
+
+    ?force=1 also deletes a file left unprocessed by an upload that died.
+    """
+    force = request.args.get('force', '').lower() in ('1', 'true')
+    result = get_file_manager().delete_file(file_id, force=force)
+    if not result['success']:
+        status = 404 if result['error'] == 'File not found' else 409
+        return jsonify({
+            'success': False,
+            'error': 'Fayl tapılmadı' if status == 404 else f"Fayl silinə bilmədi: {result['error']}"
+        }), status
+    return jsonify(result)
+
+
+@app.route('/files/<file_id>/replace', methods=['POST'])
+@admin_required
+def replace_file(file_id):
+    """Replace a file with a new version, keeping its metadata (Admin only)"""
+    file_manager = get_file_manager()
+    # Checked before the body is read, so nothing is stored for a bad target
+    status = file_manager.get_processing_status([file_id]).get(file_id)
+    if status is None:
+        return jsonify({'success': False, 'error': 'Fayl tapılmadı'}), 404
+    if not status['processed']:
+        return jsonify({'success': False, 'error': 'Fayl hələ emal olunur'}), 409
+
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'Fayl seçilməyib'}), 400
+
+    filename = secure_filename(file.filename)
+    blob_path = file_manager.receive_upload(file.stream, filename)
+
+    # Indexed in the background like /upload; the old version goes once
+    # the new one is searchable
+    job_id = get_ingest_queue().submit_files([{
+        'path': str(blob_path),
+        'filename': filename,
+        'replaces': file_id
+    }], owner=session['user_id'])
+
+    return jsonify({
+        'success': True,
+        'message': f'{filename} qəbul edildi, emal olunur',
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id)
+    }), 202
+
+
+@app.route('/maintenance/sweep', methods=['POST'])
+@admin_required
+def sweep_storage():
+    """Remove orphaned files, optimize the search index and vacuum now (Admin only)"""
+    sweeper = get_storage_sweeper()
+    if sweeper is None:
+        return jsonify({'success': False, 'error': 'Fayl sistemi əlçatan deyil'}), 500
+    return jsonify(sweeper.run_once())
+
+
 @app.route('/search-files')
 @login_required
 def search_files():
@@ -535,7 +697,7 @@ def search_files():
         if not query:
             return jsonify({'error': 'Axtarış sorğusu tələb olunur'}), 400
 
-        results = file_manager.search_files(query, category=category)
+        results = get_file_manager().search_files(query, category=category)
 
         return jsonify({
             'success': True,
@@ -558,6 +720,8 @@ def bulk_upload():
         data = request.json
         directory_path = data.get('directory_path')
         category = data.get('category', 'Bulk Upload')
+        # Sync mode only ingests files added or changed since the last sync
+        sync = bool(data.get('sync', False))
 
         if not directory_path:
             return jsonify({'error': 'Directory path tələb olunur'}), 400
@@ -565,12 +729,14 @@ def bulk_upload():
         if not os.path.exists(directory_path):
             return jsonify({'error': 'Directory tapılmadı'}), 400
 
-        result = file_manager.bulk_upload(directory_path, category=category)
+        job_id = get_ingest_queue().submit_directory(directory_path, category=category, sync=sync,
+                                                     owner=session['user_id'])
 
         return jsonify({
             'success': True,
-            'result': result
-        })
+            'job_id': job_id,
+            'status_url': url_for('job_status', job_id=job_id)
+        }), 202
     except Exception as e:
         print(f"Bulk upload error: {e}")
         return jsonify({
@@ -579,12 +745,80 @@ def bulk_upload():
         }), 500
 
 
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    """Report the progress of an upload job to whoever submitted it, or an admin"""
+    job = get_ingest_queue().get_job(job_id) if get_ingest_queue() else None
+    # Someone else's job is reported as missing, not forbidden
+    if job is None or (session.get('role') != 'admin' and job['owner'] != session['user_id']):
+        return jsonify({'error': 'Tapşırıq tapılmadı'}), 404
+
+    return jsonify({
+        'success': True,
+        'job': job
+    })
+
+
+@app.route('/knowledge/reload', methods=['POST'])
+@admin_required
+def reload_knowledge():
+    """Recompile the static knowledge base from its data file (Admin only)"""
+    try:
+        entries = get_knowledge_base().reload_static_data()
+        return jsonify({
+            'success': True,
+            'entries': entries
+        })
+    except Exception as e:
+        print(f"Knowledge reload error: {e}")
+        return jsonify({
+            'success': False,
+            'error': f'Məlumat faylı yüklənə bilmədi: {e}'
+        }), 500
+
+
+@app.route('/documents/rechunk', methods=['POST'])
+@admin_required
+def rechunk_documents():
+    """Re-chunk all documents from the cached text, optionally with new chunk sizes (Admin only)"""
+    data = request.get_json(silent=True) or {}
+    file_manager = get_file_manager()
+    chunker = None
+    if 'max_chunk_size' in data or 'overlap_size' in data:
+        try:
+            max_chunk_size = int(data.get('max_chunk_size', file_manager.chunker.max_chunk_size))
+            overlap_size = int(data.get('overlap_size', file_manager.chunker.overlap_size))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'Parça ölçüləri tam ədəd olmalıdır'}), 400
+        if max_chunk_size <= overlap_size or overlap_size < 0:
+            return jsonify({'success': False, 'error': 'Parça ölçüsü üst-üstə düşmədən böyük olmalıdır'}), 400
+        if overlap_size and not file_manager.chunker.SUPPORTS_OVERLAP:
+            return jsonify({'success': False, 'error': 'Maddələr üzrə bölmədə üst-üstə düşmə dəstəklənmir'}), 400
+        chunker = type(file_manager.chunker)(max_chunk_size=max_chunk_size, overlap_size=overlap_size)
+
+    return jsonify(file_manager.rechunk_documents(chunker))
+
+
+@app.route('/vectors/rebuild', methods=['POST'])
+@admin_required
+def rebuild_vectors():
+    """Refit the embedding model and re-embed all chunks (Admin only)"""
+    result = get_file_manager().rebuild_vector_index()
+    if not result['success']:
+        return jsonify({
+            'success': False,
+            'error': f"Vektor indeksi qurula bilmədi: {result['error']}"
+        }), 500
+    return jsonify(result)
+
+
 @app.route('/file-stats')
 @login_required
 def file_stats():
     """Get file statistics"""
     try:
-        files = file_manager.list_files()
+        files = get_file_manager().list_files()
 
         stats = {
             'total_files': len(files),
@@ -632,7 +866,7 @@ def knowledge_search():
         if not query:
             return jsonify({'error': 'Axtarış sorğusu tələb olunur'}), 400
 
-        results = knowledge_base.search(query)
+        results = get_knowledge_base().search(query)
 
         return jsonify({
             'success': True,
@@ -668,8 +902,7 @@ def download_file(file_id):
     """Download a file by its ID"""
     try:
         # Get file info from database
-        conn = sqlite3.connect(file_manager.db_path)
-        cursor = conn.cursor()
+        cursor = get_file_manager().db.connection().cursor()
         cursor.execute('''
                        SELECT filename, file_path, file_type
                        FROM files
@@ -677,7 +910,6 @@ def download_file(file_id):
                        ''', (file_id,))
 
         file_info = cursor.fetchone()
-        conn.close()
 
         if not file_info:
             return jsonify({'error': 'File not found'}), 404
@@ -706,45 +938,54 @@ def download_file(file_id):
 def download_all_files():
     """Download all files as ZIP (Admin only)"""
     try:
-        import zipfile
-        from io import BytesIO
+        # Files go in category folders; all paths come from a single query
+        entries = [(f"{category or 'Uncategorized'}/{filename}", file_path)
+                   for filename, category, file_path in get_file_manager().list_stored_files()]
+        return _zip_response(entries, f'nazirlik_documents_{datetime.now().strftime("%Y%m%d")}.zip')
 
-        # Create ZIP in memory
-        zip_buffer = BytesIO()
-
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            # Get all files
-            files = file_manager.list_files()
+    except Exception as e:
+        print(f"Download all error: {e}")
+        return jsonify({'error': 'ZIP creation failed'}), 500
 
-            for file_info in files:
-                file_path = None
 
-                # Get file path from database
-                conn = sqlite3.connect(file_manager.db_path)
-                cursor = conn.cursor()
-                cursor.execute('SELECT file_path FROM files WHERE id = ?', (file_info['file_id'],))
-                result = cursor.fetchone()
-                conn.close()
+def _zip_response(entries, download_name, cleanup_dir=None):
+    """Send a ZIP archive while it is being written, see stream_zip().
 
-                if result and os.path.exists(result[0]):
-                    file_path = result[0]
-                    # Add file to ZIP with category folder structure
-                    category = file_info.get('category', 'Uncategorized')
-                    zip_path = f"{category}/{file_info['filename']}"
-                    zip_file.write(file_path, zip_path)
+    cleanup_dir is removed once the archive is sent or the client goes away.
+    """
+    def chunks():
+        try:
+            yield from stream_zip(entries)
+        finally:
+            if cleanup_dir:
+                shutil.rmtree(cleanup_dir, ignore_errors=True)
+
+    return Response(chunks(), mimetype='application/zip', headers={
+        'Content-Disposition': f'attachment; filename="{download_name}"',
+        'X-Accel-Buffering': 'no'
+    })
 
-        zip_buffer.seek(0)
 
-        return send_file(
-            BytesIO(zip_buffer.read()),
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f'nazirlik_documents_{datetime.now().strftime("%Y%m%d")}.zip'
-        )
+def _database_snapshots(db_paths, snapshot_dir):
+    """Copy live databases into snapshot_dir with the SQLite backup API.
 
-    except Exception as e:
-        print(f"Download all error: {e}")
-        return jsonify({'error': 'ZIP creation failed'}), 500
+    The databases run in WAL mode, so the main file alone can miss recent
+    writes; a backup is a consistent copy of everything committed.
+    """
+    entries = []
+    for db_path in db_paths:
+        if not db_path or not os.path.exists(db_path):
+            continue
+        target = os.path.join(snapshot_dir, os.path.basename(db_path))
+        source = sqlite3.connect(db_path, timeout=30)
+        copy = sqlite3.connect(target)
+        try:
+            source.backup(copy)
+        finally:
+            copy.close()
+            source.close()
+        entries.append((f'database/{os.path.basename(db_path)}', target))
+    return entries
 
 
 @app.route('/files/<file_id>/info')
@@ -752,19 +993,25 @@ def download_all_files():
 def get_file_info(file_id):
     """Get detailed file information"""
     try:
-        conn = sqlite3.connect(file_manager.db_path)
-        cursor = conn.cursor()
+        cursor = get_file_manager().db.connection().cursor()
 
         cursor.execute('''
-                       SELECT f.*, COUNT(c.id) as chunk_count
+                       SELECT f.id,
+                              f.filename,
+                              f.original_name,
+                              f.file_type,
+                              f.file_size,
+                              f.upload_date,
+                              f.category,
+                              f.description,
+                              COUNT(c.id) as chunk_count
                        FROM files f
-                                LEFT JOIN chunks c ON f.id = c.file_id
+                                LEFT JOIN chunks c ON COALESCE(f.blob_id, f.id) = c.file_id
                        WHERE f.id = ?
                        GROUP BY f.id
                        ''', (file_id,))
 
         file_data = cursor.fetchone()
-        conn.close()
 
         if not file_data:
             return jsonify({'error': 'File not found'}), 404
@@ -773,12 +1020,12 @@ def get_file_info(file_id):
             'file_id': file_data[0],
             'filename': file_data[1],
             'original_name': file_data[2],
-            'file_type': file_data[4],
-            'file_size': file_data[5],
-            'upload_date': file_data[7],
-            'category': file_data[9],
-            'description': file_data[11],
-            'chunk_count': file_data[14],
+            'file_type': file_data[3],
+            'file_size': file_data[4],
+            'upload_date': file_data[5],
+            'category': file_data[6],
+            'description': file_data[7],
+            'chunk_count': file_data[8],
             'download_url': url_for('download_file', file_id=file_id)
         }
 
@@ -796,54 +1043,36 @@ def get_file_info(file_id):
 @admin_required
 def export_data():
     """Export all data including files and database (Admin only)"""
+    snapshot_dir = None
     try:
-        import zipfile
-        from io import BytesIO
-        import json
-
-        zip_buffer = BytesIO()
-
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-
-            # 1. Add all documents
-            files = file_manager.list_files()
-            for file_info in files:
-                conn = sqlite3.connect(file_manager.db_path)
-                cursor = conn.cursor()
-                cursor.execute('SELECT file_path FROM files WHERE id = ?', (file_info['file_id'],))
-                result = cursor.fetchone()
-                conn.close()
-
-                if result and os.path.exists(result[0]):
-                    category = file_info.get('category', 'Uncategorized')
-                    zip_path = f"documents/{category}/{file_info['filename']}"
-                    zip_file.write(result[0], zip_path)
-
-            # 2. Add databases
-            if os.path.exists('users.db'):
-                zip_file.write('users.db', 'database/users.db')
-            if os.path.exists('file_index.db'):
-                zip_file.write('file_index.db', 'database/file_index.db')
-
-            # 3. Add file metadata as JSON
-            metadata = {
-                'export_date': datetime.now().isoformat(),
-                'total_files': len(files),
-                'files': files
-            }
-            zip_file.writestr('metadata.json', json.dumps(metadata, ensure_ascii=False, indent=2))
-
-        zip_buffer.seek(0)
+        file_manager = get_file_manager()
+        users = get_user_manager()
 
-        return send_file(
-            BytesIO(zip_buffer.read()),
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f'nazirlik_full_export_{datetime.now().strftime("%Y%m%d_%H%M")}.zip'
-        )
+        # 1. All documents
+        entries = [(f"documents/{category or 'Uncategorized'}/{filename}", file_path)
+                   for filename, category, file_path in file_manager.list_stored_files()]
+
+        # 2. Databases, as consistent copies of the live ones
+        snapshot_dir = tempfile.mkdtemp(prefix='export-')
+        entries.extend(_database_snapshots([users.db_path if users else None, file_manager.db_path],
+                                           snapshot_dir))
+
+        # 3. File metadata as JSON
+        files = file_manager.list_files()
+        metadata = {
+            'export_date': datetime.now().isoformat(),
+            'total_files': len(files),
+            'files': files
+        }
+        entries.append(('metadata.json', json.dumps(metadata, ensure_ascii=False, indent=2).encode('utf-8')))
+
+        return _zip_response(entries, f'nazirlik_full_export_{datetime.now().strftime("%Y%m%d_%H%M")}.zip',
+                             cleanup_dir=snapshot_dir)
 
     except Exception as e:
         print(f"Export error: {e}")
+        if snapshot_dir:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
         return jsonify({'error': 'Export failed'}), 500
 
 @app.route('/files-manager')
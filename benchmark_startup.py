@@ -0,0 +1,68 @@
+"""Measure cold-start cost: importing the app and serving the first requests.
+
+Every run is a fresh Python process, like a new serverless instance:
+
+    python benchmark_startup.py --runs 5
+    EAGER_INIT=true python benchmark_startup.py
+
+The chat request uses the stub model backend, so no API key is needed and
+the numbers show only the app's own start-up work.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+COLD_START = r'''
+import json, time
+timings = {}
+start = time.perf_counter()
+import app
+timings['import'] = time.perf_counter() - start
+
+client = app.app.test_client()
+for name, request in [
+    ('GET /login', lambda: client.get('/login')),
+    ('POST /login', lambda: client.post('/login', json={'username': 'admin', 'password': 'admin123'})),
+    ('GET /files', lambda: client.get('/files')),
+    ('POST /chat', lambda: client.post('/chat', json={'message': 'İş saatları nədir?'})),
+]:
+    start = time.perf_counter()
+    response = request()
+    timings[name] = time.perf_counter() - start
+    # A redirect to /login would time the wrong thing
+    assert response.status_code == 200, (name, response.status_code)
+
+print(json.dumps(timings))
+'''
+
+
+def run_once(env) -> dict:
+    result = subprocess.run([sys.executable, '-c', COLD_START], env=env, capture_output=True,
+                            text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes to start')
+    args = parser.parse_args()
+
+    env = {**os.environ, 'LLM_BACKEND': 'stub', 'INGEST_ASYNC': 'False'}
+    runs = [run_once(env) for _ in range(args.runs)]
+
+    print(f"Cold start over {args.runs} runs (EAGER_INIT={env.get('EAGER_INIT', 'False')}), median ms:")
+    total = 0.0
+    for stage in runs[0]:
+        median = statistics.median(run[stage] for run in runs) * 1000
+        total += median
+        print(f"  {stage:<12} {median:8.1f}")
+    print(f"  {'total':<12} {total:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
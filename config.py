@@ -22,5 +22,41 @@ class Config:
     HOST = os.environ.get('FLASK_HOST', '0.0.0.0')
     PORT = int(os.environ.get('FLASK_PORT', 5000))
 
+    # Build every component at import instead of on first use; worth it for
+    # long-running servers, not for serverless cold starts
+    EAGER_INIT = os.environ.get('EAGER_INIT', 'False').lower() == 'true'
+
+    # Background ingestion - set INGEST_ASYNC=false on serverless hosts,
+    # where work left running after the response is frozen
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 2))
+    INGEST_ASYNC = os.environ.get('INGEST_ASYNC', 'True').lower() == 'true'
+    # Extraction processes for /bulk-upload, defaults to one per CPU
+    BULK_UPLOAD_WORKERS = int(os.environ.get('BULK_UPLOAD_WORKERS', 0)) or None
+    # Rows read per spreadsheet sheet, defaults to 50000
+    EXCEL_MAX_ROWS_PER_SHEET = int(os.environ.get('EXCEL_MAX_ROWS_PER_SHEET', 0)) or None
+    # JSON file with the static knowledge base ({category: {key: text}});
+    # unset uses the built-in entries
+    STATIC_DATA_PATH = os.environ.get('STATIC_DATA_PATH')
+    # Dense vector index over chunks, fused with the keyword ranking
+    VECTOR_SEARCH = os.environ.get('VECTOR_SEARCH', 'True').lower() == 'true'
+    # Seconds between background storage sweeps (orphaned blobs, temp files,
+    # index optimize and vacuum), 0 disables them; only runs with INGEST_ASYNC.
+    # Files younger than SWEEP_MIN_AGE seconds are never swept
+    SWEEP_INTERVAL = int(os.environ.get('SWEEP_INTERVAL', 6 * 3600))
+    SWEEP_MIN_AGE = int(os.environ.get('SWEEP_MIN_AGE', 3600))
+    # Estimated tokens of document and knowledge base context per AI prompt
+    CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 3000))
+    # Cached AI answers: entries kept and seconds each stays valid
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 500))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 3600))
+    # Model calls: 'gemini', or 'stub' for load tests without the API
+    LLM_BACKEND = os.environ.get('LLM_BACKEND', 'gemini')
+    LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 30))
+    LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 4))
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 3))
+    # Conversations held in memory per worker; all are persisted in SQLite
+    CONVERSATION_CACHE_USERS = int(os.environ.get('CONVERSATION_CACHE_USERS', 1000))
+    CONVERSATION_CACHE_TTL = int(os.environ.get('CONVERSATION_CACHE_TTL', 3600))
+
     # Templates directory
     TEMPLATES_DIR = 'templates'
\ No newline at end of file
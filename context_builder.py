@@ -0,0 +1,124 @@
+import math
+from typing import Dict, List
+
+from text_normalizer import tokenize
+
+
+class ContextBuilder:
+    """Assembles prompt context from ranked passages within a token budget.
+
+    Candidates from any source (static knowledge base, document chunks, a
+    requested document) are added with their relevance; build() drops
+    duplicates and near-duplicates and takes the most relevant ones until
+    the token budget is spent.
+    """
+
+    # Rough characters per token for Azerbaijani text; errs towards
+    # overestimating so the real prompt stays under budget
+    CHARS_PER_TOKEN = 3.0
+    # Share of a passage's word trigrams already in the context that makes
+    # it a near-duplicate
+    DUPLICATE_THRESHOLD = 0.8
+    # Smallest leftover budget worth filling with a truncated passage
+    MIN_PARTIAL_TOKENS = 80
+
+    def __init__(self, token_budget: int = 3000):
+        self.token_budget = token_budget
+        self.candidates: List[Dict] = []
+        self.stats = {}
+
+    @classmethod
+    def estimate_tokens(cls, text: str) -> int:
+        """Cheap token estimate, no tokenizer round-trip"""
+        return math.ceil(len(text) / cls.CHARS_PER_TOKEN) if text else 0
+
+    def add(self, text: str, relevance: float, source: str, label: str = None,
+            pinned: bool = False, max_tokens: int = None):
+        """Add one candidate; pinned ones are placed before everything else"""
+        text = (text or "").strip()
+        if not text:
+            return
+        if max_tokens is not None:
+            text = self._truncate(text, max_tokens)
+        self.candidates.append({
+            'text': text,
+            'relevance': relevance,
+            'source': source,
+            'label': label,
+            'pinned': pinned
+        })
+
+    def add_ranked(self, items: List[Dict], source: str, weight: float = 1.0):
+        """Add a source's ranked results ({'text', 'score', 'label'}).
+
+        Scores are only comparable within a source, so they are scaled to
+        0..weight against the source's best result before sources compete.
+        """
+        if not items:
+            return
+        best = max(item.get('score') or 0 for item in items)
+        for rank, item in enumerate(items):
+            score = item.get('score') or 0
+            relevance = weight * score / best if best > 0 else weight / (rank + 1)
+            self.add(item['text'], relevance, source, label=item.get('label'))
+
+    def build(self) -> str:
+        """Render the selected passages, most relevant first"""
+        ordered = sorted(self.candidates, key=lambda c: (not c['pinned'], -c['relevance']))
+        selected = []
+        seen_shingles = set()
+        used_tokens = 0
+        duplicates = 0
+
+        for candidate in ordered:
+            shingles = self._shingles(candidate['text'])
+            if shingles and len(shingles & seen_shingles) >= self.DUPLICATE_THRESHOLD * len(shingles):
+                duplicates += 1
+                continue
+
+            block = self._render(candidate['label'], candidate['text'])
+            cost = self.estimate_tokens(block) + 1
+            remaining = self.token_budget - used_tokens
+            if cost > remaining:
+                if remaining < self.MIN_PARTIAL_TOKENS:
+                    continue
+                # Fill what is left with the start of the passage
+                label_tokens = self.estimate_tokens(self._render(candidate['label'], ""))
+                block = self._render(candidate['label'],
+                                     self._truncate(candidate['text'], remaining - label_tokens - 1))
+                cost = self.estimate_tokens(block) + 1
+
+            selected.append(block)
+            seen_shingles |= shingles
+            used_tokens += cost
+
+        self.stats = {
+            'candidates': len(self.candidates),
+            'selected': len(selected),
+            'duplicates': duplicates,
+            'tokens': used_tokens,
+            'budget': self.token_budget
+        }
+        return "\n\n".join(selected)
+
+    @staticmethod
+    def _render(label: str, text: str) -> str:
+        return f"[{label}]\n{text}" if label else text
+
+    @classmethod
+    def _truncate(cls, text: str, max_tokens: int) -> str:
+        max_chars = int(max_tokens * cls.CHARS_PER_TOKEN)
+        if len(text) <= max_chars:
+            return text
+        cut = text[:max(max_chars - 3, 0)]
+        # Don't end on half a word
+        if ' ' in cut:
+            cut = cut[:cut.rindex(' ')]
+        return cut + "..."
+
+    @staticmethod
+    def _shingles(text: str) -> set:
+        tokens = tokenize(text)
+        if len(tokens) < 3:
+            return set(tokens)
+        return {tuple(tokens[i:i + 3]) for i in range(len(tokens) - 2)}
@@ -0,0 +1,174 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from database import get_connection_manager
+
+
+def summarize_turns(summary: str, turns: List[Dict], max_lines: int = 8) -> str:
+    """Fold turns into a running summary: one short line per question.
+
+    Needs no model call; pass a different summarizer to ConversationStore
+    for an abstractive one.
+    """
+    lines = summary.split("\n") if summary else []
+    for turn in turns:
+        question = " ".join(turn['user_message'].split())[:120]
+        answer = " ".join(turn['ai_response'].split())
+        # First sentence of the answer is usually the gist
+        answer = answer.split(". ")[0][:160]
+        lines.append(f"- {question} → {answer}")
+    return "\n".join(lines[-max_lines:])
+
+
+class ConversationStore:
+    """Per-user conversation history in memory, backed by SQLite.
+
+    The memory tier keeps at most max_users conversations for ttl_seconds
+    since their last use. With a db_path every turn is also written to
+    SQLite, so history survives restarts and is shared by all workers; a
+    conversation another worker has added to is reloaded on its next read.
+    Once a conversation has more than max_turns turns, all but the last
+    recent_turns are folded into a summary, keeping prompts small.
+    """
+
+    def __init__(self, db_path: str = None, max_users: int = 1000, ttl_seconds: int = 3600,
+                 max_turns: int = 8, recent_turns: int = 3,
+                 summarizer: Callable[[str, List[Dict]], str] = summarize_turns):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.max_turns = max_turns
+        self.recent_turns = recent_turns
+        self.summarizer = summarizer
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self.db = get_connection_manager(db_path) if db_path else None
+        if self.db:
+            self.init_db()
+
+    def init_db(self):
+        if self.db.connection().execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'conversation_summaries'").fetchone():
+            return
+        with self.db.transaction() as conn:
+            conn.execute('''
+                         CREATE TABLE IF NOT EXISTS conversation_turns
+                         (
+                             id           INTEGER PRIMARY KEY AUTOINCREMENT,
+                             user_id      TEXT NOT NULL,
+                             user_message TEXT NOT NULL,
+                             ai_response  TEXT NOT NULL,
+                             timestamp    TEXT NOT NULL
+                         )
+                         ''')
+            conn.execute('''
+                         CREATE INDEX IF NOT EXISTS idx_conversation_turns_user
+                             ON conversation_turns (user_id, id)
+                         ''')
+            conn.execute('''
+                         CREATE TABLE IF NOT EXISTS conversation_summaries
+                         (
+                             user_id    TEXT PRIMARY KEY,
+                             summary    TEXT NOT NULL,
+                             updated_at TEXT NOT NULL
+                         )
+                         ''')
+
+    def append(self, user_id: str, user_message: str, ai_response: str):
+        """Record one question and answer"""
+        turn = {
+            'user_message': user_message,
+            'ai_response': ai_response,
+            'timestamp': datetime.now().isoformat()
+        }
+        with self._lock:
+            conversation = self._load(user_id)
+            conversation['turns'].append(turn)
+            folded = []
+            if len(conversation['turns']) > self.max_turns:
+                while len(conversation['turns']) > self.recent_turns:
+                    folded.append(conversation['turns'].popleft())
+                conversation['summary'] = self.summarizer(conversation['summary'], folded)
+
+            if self.db:
+                with self.db.transaction() as conn:
+                    cursor = conn.execute('''
+                                          INSERT INTO conversation_turns (user_id, user_message, ai_response, timestamp)
+                                          VALUES (?, ?, ?, ?)
+                                          ''', (user_id, user_message, ai_response, turn['timestamp']))
+                    conversation['last_turn_id'] = cursor.lastrowid
+                    if folded:
+                        # Summarized turns only live on in the summary
+                        conn.execute('''
+                                     DELETE FROM conversation_turns
+                                     WHERE user_id = ? AND id NOT IN (
+                                         SELECT id FROM conversation_turns WHERE user_id = ?
+                                         ORDER BY id DESC LIMIT ?)
+                                     ''', (user_id, user_id, len(conversation['turns'])))
+                        conn.execute('''
+                                     INSERT OR REPLACE INTO conversation_summaries (user_id, summary, updated_at)
+                                     VALUES (?, ?, ?)
+                                     ''', (user_id, conversation['summary'], turn['timestamp']))
+
+    def recent(self, user_id: str, limit: int = None) -> List[Dict]:
+        """The last `limit` turns still kept verbatim, oldest first"""
+        with self._lock:
+            turns = list(self._load(user_id)['turns'])
+        return turns[-limit:] if limit else turns
+
+    def summary(self, user_id: str) -> str:
+        """Summary of the turns no longer kept verbatim"""
+        with self._lock:
+            return self._load(user_id)['summary']
+
+    def clear(self, user_id: str):
+        with self._lock:
+            self._conversations.pop(user_id, None)
+            if self.db:
+                with self.db.transaction() as conn:
+                    conn.execute('DELETE FROM conversation_turns WHERE user_id = ?', (user_id,))
+                    conn.execute('DELETE FROM conversation_summaries WHERE user_id = ?', (user_id,))
+
+    def _load(self, user_id: str) -> Dict:
+        """Memory entry for a user, reloaded from SQLite when missing, expired or stale"""
+        now = time.monotonic()
+        conversation = self._conversations.get(user_id)
+        if conversation is not None and conversation['expires'] < now:
+            conversation = None
+
+        if self.db and (conversation is None
+                        or conversation['last_turn_id'] != self._last_turn_id(user_id)):
+            conversation = self._read(user_id)
+        elif conversation is None:
+            conversation = {'turns': deque(), 'summary': "", 'last_turn_id': None}
+
+        conversation['expires'] = now + self.ttl_seconds
+        self._conversations[user_id] = conversation
+        self._conversations.move_to_end(user_id)
+        while len(self._conversations) > self.max_users:
+            self._conversations.popitem(last=False)
+        return conversation
+
+    def _last_turn_id(self, user_id: str) -> Optional[int]:
+        row = self.db.connection().execute(
+            'SELECT MAX(id) FROM conversation_turns WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0]
+
+    def _read(self, user_id: str) -> Dict:
+        conn = self.db.connection()
+        rows = conn.execute('''
+                            SELECT id, user_message, ai_response, timestamp
+                            FROM conversation_turns
+                            WHERE user_id = ?
+                            ORDER BY id DESC LIMIT ?
+                            ''', (user_id, self.max_turns)).fetchall()
+        summary_row = conn.execute('SELECT summary FROM conversation_summaries WHERE user_id = ?',
+                                   (user_id,)).fetchone()
+        return {
+            'turns': deque({'user_message': row[1], 'ai_response': row[2], 'timestamp': row[3]}
+                           for row in reversed(rows)),
+            'summary': summary_row[0] if summary_row else "",
+            'last_turn_id': rows[0][0] if rows else None
+        }
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+import weakref
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection(sqlite3.Connection):
+    """sqlite3 connection that can be tracked with weak references"""
+
+
+class ConnectionManager:
+    """Shared SQLite connection layer with one persistent connection per thread.
+
+    Connections stay open for the lifetime of the thread, so the sqlite3
+    statement cache (``cached_statements``) keeps prepared statements warm
+    across requests instead of recompiling them on every connect.
+    """
+
+    PRAGMAS = {
+        # Only takes effect on a new database, so it must come before
+        # journal_mode, which writes the header; existing ones are switched
+        # by FileManager.sweep_storage()
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,  # negative value means KiB, i.e. ~16 MB
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000,
+    }
+
+    def __init__(self, db_path: str, cached_statements: int = 256):
+        self.db_path = db_path
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = weakref.WeakSet()
+        self._connect_hooks: List[Callable[[sqlite3.Connection], None]] = []
+
+    def add_connect_hook(self, hook: Callable[[sqlite3.Connection], None]):
+        """Run hook on every connection, including ones already open"""
+        with self._lock:
+            if hook in self._connect_hooks:
+                return
+            self._connect_hooks.append(hook)
+            open_connections = list(self._connections)
+        for conn in open_connections:
+            hook(conn)
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, factory=PooledConnection,
+                               cached_statements=self.cached_statements)
+        for pragma, value in self.PRAGMAS.items():
+            try:
+                conn.execute(f'PRAGMA {pragma} = {value}')
+            except sqlite3.DatabaseError as e:
+                logger.warning(f"Could not set PRAGMA {pragma} on {self.db_path}: {e}")
+
+        with self._lock:
+            hooks = list(self._connect_hooks)
+            self._connections.add(conn)
+        for hook in hooks:
+            hook(conn)
+        return conn
+
+    def connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use"""
+        conn = getattr(self._local, 'conn', None)
+        # A forked worker must not reuse the parent's connection
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._open()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """Yield this thread's connection and commit, or roll back on error"""
+        conn = self.connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def close_all(self):
+        """Close every open connection (e.g. before deleting the database)"""
+        with self._lock:
+            open_connections = list(self._connections)
+            self._connections = weakref.WeakSet()
+        for conn in open_connections:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+        self._local = threading.local()
+
+
+_managers: Dict[str, ConnectionManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_path: str) -> ConnectionManager:
+    """Return the process-wide ConnectionManager for a database file"""
+    key = os.path.abspath(db_path)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = ConnectionManager(db_path)
+            _managers[key] = manager
+        return manager
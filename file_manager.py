@@ -1,23 +1,26 @@
 import os
+import re
 import json
+import time
+import uuid
 import hashlib
-import sqlite3
+import threading
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from pathlib import Path
 import mimetypes
 import logging
-from typing import List, Dict, Optional, Tuple
-
-# For document processing
-try:
-    import PyPDF2
-    import docx
-    import openpyxl
-    from bs4 import BeautifulSoup
-    import markdown
-except ImportError:
-    print("Warning: Some document processing libraries are not installed.")
-    print("Install with: pip install PyPDF2 python-docx openpyxl beautifulsoup4 markdown")
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Dict, Optional, Tuple, Union
+
+from database import get_connection_manager
+from text_cache import ExtractedTextCache
+from text_normalizer import (fold, stem, tokenize, fts_terms, trigram_queries, fuzzy_min_hits,
+                             register_sql_functions)
+
+# Document processing libraries (PyPDF2 python-docx openpyxl beautifulsoup4
+# markdown) are imported by the extractor that needs them, so importing this
+# module, e.g. on a serverless cold start, doesn't load them all
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -27,51 +30,168 @@ logger = logging.getLogger(__name__)
 class DocumentProcessor:
     """Handles different document types and extracts text content"""
 
-    @staticmethod
-    def extract_text_from_pdf(file_path: str) -> str:
-        """Extract text from PDF files"""
+    # Spreadsheet limits: rows read per sheet and characters kept per cell
+    EXCEL_MAX_ROWS_PER_SHEET = 50000
+    EXCEL_MAX_CELL_CHARS = 500
+
+    # Bump whenever an extractor's output changes, so cached text is re-extracted
+    EXTRACTOR_VERSION = 1
+
+    def __init__(self, excel_max_rows: int = None, excel_max_cell_chars: int = None,
+                 text_cache: ExtractedTextCache = None):
+        self.excel_max_rows = excel_max_rows or self.EXCEL_MAX_ROWS_PER_SHEET
+        self.excel_max_cell_chars = excel_max_cell_chars or self.EXCEL_MAX_CELL_CHARS
+        # With a cache, each blob is parsed once per extractor version
+        self.text_cache = text_cache
+
+    def _cached(self, file_path: str, key: str, extract: Callable[[], Iterable], kind: str) -> Iterator:
+        """extract(), read through the text cache when there is one.
+
+        The parse_* extractors raise on errors, so only a complete
+        extraction is ever cached. When one fails part way the units read
+        so far are still yielded and the error is logged; when it fails
+        before yielding anything the error is raised.
+        """
+        if self.text_cache is None:
+            units = extract()
+        else:
+            name = Path(file_path).stem
+            # Stored blobs are named after their hash; anything else is hashed
+            if len(name) == 32 and all(c in '0123456789abcdef' for c in name):
+                content_hash = name
+            else:
+                content_hash = FileManager.calculate_file_hash(file_path)
+            units = self.text_cache.read_through(content_hash, f"{key}-v{self.EXTRACTOR_VERSION}", extract)
+
+        produced = False
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-                return text
+            for unit in units:
+                produced = True
+                yield unit
         except Exception as e:
-            logger.error(f"Error processing PDF {file_path}: {e}")
-            return ""
+            if not produced:
+                raise
+            logger.error(f"Error processing {kind} {file_path}, keeping the text read before it: {e}")
 
     @staticmethod
-    def extract_text_from_docx(file_path: str) -> str:
-        """Extract text from DOCX files"""
+    def _tolerant(units: Iterable, kind: str, file_path: str) -> Iterator:
+        """Yield units until the extractor fails, logging the error instead of raising it"""
         try:
-            doc = docx.Document(file_path)
-            text = ""
-            for paragraph in doc.paragraphs:
-                text += paragraph.text + "\n"
-            return text
+            yield from units
         except Exception as e:
-            logger.error(f"Error processing DOCX {file_path}: {e}")
-            return ""
+            logger.error(f"Error processing {kind} {file_path}: {e}")
 
     @staticmethod
-    def extract_text_from_excel(file_path: str) -> str:
-        """Extract text from Excel files"""
+    def parse_pdf_pages(file_path: str) -> Iterator[str]:
+        """Yield the text of a PDF one page at a time"""
+        import PyPDF2
+        with open(file_path, 'rb') as file:
+            pdf_reader = PyPDF2.PdfReader(file)
+            for page in pdf_reader.pages:
+                yield (page.extract_text() or "") + "\n"
+
+    @classmethod
+    def extract_text_from_pdf(cls, file_path: str) -> str:
+        """Extract text from PDF files"""
+        return "".join(cls._tolerant(cls.parse_pdf_pages(file_path), 'PDF', file_path))
+
+    def iter_docx_blocks(self, file_path: str) -> Iterator[Tuple[str, str]]:
+        """Yield (kind, text) for the paragraphs and tables of a DOCX in order.
+
+        kind is 'heading' for Heading/Title styled paragraphs, 'paragraph'
+        or 'table'; table rows come out as "cell | cell" lines.
+        """
+        return self._cached(file_path, 'docx-blocks', lambda: self.parse_docx_blocks(file_path), 'DOCX')
+
+    @staticmethod
+    def parse_docx_blocks(file_path: str) -> Iterator[Tuple[str, str]]:
+        """iter_docx_blocks() straight from the file, raising on errors"""
+        import docx
+        from docx.oxml.ns import qn
+        from docx.table import Table
+        from docx.text.paragraph import Paragraph
+        doc = docx.Document(file_path)
+        for element in doc.element.body.iterchildren():
+            if element.tag == qn('w:p'):
+                paragraph = Paragraph(element, doc)
+                text = paragraph.text.strip()
+                if not text:
+                    continue
+                style = paragraph.style.name if paragraph.style is not None else ""
+                kind = 'heading' if style.startswith(('Heading', 'Title')) else 'paragraph'
+                yield kind, text
+            elif element.tag == qn('w:tbl'):
+                rows = []
+                for row in Table(element, doc).rows:
+                    cells = []
+                    for cell in row.cells:
+                        # Merged cells repeat once per grid column
+                        if not cells or cell.text.strip() != cells[-1]:
+                            cells.append(cell.text.strip())
+                    if any(cells):
+                        rows.append(" | ".join(cells))
+                if rows:
+                    yield 'table', "\n".join(rows)
+
+    @classmethod
+    def extract_text_from_docx(cls, file_path: str) -> str:
+        """Extract text from DOCX files"""
+        blocks = cls._tolerant(cls.parse_docx_blocks(file_path), 'DOCX', file_path)
+        return "".join(text + "\n" for _, text in blocks)
+
+    def iter_excel_rows(self, file_path: str) -> Iterator[Tuple[str, str]]:
+        """Yield (sheet name, row text) for the non-empty rows of a workbook.
+
+        The workbook is opened read-only, so rows are parsed as they are
+        read instead of loading every cell. The first row yielded for a
+        sheet is its header.
+        """
+        # The row and cell limits change the output, so they are part of the key
+        key = f"excel-rows-r{self.excel_max_rows}-c{self.excel_max_cell_chars}"
+        return self._cached(file_path, key, lambda: self.parse_excel_rows(file_path), 'Excel')
+
+    def parse_excel_rows(self, file_path: str) -> Iterator[Tuple[str, str]]:
+        """iter_excel_rows() straight from the file, raising on errors"""
+        import openpyxl
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
         try:
-            workbook = openpyxl.load_workbook(file_path, data_only=True)
-            text = ""
-            for sheet_name in workbook.sheetnames:
-                sheet = workbook[sheet_name]
-                text += f"Sheet: {sheet_name}\n"
+            for sheet in workbook.worksheets:
+                row_count = 0
                 for row in sheet.iter_rows(values_only=True):
-                    row_text = " | ".join([str(cell) if cell is not None else "" for cell in row])
-                    if row_text.strip():
-                        text += row_text + "\n"
-                text += "\n"
-            return text
-        except Exception as e:
-            logger.error(f"Error processing Excel {file_path}: {e}")
-            return ""
+                    cells = [str(cell)[:self.excel_max_cell_chars] if cell is not None else "" for cell in row]
+                    # Read-only sheets pad rows to the widest column
+                    while cells and not cells[-1]:
+                        cells.pop()
+                    row_text = " | ".join(cells)
+                    if not row_text.strip():
+                        continue
+
+                    if row_count == self.excel_max_rows:
+                        logger.info(f"Sheet {sheet.title} of {file_path} truncated after {row_count} rows")
+                        yield sheet.title, f"[... truncated after {row_count} rows]"
+                        break
+                    row_count += 1
+                    yield sheet.title, row_text
+        finally:
+            workbook.close()
+
+    def extract_text_from_excel(self, file_path: str) -> str:
+        """Extract text from Excel files"""
+        return self.format_excel_rows(self._tolerant(self.iter_excel_rows(file_path), 'Excel', file_path))
+
+    @staticmethod
+    def format_excel_rows(rows: Iterable[Tuple[str, str]]) -> str:
+        """Join (sheet name, row text) pairs into text with a line per sheet heading and row"""
+        lines = []
+        current_sheet = None
+        for sheet_name, row_text in rows:
+            if sheet_name != current_sheet:
+                if current_sheet is not None:
+                    lines.append("")
+                lines.append(f"Sheet: {sheet_name}")
+                current_sheet = sheet_name
+            lines.append(row_text)
+        return "\n".join(lines) + "\n" if lines else ""
 
     @staticmethod
     def extract_text_from_txt(file_path: str) -> str:
@@ -91,6 +211,7 @@ class DocumentProcessor:
     def extract_text_from_html(file_path: str) -> str:
         """Extract text from HTML files"""
         try:
+            from bs4 import BeautifulSoup
             with open(file_path, 'r', encoding='utf-8') as file:
                 soup = BeautifulSoup(file.read(), 'html.parser')
                 return soup.get_text()
@@ -102,6 +223,8 @@ class DocumentProcessor:
     def extract_text_from_md(file_path: str) -> str:
         """Extract text from Markdown files"""
         try:
+            import markdown
+            from bs4 import BeautifulSoup
             with open(file_path, 'r', encoding='utf-8') as file:
                 md_content = file.read()
                 html = markdown.markdown(md_content)
@@ -111,61 +234,449 @@ class DocumentProcessor:
             logger.error(f"Error processing Markdown {file_path}: {e}")
             return ""
 
+    def extract_text(self, file_path: str, file_type: str) -> str:
+        """Extract text content based on file type"""
+        extractors = {
+            'pdf': self.extract_text_from_pdf,
+            'docx': self.extract_text_from_docx,
+            'excel': self.extract_text_from_excel,
+            'text': self.extract_text_from_txt,
+            'html': self.extract_text_from_html,
+            'markdown': self.extract_text_from_md
+        }
+
+        extractor = extractors.get(file_type, self.extract_text_from_txt)
+        return extractor(file_path)
+
+    def iter_text(self, file_path: str, file_type: str) -> Iterator[str]:
+        """Yield a document's text in pieces that break on whitespace.
+
+        PDFs stream page by page; other formats come out as one piece.
+        """
+        return self._cached(file_path, f"{file_type}-text", lambda: self.parse_text(file_path, file_type),
+                            file_type.upper())
+
+    def parse_text(self, file_path: str, file_type: str) -> Iterator[str]:
+        """iter_text() straight from the file.
+
+        PDF, DOCX and spreadsheet errors are raised. The other extractors
+        return "" on errors, which is not yielded, so it is never cached.
+        """
+        if file_type == 'pdf':
+            yield from self.parse_pdf_pages(file_path)
+        elif file_type == 'docx':
+            yield "".join(text + "\n" for _, text in self.parse_docx_blocks(file_path))
+        elif file_type == 'excel':
+            yield self.format_excel_rows(self.parse_excel_rows(file_path))
+        else:
+            text = self.extract_text(file_path, file_type)
+            if text:
+                yield text
+
 
 class DocumentChunker:
     """Handles chunking of large documents for better processing"""
 
+    # Whether overlap_size has any effect
+    SUPPORTS_OVERLAP = True
+
     def __init__(self, max_chunk_size: int = 4000, overlap_size: int = 200):
+        # Each chunk must move the window forward, or chunk_stream() never ends
+        if overlap_size < 0 or max_chunk_size <= overlap_size:
+            raise ValueError(f"max_chunk_size ({max_chunk_size}) must be greater than "
+                             f"overlap_size ({overlap_size}), which can't be negative")
         self.max_chunk_size = max_chunk_size
         self.overlap_size = overlap_size
 
+    def chunk_document(self, processor: DocumentProcessor, file_path: str, file_type: str,
+                       document_id: str) -> Iterator[Dict]:
+        """Stream the chunks of a stored document"""
+        if file_type == 'excel':
+            return self.chunk_table_rows(processor.iter_excel_rows(file_path), document_id)
+        return self.chunk_stream(processor.iter_text(file_path, file_type), document_id)
+
     def chunk_text(self, text: str, document_id: str) -> List[Dict]:
         """Split text into overlapping chunks"""
-        chunks = []
-        words = text.split()
-
-        if len(words) <= self.max_chunk_size:
-            return [{
-                'chunk_id': f"{document_id}_chunk_0",
-                'content': text,
-                'chunk_index': 0,
-                'total_chunks': 1
-            }]
-
-        total_chunks = (len(words) + self.max_chunk_size - 1) // self.max_chunk_size
-
-        for i in range(0, len(words), self.max_chunk_size - self.overlap_size):
-            chunk_words = words[i:i + self.max_chunk_size]
-            chunk_text = ' '.join(chunk_words)
-
-            chunks.append({
-                'chunk_id': f"{document_id}_chunk_{len(chunks)}",
-                'content': chunk_text,
-                'chunk_index': len(chunks),
-                'total_chunks': total_chunks
-            })
+        chunks = list(self.chunk_stream([text], document_id))
+        for chunk in chunks:
+            chunk['total_chunks'] = len(chunks)
+        return chunks
 
-            if i + self.max_chunk_size >= len(words):
-                break
+    def chunk_stream(self, pieces: Iterable[str], document_id: str) -> Iterator[Dict]:
+        """Chunk text arriving in pieces (e.g. PDF pages) as it is read.
+
+        Only about one chunk worth of words is held at a time, so memory
+        doesn't grow with the document. A document that fits in a single
+        chunk keeps its original whitespace.
+        """
+        step = self.max_chunk_size - self.overlap_size
+        words = []
+        # Raw text is only kept until it is known to need more than one chunk
+        raw_pieces = []
+        chunk_index = 0
+
+        for piece in pieces:
+            if chunk_index == 0:
+                raw_pieces.append(piece)
+            words.extend(piece.split())
+
+            while len(words) > self.max_chunk_size:
+                yield self._make_chunk(document_id, chunk_index, ' '.join(words[:self.max_chunk_size]))
+                chunk_index += 1
+                raw_pieces = []
+                del words[:step]
+
+        if chunk_index == 0:
+            yield self._make_chunk(document_id, 0, ''.join(raw_pieces))
+        elif len(words) > self.overlap_size:
+            yield self._make_chunk(document_id, chunk_index, ' '.join(words))
+
+    def chunk_table_rows(self, rows: Iterable[Tuple[str, str]], document_id: str) -> Iterator[Dict]:
+        """Chunk spreadsheet rows without splitting a row.
+
+        Every chunk starts with its sheet name and header row, so a chunk
+        from the middle of a large table can still be read on its own.
+        """
+        chunk_index = 0
+        sheet_name = None
+        heading = ""
+        heading_words = 0
+        sheet_chunks = 0
+        lines = []
+        words = 0
+
+        for row_sheet, row_text in rows:
+            if row_sheet != sheet_name:
+                # A sheet with only a header still gets a chunk
+                if sheet_name is not None and (lines or not sheet_chunks):
+                    yield self._make_chunk(document_id, chunk_index, "\n".join([heading, *lines]))
+                    chunk_index += 1
+                sheet_name = row_sheet
+                heading = f"Sheet: {row_sheet}\n{row_text}"
+                heading_words = len(heading.split())
+                sheet_chunks = 0
+                lines = []
+                words = heading_words
+                continue
+
+            row_words = len(row_text.split())
+            if lines and words + row_words > self.max_chunk_size:
+                yield self._make_chunk(document_id, chunk_index, "\n".join([heading, *lines]))
+                chunk_index += 1
+                sheet_chunks += 1
+                lines = []
+                words = heading_words
+            lines.append(row_text)
+            words += row_words
+
+        if sheet_name is not None and (lines or not sheet_chunks):
+            yield self._make_chunk(document_id, chunk_index, "\n".join([heading, *lines]))
+        elif sheet_name is None:
+            yield self._make_chunk(document_id, 0, "")
 
-        return chunks
+    @staticmethod
+    def _make_chunk(document_id: str, chunk_index: int, content: str, article: str = None,
+                    section: str = None) -> Dict:
+        return {
+            'chunk_id': f"{document_id}_chunk_{chunk_index}",
+            'content': content,
+            'chunk_index': chunk_index,
+            'article': article,
+            'section': section
+        }
+
+
+class LegalDocumentChunker(DocumentChunker):
+    """Chunks legal documents along their structure instead of word windows.
+
+    Every article ("Maddə N") starts a new chunk, section headings (docx
+    heading styles, "Bölmə"/"Fəsil"/"Hissə" lines) set the section of the
+    chunks that follow, and tables stay whole where they fit. A chunk is
+    only split further when it grows past max_chunk_size words. Chunks carry
+    'article' and 'section' labels. Articles never overlap, so overlap_size
+    is not used.
+    """
+
+    SUPPORTS_OVERLAP = False
+
+    # Matched against folded text, so "MADDƏ 20." and "Madde 20" both count;
+    # "Maddə 20-də ..." in running text does not
+    ARTICLE_PATTERN = re.compile(r'^madde\s+\d+(?:[.\-]\d+)*\.?(?=\s|$)')
+    SECTION_PATTERN = re.compile(
+        r'^(?:(?:bolme|fesil|hisse)\s+[\divxlc]+\b'
+        r'|[\divxlc]+(?:-?(?:ci|cu))?\s+(?:bolme|fesil|hisse)\b)'
+    )
+    MAX_LABEL_LENGTH = 200
+
+    def __init__(self, max_chunk_size: int = 800, overlap_size: int = 0):
+        super().__init__(max_chunk_size, overlap_size)
+
+    def chunk_document(self, processor: DocumentProcessor, file_path: str, file_type: str,
+                       document_id: str) -> Iterator[Dict]:
+        if file_type == 'excel':
+            return super().chunk_document(processor, file_path, file_type, document_id)
+        if file_type == 'docx':
+            blocks = processor.iter_docx_blocks(file_path)
+        else:
+            blocks = (('paragraph', line.strip())
+                      for piece in processor.iter_text(file_path, file_type)
+                      for line in piece.splitlines() if line.strip())
+        return self.chunk_blocks(blocks, document_id)
+
+    def chunk_blocks(self, blocks: Iterable[Tuple[str, str]], document_id: str) -> Iterator[Dict]:
+        """Chunk (kind, text) blocks, kind being 'heading', 'paragraph' or 'table'"""
+        chunk_index = 0
+        section = None
+        article = None
+        article_title = None
+        lines = []
+        words = 0
+        has_body = False
+
+        for kind, text in blocks:
+            folded = fold(text)
+            is_section = kind == 'heading' or self.SECTION_PATTERN.match(folded)
+            article_match = None if is_section else self.ARTICLE_PATTERN.match(folded)
+
+            if is_section or article_match:
+                # Headings directly above an article stay with it
+                if has_body:
+                    yield self._make_chunk(document_id, chunk_index, "\n".join(lines), article, section)
+                    chunk_index += 1
+                    lines, words, has_body = [], 0, False
+                if is_section:
+                    section = text[:self.MAX_LABEL_LENGTH]
+                    article = article_title = None
+                else:
+                    article = text[:article_match.end()].rstrip('.')
+                    article_title = text[:self.MAX_LABEL_LENGTH]
+                    has_body = True
+                lines.append(text)
+                words += len(text.split())
+                continue
+
+            for part in self._split_block(kind, text):
+                part_words = len(part.split())
+                if has_body and words + part_words > self.max_chunk_size:
+                    yield self._make_chunk(document_id, chunk_index, "\n".join(lines), article, section)
+                    chunk_index += 1
+                    # Continuations repeat the article title so they read on their own
+                    lines = [f"{article_title} (davamı)"] if article_title else []
+                    words = len(lines[0].split()) if lines else 0
+                lines.append(part)
+                words += part_words
+                has_body = True
+
+        if lines or chunk_index == 0:
+            yield self._make_chunk(document_id, chunk_index, "\n".join(lines), article, section)
+
+    def _split_block(self, kind: str, text: str) -> Iterator[str]:
+        """Cut a block longer than max_chunk_size at line, then word, boundaries"""
+        if len(text.split()) <= self.max_chunk_size:
+            yield text
+            return
+
+        block_lines = text.split("\n")
+        # Table parts keep the header row
+        header = block_lines[0] if kind == 'table' else None
+        part, part_words = [], 0
+        for line in block_lines:
+            line_words = line.split()
+            if len(line_words) > self.max_chunk_size:
+                for i in range(0, len(line_words), self.max_chunk_size):
+                    yield ' '.join(line_words[i:i + self.max_chunk_size])
+                continue
+            if part and part_words + len(line_words) > self.max_chunk_size:
+                yield "\n".join(part)
+                part, part_words = ([header], len(header.split())) if header else ([], 0)
+            part.append(line)
+            part_words += len(line_words)
+        if part and part != [header]:
+            yield "\n".join(part)
+
+
+# Read size for hashing and storing uploads
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def store_blob(source: Union[str, Path, BinaryIO], storage_dir: Path, suffix: str) -> Tuple[Path, str, int]:
+    """Stream a file into content-addressed storage, hashing it on the way.
+
+    source is a path or a readable binary stream (e.g. an upload). Every
+    byte is read once; the copy lands under a temporary name and is moved
+    into place with os.replace(), so readers never see a partial blob.
+    Returns the storage path, the content hash and the size in bytes.
+    """
+    partial_path = Path(storage_dir) / f".incoming-{uuid.uuid4().hex}"
+    hash_md5 = hashlib.md5()
+    size = 0
+    try:
+        stream = open(source, 'rb') if isinstance(source, (str, Path)) else source
+        try:
+            with open(partial_path, 'wb') as target:
+                for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b""):
+                    hash_md5.update(block)
+                    target.write(block)
+                    size += len(block)
+        finally:
+            if stream is not source:
+                stream.close()
+
+        content_hash = hash_md5.hexdigest()
+        storage_path = Path(storage_dir) / f"{content_hash}{suffix}"
+        os.replace(partial_path, storage_path)
+    except BaseException:
+        partial_path.unlink(missing_ok=True)
+        raise
+    return storage_path, content_hash, size
+
+
+class BulkExtractor:
+    """CPU-bound half of a bulk upload, run inside worker processes.
+
+    Stores and hashes each file in one pass, then extracts and chunks new
+    content; the database writes are left to FileManager.
+    """
+
+    def __init__(self, storage_dir: str, known_hashes: frozenset = frozenset(),
+                 processor: DocumentProcessor = None, chunker: DocumentChunker = None):
+        self.storage_dir = Path(storage_dir)
+        self.known_hashes = known_hashes
+        self.processor = processor or DocumentProcessor()
+        self.chunker = chunker or DocumentChunker()
+
+    def prepare(self, spec: Dict) -> Dict:
+        """Turn a file spec (path, file_id, ...) into a row ready to insert"""
+        file_path = Path(spec['path'])
+        result = {**spec, 'filename': file_path.name, 'file_size': 0}
+        try:
+            result['file_type'] = FileManager.detect_file_type(str(file_path))
+            storage_path, result['content_hash'], result['file_size'] = store_blob(
+                file_path, self.storage_dir, file_path.suffix.lower())
+            result['storage_path'] = str(storage_path)
+
+            # Already indexed content is only registered, not extracted again
+            if result['content_hash'] in self.known_hashes:
+                result['chunks'] = None
+                return result
+
+            # Results cross the process boundary, so the chunk list is built whole
+            result['chunks'] = list(self.chunker.chunk_document(self.processor, str(storage_path),
+                                                                result['file_type'], spec['file_id']))
+        except Exception as e:
+            result['error'] = str(e)
+        return result
+
+
+_bulk_extractor: Optional[BulkExtractor] = None
+
+
+def _init_bulk_worker(*args):
+    global _bulk_extractor
+    _bulk_extractor = BulkExtractor(*args)
+
+
+def _prepare_in_worker(spec: Dict) -> Dict:
+    return _bulk_extractor.prepare(spec)
 
 
 class FileManager:
     """Enhanced file management system for handling dozens of files"""
 
-    def __init__(self, storage_dir: str = "/tmp/documents", db_path: str = "/tmp/file_index.db"):
+    # Bump together with a new step in _migrate()
+    SCHEMA_VERSION = 7
+
+    # bm25() weights per index column; file_id is an opaque hash
+    SEARCH_COLUMNS = {
+        'file_search': ('file_id', 'filename', 'content', 'category', 'tags'),
+        'chunk_trigrams': ('file_id', 'filename', 'content'),
+    }
+    DEFAULT_BM25_WEIGHTS = {'filename': 2.0, 'content': 1.0, 'category': 0.5, 'tags': 1.5}
+
+    SUPPORTED_EXTENSIONS = {'.pdf', '.docx', '.xlsx', '.txt', '.md', '.html'}
+
+    # FTS5 segment merging: automerge merges this many same-level segments
+    # in the background, crisismerge forces a merge once a level holds this
+    # many. A full 'optimize' runs every OPTIMIZE_EVERY_CHUNKS indexed
+    # chunks (0 disables it).
+    FTS_AUTOMERGE = 8
+    FTS_CRISISMERGE = 16
+    OPTIMIZE_EVERY_CHUNKS = 5000
+
+    # Chunks committed per transaction while a document is still being read
+    CHUNK_WRITE_BATCH = 32
+
+    # Hybrid search: candidates taken from each ranking per result wanted,
+    # and the k of reciprocal rank fusion (1 / (k + rank))
+    HYBRID_CANDIDATES = 3
+    RRF_K = 60
+
+    # sweep_storage() refits the vectors once this share of them belong to
+    # deleted chunks
+    VECTOR_REFIT_REMOVED = 0.25
+    # Seconds a received upload is protected from the sweep while it waits
+    # to be ingested
+    PENDING_UPLOAD_TTL = 24 * 3600
+    # Seconds after which a file still unprocessed since its upload_date is
+    # taken to belong to an upload that died; sweep_storage() removes it
+    STALE_PROCESSING_AGE = 6 * 3600
+
+    def __init__(self, storage_dir: str = "/tmp/documents", db_path: str = "/tmp/file_index.db",
+                 use_stemming: bool = True, excel_max_rows: int = None,
+                 chunker: DocumentChunker = None, use_vectors: bool = True,
+                 embedder_factory: Callable[[], object] = None, text_cache_dir: str = None):
         self.storage_dir = Path(storage_dir)
         self.storage_dir.mkdir(exist_ok=True, parents=True)
         self.db_path = db_path
-        self.processor = DocumentProcessor()
-        self.chunker = DocumentChunker()
+        self.db = get_connection_manager(db_path)
+        # az_fold() is used by the search index and passage windows
+        self.db.add_connect_hook(register_sql_functions)
+        self.use_stemming = use_stemming
+        self.has_trigram_index = False
+        # Extracted text is cached next to the database, so re-chunking
+        # never has to parse the original documents again
+        self.text_cache = ExtractedTextCache(text_cache_dir or str(Path(db_path).with_suffix('.textcache')))
+        self.processor = DocumentProcessor(excel_max_rows=excel_max_rows, text_cache=self.text_cache)
+        # Any DocumentChunker works; legal documents are split by article
+        self.chunker = chunker or LegalDocumentChunker()
+        self._chunks_since_optimize = 0
+        self._maintenance_lock = threading.Lock()
+        self._change_listeners: List[Callable[[], None]] = []
+        # Dense vectors live next to the database, built on first use;
+        # embedder_factory swaps out the default TF-IDF + SVD model
+        self.use_vectors = use_vectors
+        self.embedder_factory = embedder_factory
+        self.vector_dir = Path(db_path).with_suffix('.vectors')
+        self._vector_index = None
         self.init_database()
 
+    def add_change_listener(self, callback: Callable[[], None]):
+        """Call callback() whenever documents are added or removed"""
+        self._change_listeners.append(callback)
+
+    def _notify_change(self):
+        for callback in self._change_listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Change listener failed: {e}")
+
     def init_database(self):
         """Initialize the file index database"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        conn = self.db.connection()
+        # An up-to-date database needs no DDL, so a cold start stays read-only
+        if conn.execute('PRAGMA user_version').fetchone()[0] == self.SCHEMA_VERSION:
+            self.has_trigram_index = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'chunk_trigrams'").fetchone() is not None
+            return
+
+        with self.db.transaction() as conn:
+            self._create_schema(conn.cursor())
+
+    def _create_schema(self, cursor):
+        """Create tables and indexes, then run pending migrations"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files'")
+        fresh = cursor.fetchone() is None
 
         # Files table
         cursor.execute('''
@@ -220,71 +731,452 @@ class FileManager:
                            chunk_count
                            INTEGER
                            DEFAULT
-                           0
+                           0,
+                           blob_id
+                           TEXT
                        )
                        ''')
 
         # Chunks table for large documents
-        cursor.execute('''
-                       CREATE TABLE IF NOT EXISTS chunks
+        self._create_chunks_table(cursor)
+
+        if fresh:
+            self._create_search_index(cursor)
+            self._create_trigram_index(cursor)
+            self._create_sync_manifest(cursor)
+            self._create_pending_uploads(cursor)
+            cursor.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        else:
+            self._migrate(cursor)
+
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunk_trigrams'")
+        self.has_trigram_index = cursor.fetchone() is not None
+
+        # Merge settings persist in each index's config table
+        for index in self.search_index_tables():
+            cursor.execute(f"INSERT INTO {index} ({index}, rank) VALUES ('automerge', ?)", (self.FTS_AUTOMERGE,))
+            cursor.execute(f"INSERT INTO {index} ({index}, rank) VALUES ('crisismerge', ?)", (self.FTS_CRISISMERGE,))
+
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files (content_hash)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_files_blob_id ON files (blob_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_chunks_file_id ON chunks (file_id, chunk_index)')
+
+    def _migrate(self, cursor):
+        """Upgrade an existing index database to SCHEMA_VERSION"""
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+
+        if version < 1:
+            # Content-addressed storage: every file row points at the blob
+            # (the first upload of the same content) that owns its chunks
+            columns = {row[1] for row in cursor.execute('PRAGMA table_info(files)')}
+            if 'blob_id' not in columns:
+                cursor.execute('ALTER TABLE files ADD COLUMN blob_id TEXT')
+            cursor.execute('UPDATE files SET blob_id = id WHERE blob_id IS NULL')
+
+        if version < 3:
+            # v2 gave search rows the rowid of the chunk they index, v3 moved
+            # to the Azerbaijani-folded external content index; one rebuild
+            # covers both
+            cursor.execute('DROP TABLE IF EXISTS file_search')
+            self._create_search_index(cursor)
+            self.rebuild_search_index(cursor)
+
+        if version < 4:
+            if self._create_trigram_index(cursor):
+                self.rebuild_search_index(cursor)
+
+        if version < 5:
+            # Structure labels of legal chunks; older chunks keep NULL
+            columns = {row[1] for row in cursor.execute('PRAGMA table_info(chunks)')}
+            for column in ('section', 'article'):
+                if column not in columns:
+                    cursor.execute(f'ALTER TABLE chunks ADD COLUMN {column} TEXT')
+
+        if version < 6:
+            self._create_sync_manifest(cursor)
+
+        if version < 7:
+            # The full-text and vector indexes point at chunk rowids, which
+            # VACUUM may renumber unless they are an INTEGER PRIMARY KEY;
+            # the copy keeps every rowid as it is
+            columns = [row[1] for row in cursor.execute('PRAGMA table_info(chunks)')]
+            if 'seq' not in columns:
+                cursor.execute('DROP VIEW IF EXISTS file_search_content')
+                self._create_chunks_table(cursor, 'chunks_v7')
+                cursor.execute('''
+                               INSERT INTO chunks_v7 (seq, id, file_id, chunk_index, content,
+                                                      content_preview, section, article)
+                               SELECT rowid, id, file_id, chunk_index, content,
+                                      content_preview, section, article
+                               FROM chunks
+                               ''')
+                cursor.execute('DROP TABLE chunks')
+                cursor.execute('ALTER TABLE chunks_v7 RENAME TO chunks')
+                self._create_search_index(cursor)
+            self._create_pending_uploads(cursor)
+
+        if version != self.SCHEMA_VERSION:
+            cursor.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+
+    def _create_chunks_table(self, cursor, name: str = 'chunks'):
+        """Create the chunks table.
+
+        seq is the rowid the search and vector indexes refer to; declared
+        as INTEGER PRIMARY KEY it stays the same through VACUUM.
+        """
+        cursor.execute(f'''
+                       CREATE TABLE IF NOT EXISTS {name}
                        (
-                           id
-                           TEXT
-                           PRIMARY
-                           KEY,
-                           file_id
-                           TEXT
-                           NOT
-                           NULL,
-                           chunk_index
-                           INTEGER
-                           NOT
-                           NULL,
-                           content
-                           TEXT
-                           NOT
-                           NULL,
-                           content_preview
-                           TEXT,
-                           FOREIGN
-                           KEY
+                           seq             INTEGER PRIMARY KEY,
+                           id              TEXT    NOT NULL UNIQUE,
+                           file_id         TEXT    NOT NULL REFERENCES files (id),
+                           chunk_index     INTEGER NOT NULL,
+                           content         TEXT    NOT NULL,
+                           content_preview TEXT,
+                           section         TEXT,
+                           article         TEXT
+                       )
+                       ''')
+
+    def _create_pending_uploads(self, cursor):
+        """Create the table of blobs received but not yet registered in files.
+
+        receive_upload() adds a row and upload_file() removes it once the
+        blob has its files row, so sweep_storage() leaves uploads that are
+        still waiting in the ingestion queue alone.
+        """
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS pending_uploads
                        (
-                           file_id
-                       ) REFERENCES files
+                           file_path   TEXT PRIMARY KEY,
+                           received_at REAL NOT NULL
+                       )
+                       ''')
+
+    def _create_sync_manifest(self, cursor):
+        """Create the manifest of synced source files, see sync_directory().
+
+        One row per source path: its size, mtime and content hash when it was
+        last ingested, and the files row that holds it. status is 'present',
+        or 'deleted' once the path is gone from the synced directory;
+        previous_file_id is the files row a modified file replaced.
+        """
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS sync_manifest
                        (
-                           id
+                           path             TEXT PRIMARY KEY,
+                           root             TEXT    NOT NULL,
+                           size             INTEGER NOT NULL,
+                           mtime_ns         INTEGER NOT NULL,
+                           content_hash     TEXT    NOT NULL,
+                           file_id          TEXT,
+                           previous_file_id TEXT,
+                           status           TEXT    NOT NULL DEFAULT 'present',
+                           synced_at        TEXT    NOT NULL
                        )
-                           )
                        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_sync_manifest_root ON sync_manifest (root, status)')
+
+    def _create_search_index(self, cursor):
+        """Create the full-text search table.
+
+        The index holds az_fold()ed text while the original text is read back
+        from the chunks table through file_search_content, so snippet() still
+        shows the document as written. Folding never changes token boundaries,
+        which keeps the two aligned.
+        """
+        cursor.execute('''
+            CREATE VIEW IF NOT EXISTS file_search_content AS
+            SELECT c.rowid                     as chunk_rowid,
+                   c.file_id                   as file_id,
+                   f.filename                  as filename,
+                   c.content                   as content,
+                   COALESCE(f.category, '')    as category,
+                   COALESCE(f.tags, '[]')      as tags
+            FROM chunks c
+                     JOIN files f ON f.id = c.file_id
+        ''')
 
-        # Full-text search table
         cursor.execute('''
             CREATE VIRTUAL TABLE IF NOT EXISTS file_search USING fts5(
-                file_id,
+                file_id UNINDEXED,
                 filename,
                 content,
                 category,
-                tags
+                tags,
+                content='file_search_content',
+                content_rowid='chunk_rowid',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='3 4'
             )
         ''')
 
-        conn.commit()
-        conn.close()
+    def _create_trigram_index(self, cursor) -> bool:
+        """Create the trigram index used for substring and fuzzy search.
+
+        Needs SQLite 3.34+; older builds keep using fallback_search.
+        """
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunk_trigrams USING fts5(
+                    file_id UNINDEXED,
+                    filename,
+                    content,
+                    content='file_search_content',
+                    content_rowid='chunk_rowid',
+                    tokenize='trigram'
+                )
+            ''')
+            return True
+        except Exception as e:
+            logger.warning(f"Trigram index not available: {e}")
+            return False
+
+    def rebuild_search_index(self, cursor=None):
+        """Reindex every chunk into file_search and chunk_trigrams"""
+        if cursor is None:
+            with self.db.transaction() as conn:
+                return self.rebuild_search_index(conn.cursor())
+
+        cursor.execute("INSERT INTO file_search (file_search) VALUES ('delete-all')")
+        cursor.execute('''
+                       INSERT INTO file_search (rowid, file_id, filename, content, category, tags)
+                       SELECT chunk_rowid, file_id, az_fold(filename), az_fold(content),
+                              az_fold(category), az_fold(tags)
+                       FROM file_search_content
+                       ''')
+
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunk_trigrams'")
+        if cursor.fetchone():
+            cursor.execute("INSERT INTO chunk_trigrams (chunk_trigrams) VALUES ('delete-all')")
+            cursor.execute('''
+                           INSERT INTO chunk_trigrams (rowid, file_id, filename, content)
+                           SELECT chunk_rowid, file_id, az_fold(filename), az_fold(content)
+                           FROM file_search_content
+                           ''')
+
+    def search_index_tables(self) -> List[str]:
+        """Full-text indexes present in this database"""
+        return ['file_search', 'chunk_trigrams'] if self.has_trigram_index else ['file_search']
+
+    def maintain_search_index(self, optimize: bool = False, merge_pages: int = 500) -> Dict:
+        """Merge the b-tree segments of the full-text indexes.
+
+        By default runs an incremental 'merge' of about merge_pages pages,
+        cheap enough to call between uploads; optimize=True merges every
+        segment into one, which gives the fastest queries but rewrites the
+        whole index.
+        """
+        operation = 'optimize' if optimize else 'merge'
+        started = time.perf_counter()
+        try:
+            with self._maintenance_lock, self.db.transaction() as conn:
+                for index in self.search_index_tables():
+                    if optimize:
+                        conn.execute(f"INSERT INTO {index} ({index}) VALUES ('optimize')")
+                    else:
+                        conn.execute(f"INSERT INTO {index} ({index}, rank) VALUES ('merge', ?)", (merge_pages,))
+                if optimize:
+                    self._chunks_since_optimize = 0
+        except Exception as e:
+            logger.error(f"Search index {operation} failed: {e}")
+            return {'success': False, 'error': str(e)}
+
+        elapsed = round(time.perf_counter() - started, 3)
+        logger.info(f"Search index {operation} finished in {elapsed}s")
+        return {
+            'success': True,
+            'operation': operation,
+            'indexes': self.search_index_tables(),
+            'elapsed_seconds': elapsed
+        }
+
+    def _record_indexed_chunks(self, count: int):
+        """Run the periodic optimize once enough chunks have been indexed"""
+        with self._maintenance_lock:
+            self._chunks_since_optimize += count
+            due = self.OPTIMIZE_EVERY_CHUNKS and self._chunks_since_optimize >= self.OPTIMIZE_EVERY_CHUNKS
+        if due:
+            self.maintain_search_index(optimize=True)
+
+    @property
+    def vector_index(self):
+        """The dense chunk index; NumPy is only imported once it is needed"""
+        if self._vector_index is None:
+            from vector_index import TfidfSvdEmbedder, VectorIndex
+            self._vector_index = VectorIndex(str(self.vector_dir),
+                                             self.embedder_factory or TfidfSvdEmbedder)
+        return self._vector_index
+
+    def _iter_chunk_texts(self, file_ids: List[str] = None) -> Iterator[Tuple[int, str]]:
+        """(rowid, content) of the processed chunks, of some files or all of them"""
+        query = '''
+                SELECT c.rowid, c.content
+                FROM chunks c
+                         JOIN files f ON f.id = c.file_id
+                WHERE f.processed
+                '''
+        params = []
+        if file_ids is not None:
+            query += f" AND c.file_id IN ({', '.join('?' * len(file_ids))})"
+            params = file_ids
+        cursor = self.db.connection().execute(query + ' ORDER BY c.rowid', params)
+        while True:
+            rows = cursor.fetchmany(500)
+            if not rows:
+                break
+            yield from rows
+
+    def _embed_chunks(self, file_ids: List[str]):
+        """Add newly indexed chunks to the vector index.
+
+        The embedding model is fitted once there are enough chunks and
+        refitted whenever the corpus has grown a lot since, which re-embeds
+        everything. A failure here never fails the ingest: the chunks are
+        still found by the full-text search.
+        """
+        if not self.use_vectors or not file_ids:
+            return
+        try:
+            cursor = self.db.connection().execute(
+                'SELECT COUNT(*) FROM chunks c JOIN files f ON f.id = c.file_id WHERE f.processed')
+            if self.vector_index.needs_fit(cursor.fetchone()[0]):
+                self.vector_index.fit(self._iter_chunk_texts)
+            else:
+                self.vector_index.add(self._iter_chunk_texts(file_ids))
+        except Exception as e:
+            logger.warning(f"Vector index update failed: {e}")
+
+    def rebuild_vector_index(self) -> Dict:
+        """Refit the embedding model and re-embed every chunk"""
+        try:
+            self.vector_index.fit(self._iter_chunk_texts)
+            return {'success': True, **self.vector_index.stats()}
+        except Exception as e:
+            logger.error(f"Vector index rebuild failed: {e}")
+            return {'success': False, 'error': str(e)}
+
+    def sweep_storage(self, temp_dir: str = None, min_age_seconds: float = 3600,
+                      vacuum: bool = True) -> Dict:
+        """Reclaim the space deleted and abandoned documents leave behind.
+
+        Removes blobs no files row points at, partial .incoming- uploads,
+        leftovers in temp_dir and cached text of content that is gone, then
+        merges the full-text indexes into one segment and vacuums the
+        database. Files left unprocessed for STALE_PROCESSING_AGE by an upload
+        that died are deleted with their chunks. Blobs of other unprocessed
+        files and uploads still waiting in the ingestion queue
+        (pending_uploads, for up to PENDING_UPLOAD_TTL) are kept, and so is
+        anything younger than min_age_seconds. Vectors are
+        refitted once more than VECTOR_REFIT_REMOVED of them belong to
+        deleted chunks.
+        """
+        start = time.time()
+        cutoff = start - min_age_seconds
+        with self.db.transaction() as conn:
+            # Rows left by a process that died before ingesting its upload
+            conn.execute('DELETE FROM pending_uploads WHERE received_at < ?', (start - self.PENDING_UPLOAD_TTL,))
+        stale = [file_id for file_id, in conn.execute(
+            "SELECT id FROM files WHERE NOT processed AND upload_date < datetime('now', ?)",
+            (f"-{self.STALE_PROCESSING_AGE} seconds",))]
+        stale_removed = sum(1 for file_id in stale if self.delete_file(file_id, force=True)['success'])
+        # pending_uploads first: a blob leaves it only after its files row exists
+        referenced = {Path(path).name for path, in conn.execute('SELECT file_path FROM pending_uploads')}
+        referenced.update(Path(path).name for path, in conn.execute('SELECT DISTINCT file_path FROM files'))
+        hashes = {content_hash for content_hash, in conn.execute('SELECT DISTINCT content_hash FROM files')}
+        results = {'stale_removed': stale_removed, 'blobs_removed': 0, 'temp_removed': 0, 'bytes_freed': 0}
+
+        for entry in os.scandir(self.storage_dir):
+            path = Path(entry.path)
+            abandoned = entry.name.startswith('.incoming-') or (
+                self.is_stored_blob(path) and entry.name not in referenced)
+            if abandoned and entry.is_file() and self._remove_if_older(path, cutoff, results):
+                results['blobs_removed'] += 1
+
+        if temp_dir and os.path.isdir(temp_dir):
+            # Per-upload directories are removed once they are empty
+            for dirpath, dirnames, filenames in os.walk(temp_dir, topdown=False):
+                for name in filenames:
+                    if self._remove_if_older(Path(dirpath) / name, cutoff, results):
+                        results['temp_removed'] += 1
+                if os.path.abspath(dirpath) != os.path.abspath(temp_dir):
+                    try:
+                        os.rmdir(dirpath)
+                    except OSError:
+                        pass
+
+        results['cache_removed'] = self.text_cache.prune(hashes, min_age_seconds)
+        results['vectors_refitted'] = False
+        if self.use_vectors and (self.vector_dir / 'model.npz').exists():
+            stats = self.vector_index.stats()
+            if stats['removed'] > (stats['vectors'] + stats['removed']) * self.VECTOR_REFIT_REMOVED:
+                results['vectors_refitted'] = self.rebuild_vector_index()['success']
+
+        optimized = self.maintain_search_index(optimize=True)
+        results['search_index_optimized'] = optimized['success']
+        results['vacuum'] = self.vacuum_database() if vacuum else None
+
+        elapsed = time.time() - start
+        logger.info(f"Storage sweep removed {stale_removed} stale uploads, {results['blobs_removed']} blobs, "
+                    f"{results['temp_removed']} temp files and {results['cache_removed']} cache entries "
+                    f"in {elapsed:.2f}s")
+        return {'success': True, **results, 'elapsed_seconds': round(elapsed, 3)}
+
+    @staticmethod
+    def _remove_if_older(path: Path, cutoff: float, results: Dict) -> bool:
+        try:
+            stat = path.stat()
+            if stat.st_mtime > cutoff:
+                return False
+            path.unlink()
+        except OSError:
+            return False
+        results['bytes_freed'] += stat.st_size
+        return True
+
+    def vacuum_database(self) -> Dict:
+        """Return the database's free pages to the file system.
+
+        New databases use incremental auto-vacuum, which frees pages
+        without rewriting anything. An older database is switched over the
+        first time it has free pages, with one full VACUUM. Chunk rowids are
+        an INTEGER PRIMARY KEY (chunks.seq), so neither rewrites them and the
+        full-text and vector indexes stay valid throughout.
+        """
+        with self._maintenance_lock:
+            conn = self.db.connection()
+            free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free_pages:
+                return {'mode': None, 'pages_freed': 0}
+
+            incremental = conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+            if incremental:
+                # Each step frees a page, so the statement has to run to the end
+                conn.execute('PRAGMA incremental_vacuum').fetchall()
+            else:
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+            pages_freed = free_pages - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+        logger.info(f"Vacuumed {pages_freed} pages ({'incremental' if incremental else 'full'})")
+        return {'mode': 'incremental' if incremental else 'full', 'pages_freed': pages_freed}
 
     def generate_file_id(self, filename: str) -> str:
         """Generate unique file ID"""
         timestamp = datetime.now().isoformat()
         return hashlib.md5(f"{filename}_{timestamp}".encode()).hexdigest()
 
-    def calculate_file_hash(self, file_path: str) -> str:
+    @staticmethod
+    def calculate_file_hash(file_path: str) -> str:
         """Calculate file hash for duplicate detection"""
         hash_md5 = hashlib.md5()
         with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
+            for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
                 hash_md5.update(chunk)
         return hash_md5.hexdigest()
 
-    def detect_file_type(self, file_path: str) -> str:
+    @staticmethod
+    def detect_file_type(file_path: str) -> str:
         """Detect file type based on extension and content"""
         mime_type, _ = mimetypes.guess_type(file_path)
         extension = Path(file_path).suffix.lower()
@@ -305,99 +1197,448 @@ class FileManager:
 
         return type_mapping.get(extension, 'unknown')
 
+    def find_blob(self, content_hash: str) -> Optional[Dict]:
+        """Find an already processed upload with the same content"""
+        cursor = self.db.connection().cursor()
+        cursor.execute('''
+                       SELECT blob_id, file_path, chunk_count
+                       FROM files
+                       WHERE content_hash = ?
+                         AND processed
+                       LIMIT 1
+                       ''', (content_hash,))
+        row = cursor.fetchone()
+
+        if row and os.path.exists(row[1]):
+            return {'blob_id': row[0], 'file_path': row[1], 'chunk_count': row[2]}
+        return None
+
+    def resolve_blob_id(self, cursor, file_id: str) -> str:
+        """Return the id under which a file's chunks are stored"""
+        cursor.execute('SELECT blob_id FROM files WHERE id = ?', (file_id,))
+        row = cursor.fetchone()
+        return row[0] if row and row[0] else file_id
+
     def extract_text_content(self, file_path: str, file_type: str) -> str:
         """Extract text content based on file type"""
-        extractors = {
-            'pdf': self.processor.extract_text_from_pdf,
-            'docx': self.processor.extract_text_from_docx,
-            'excel': self.processor.extract_text_from_excel,
-            'text': self.processor.extract_text_from_txt,
-            'html': self.processor.extract_text_from_html,
-            'markdown': self.processor.extract_text_from_md
-        }
-
-        extractor = extractors.get(file_type, self.processor.extract_text_from_txt)
-        return extractor(file_path)
+        return self.processor.extract_text(file_path, file_type)
 
     def upload_file(self, file_path: str, category: str = None, tags: List[str] = None,
-                    description: str = None) -> Dict:
-        """Upload and process a file"""
+                    description: str = None, file_id: str = None, filename: str = None) -> Dict:
+        """Upload and process a file
+
+        file_id may be assigned up front by callers that want to follow the
+        file's progress (the processed flag) while it is being indexed.
+        filename is the name to record when file_path is a blob already
+        placed in storage by receive_upload().
+        """
+        received = False
         try:
             file_path = Path(file_path)
             if not file_path.exists():
                 raise FileNotFoundError(f"File not found: {file_path}")
 
             # Generate file info
-            file_id = self.generate_file_id(file_path.name)
-            file_type = self.detect_file_type(str(file_path))
-            file_size = file_path.stat().st_size
-            content_hash = self.calculate_file_hash(str(file_path))
+            original = Path(filename) if filename else file_path
+            file_id = file_id or self.generate_file_id(original.name)
+            file_type = self.detect_file_type(original.name)
+
+            if self.is_stored_blob(file_path):
+                # Streamed straight into storage, named after its hash
+                storage_path = file_path
+                content_hash = file_path.stem
+                file_size = file_path.stat().st_size
+                received = True
+            else:
+                storage_path, content_hash, file_size = store_blob(file_path, self.storage_dir,
+                                                                   original.suffix.lower())
+
+            # Identical content was already processed: share its blob, chunks
+            # and search index, only the metadata row is new
+            blob = self.find_blob(content_hash)
+            if blob:
+                result = self._register_duplicate(file_id, original, file_type, file_size,
+                                                  content_hash, blob, category, tags, description)
+                # Under another suffix the copy just stored is not needed
+                self._discard_unused_blob(storage_path)
+                return result
+
+            # Register the file as unprocessed so it is visible while indexing
+            with self.db.transaction() as conn:
+                self._insert_file_row(conn.cursor(), file_id, original, storage_path, file_type,
+                                      file_size, content_hash, category, tags, description)
 
-            # Copy file to storage
-            storage_path = self.storage_dir / f"{file_id}_{file_path.name}"
-            storage_path.write_bytes(file_path.read_bytes())
+            try:
+                # Text is extracted, chunked and stored a few chunks at a time,
+                # so neither the whole text nor the write lock is held for
+                # the length of the document
+                chunk_stream = self.chunker.chunk_document(self.processor, str(storage_path),
+                                                           file_type, file_id)
+                chunk_count = 0
+                while True:
+                    batch = list(islice(chunk_stream, self.CHUNK_WRITE_BATCH))
+                    if not batch:
+                        break
+                    with self.db.transaction() as conn:
+                        self._write_chunk_rows(conn.cursor(), file_id, batch)
+                    chunk_count += len(batch)
+
+                # The chunks only become searchable together with the processed flag
+                with self.db.transaction() as conn:
+                    if not self._mark_processed(conn.cursor(), file_id, chunk_count):
+                        raise RuntimeError(f"{original.name} was deleted while it was being processed")
+                    self._index_chunks(conn.cursor(), file_id)
+            except Exception:
+                with self.db.transaction() as conn:
+                    conn.execute('DELETE FROM chunks WHERE file_id = ?', (file_id,))
+                    conn.execute('DELETE FROM files WHERE id = ?', (file_id,))
+                raise
+
+            self._record_indexed_chunks(chunk_count)
+            self._embed_chunks([file_id])
+            self._notify_change()
+
+            logger.info(f"Successfully uploaded and processed: {original.name}")
+            return {
+                'file_id': file_id,
+                'filename': original.name,
+                'file_type': file_type,
+                'chunks': chunk_count,
+                'success': True
+            }
 
-            # Extract text content
-            text_content = self.extract_text_content(str(storage_path), file_type)
+        except Exception as e:
+            logger.error(f"Error uploading file {file_path}: {e}")
+            return {'success': False, 'error': str(e)}
 
-            # Chunk large documents
-            chunks = self.chunker.chunk_text(text_content, file_id)
+        finally:
+            if received:
+                # Registered now, or left for the sweep after a failure
+                with self.db.transaction() as conn:
+                    conn.execute('DELETE FROM pending_uploads WHERE file_path = ?', (str(file_path),))
+
+    def is_stored_blob(self, file_path: Path) -> bool:
+        """Whether file_path is a content-addressed file in storage_dir"""
+        return (file_path.parent.resolve() == self.storage_dir.resolve()
+                and len(file_path.stem) == 32
+                and all(c in '0123456789abcdef' for c in file_path.stem))
+
+    def receive_upload(self, stream: BinaryIO, filename: str) -> Path:
+        """Stream an uploaded file directly into storage.
+
+        The returned blob path can be passed to upload_file() together with
+        filename, so the upload is never copied through a temp directory.
+        """
+        storage_path, _, _ = store_blob(stream, self.storage_dir, Path(filename).suffix.lower())
+        # Until upload_file() registers it, only this row keeps the sweep away
+        with self.db.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO pending_uploads (file_path, received_at) VALUES (?, ?)',
+                         (str(storage_path), time.time()))
+        return storage_path
+
+    def _insert_file_row(self, cursor, file_id: str, file_path: Path, storage_path: Path,
+                         file_type: str, file_size: int, content_hash: str, category: str = None,
+                         tags: List[str] = None, description: str = None):
+        """Insert the metadata row of a file that is about to be indexed"""
+        cursor.execute('''
+                       INSERT INTO files (id, filename, original_name, file_path, file_type,
+                                          file_size, content_hash, category, tags, description,
+                                          processed, chunk_count, blob_id)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       ''', (
+                           file_id, file_path.name, str(file_path), str(storage_path),
+                           file_type, file_size, content_hash, category,
+                           json.dumps(tags or []), description, False, 0, file_id
+                       ))
+
+    def _mark_processed(self, cursor, file_id: str, chunk_count: int) -> bool:
+        """Flag a file as fully indexed; False if its row is gone"""
+        cursor.execute('''
+                       UPDATE files
+                       SET processed   = TRUE,
+                           chunk_count = ?
+                       WHERE id = ?
+                       ''', (chunk_count, file_id))
+        return cursor.rowcount > 0
+
+    def _insert_chunks(self, cursor, file_id: str, chunks: List[Dict]):
+        """Write the chunks of a file and their search index entries"""
+        self._write_chunk_rows(cursor, file_id, chunks)
+        self._index_chunks(cursor, file_id)
+
+    def _write_chunk_rows(self, cursor, file_id: str, chunks: List[Dict]):
+        cursor.executemany('''
+                           INSERT INTO chunks (id, file_id, chunk_index, content, content_preview,
+                                               section, article)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)
+                           ''', [
+                               (chunk['chunk_id'], file_id, chunk['chunk_index'],
+                                chunk['content'], chunk['content'][:200] + "...",
+                                chunk.get('section'), chunk.get('article'))
+                               for chunk in chunks
+                           ])
+
+    def _index_chunks(self, cursor, file_id: str):
+        """Add every chunk of a file to the full-text indexes.
+
+        The file row must already exist: index rows are filled from
+        file_search_content with az_fold(), exactly like
+        rebuild_search_index(), so they can be deleted again later. Errors
+        propagate: a file is only marked processed with its index rows, or
+        _unindex_chunks() would corrupt the indexes.
+        """
+        cursor.execute('''
+                       INSERT INTO file_search (rowid, file_id, filename, content, category, tags)
+                       SELECT chunk_rowid, file_id, az_fold(filename), az_fold(content),
+                              az_fold(category), az_fold(tags)
+                       FROM file_search_content
+                       WHERE file_id = ?
+                       ''', (file_id,))
+        if self.has_trigram_index:
+            cursor.execute('''
+                           INSERT INTO chunk_trigrams (rowid, file_id, filename, content)
+                           SELECT chunk_rowid, file_id, az_fold(filename), az_fold(content)
+                           FROM file_search_content
+                           WHERE file_id = ?
+                           ''', (file_id,))
 
-            # Store in database
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+    def _unindex_chunks(self, cursor, file_id: str):
+        """Remove every chunk of a file from the full-text indexes.
 
-            # Insert file record
+        External content indexes are deleted from with the values they were
+        built from, so this must run before the chunk rows change.
+        """
+        cursor.execute('''
+                       INSERT INTO file_search (file_search, rowid, file_id, filename, content, category, tags)
+                       SELECT 'delete', chunk_rowid, file_id, az_fold(filename), az_fold(content),
+                              az_fold(category), az_fold(tags)
+                       FROM file_search_content
+                       WHERE file_id = ?
+                       ''', (file_id,))
+        if self.has_trigram_index:
             cursor.execute('''
-                           INSERT INTO files (id, filename, original_name, file_path, file_type,
-                                              file_size, content_hash, category, tags, description,
-                                              processed, chunk_count)
-                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                           ''', (
-                               file_id, file_path.name, str(file_path), str(storage_path),
-                               file_type, file_size, content_hash, category,
-                               json.dumps(tags or []), description, True, len(chunks)
-                           ))
-
-            # Insert chunks
-            for chunk in chunks:
+                           INSERT INTO chunk_trigrams (chunk_trigrams, rowid, file_id, filename, content)
+                           SELECT 'delete', chunk_rowid, file_id, az_fold(filename), az_fold(content)
+                           FROM file_search_content
+                           WHERE file_id = ?
+                           ''', (file_id,))
+
+    def rechunk_documents(self, chunker: DocumentChunker = None) -> Dict:
+        """Chunk every stored document again and reindex it.
+
+        The text comes from the extracted-text cache, so this runs at text
+        processing speed; only documents extracted before the cache existed
+        (or by an older extractor version) are parsed, once. chunker replaces
+        self.chunker, for this and later uploads, to try other settings.
+        """
+        start = time.time()
+        chunker = chunker or self.chunker
+        cursor = self.db.connection().cursor()
+        cursor.execute('''
+                       SELECT id, filename, file_path, file_type
+                       FROM files
+                       WHERE processed
+                         AND blob_id = id
+                       ORDER BY upload_date
+                       ''')
+        blobs = cursor.fetchall()
+
+        misses = self.text_cache.misses
+        results = {'files': 0, 'chunks': 0, 'failed': []}
+        for file_id, filename, file_path, file_type in blobs:
+            try:
+                chunks = list(chunker.chunk_document(self.processor, file_path, file_type, file_id))
+                # Old chunks go and new ones come in one step; duplicates share the count
+                with self.db.transaction() as conn:
+                    self._unindex_chunks(conn.cursor(), file_id)
+                    conn.execute('DELETE FROM chunks WHERE file_id = ?', (file_id,))
+                    self._insert_chunks(conn.cursor(), file_id, chunks)
+                    conn.execute('UPDATE files SET chunk_count = ? WHERE blob_id = ?', (len(chunks), file_id))
+                results['files'] += 1
+                results['chunks'] += len(chunks)
+            except Exception as e:
+                logger.error(f"Error re-chunking {filename}: {e}")
+                results['failed'].append({'file': filename, 'error': str(e)})
+
+        results['extracted'] = self.text_cache.misses - misses
+        self.chunker = chunker
+        # New chunk rows mean new rowids; the vector index is rebuilt to match
+        if self.use_vectors and (self.vector_dir / 'model.npz').exists():
+            self.rebuild_vector_index()
+        self._notify_change()
+
+        elapsed = time.time() - start
+        logger.info(f"Re-chunked {results['files']} documents into {results['chunks']} chunks "
+                    f"in {elapsed:.2f}s ({results['extracted']} parsed)")
+        return {'success': not results['failed'], **results, 'elapsed_seconds': round(elapsed, 3)}
+
+    def delete_file(self, file_id: str, force: bool = False) -> Dict:
+        """Remove a file together with its chunks and search index entries.
+
+        A duplicate only loses its metadata row. A file whose chunks other
+        rows still share hands them to the oldest of those, which is
+        reindexed under its own name and category. Otherwise the chunks,
+        their full-text rows and vectors go in the same transaction as the
+        files row, and the blob and its cached text are deleted once no row
+        refers to them any more.
+
+        A file that is still unprocessed is only deleted with force, for
+        uploads that died part way (see STALE_PROCESSING_AGE); an upload
+        that is in fact still running then fails and drops its chunks.
+        """
+        try:
+            removed_rowids = []
+            promoted = None
+            with self.db.transaction() as conn:
+                cursor = conn.cursor()
                 cursor.execute('''
-                               INSERT INTO chunks (id, file_id, chunk_index, content, content_preview)
-                               VALUES (?, ?, ?, ?, ?)
-                               ''', (
-                                   chunk['chunk_id'], file_id, chunk['chunk_index'],
-                                   chunk['content'], chunk['content'][:200] + "..."
-                               ))
-
-                # Add to search index - only for non-problematic content
-                try:
+                               SELECT filename, file_path, content_hash, blob_id, processed
+                               FROM files
+                               WHERE id = ?
+                               ''', (file_id,))
+                row = cursor.fetchone()
+                if row is None:
+                    return {'success': False, 'error': 'File not found'}
+                filename, storage_path, content_hash, blob_id, processed = row
+                # Its chunks are still being written by the upload
+                if not processed and not force:
+                    return {'success': False, 'error': 'File is still being processed'}
+
+                if blob_id == file_id:
+                    # Unprocessed chunks never reached the full-text indexes
+                    if processed:
+                        self._unindex_chunks(cursor, file_id)
                     cursor.execute('''
-                                   INSERT INTO file_search (file_id, filename, content, category, tags)
-                                   VALUES (?, ?, ?, ?, ?)
-                                   ''', (
-                                       file_id, file_path.name, chunk['content'],
-                                       category or '', json.dumps(tags or [])
-                                   ))
-                except Exception as search_error:
-                    logger.warning(f"FTS5 index error for chunk {chunk['chunk_id']}: {search_error}")
-                    # Continue without FTS5 indexing for this chunk
-
-            conn.commit()
-            conn.close()
-
-            logger.info(f"Successfully uploaded and processed: {file_path.name}")
+                                   SELECT id
+                                   FROM files
+                                   WHERE blob_id = ?
+                                     AND id != ?
+                                   ORDER BY upload_date, id
+                                   LIMIT 1
+                                   ''', (file_id, file_id))
+                    heir = cursor.fetchone()
+                    if heir:
+                        # Chunk rowids stay the same, so do their vectors
+                        promoted = heir[0]
+                        cursor.execute('UPDATE chunks SET file_id = ? WHERE file_id = ?', (promoted, file_id))
+                        cursor.execute('UPDATE files SET blob_id = ? WHERE blob_id = ?', (promoted, file_id))
+                    else:
+                        cursor.execute('SELECT rowid FROM chunks WHERE file_id = ?', (file_id,))
+                        removed_rowids = [rowid for rowid, in cursor.fetchall()]
+                        cursor.execute('DELETE FROM chunks WHERE file_id = ?', (file_id,))
+
+                cursor.execute('DELETE FROM files WHERE id = ?', (file_id,))
+                # A path still in a synced directory is ingested again next time
+                cursor.execute("DELETE FROM sync_manifest WHERE file_id = ? AND status = 'present'", (file_id,))
+                if promoted:
+                    self._index_chunks(cursor, promoted)
+                # Before the commit, while no upload can take over the freed rowids
+                self._forget_vectors(removed_rowids)
+
+                cursor.execute('SELECT 1 FROM files WHERE file_path = ? LIMIT 1', (storage_path,))
+                blob_orphaned = cursor.fetchone() is None
+                cursor.execute('SELECT 1 FROM files WHERE content_hash = ? LIMIT 1', (content_hash,))
+                hash_orphaned = cursor.fetchone() is None
+
+            if blob_orphaned and self.is_stored_blob(Path(storage_path)):
+                Path(storage_path).unlink(missing_ok=True)
+            if hash_orphaned:
+                self.text_cache.remove(content_hash)
+            self._notify_change()
+
+            logger.info(f"Deleted {filename} ({len(removed_rowids)} chunks)")
             return {
+                'success': True,
                 'file_id': file_id,
-                'filename': file_path.name,
-                'file_type': file_type,
-                'chunks': len(chunks),
-                'success': True
+                'filename': filename,
+                'chunks_removed': len(removed_rowids),
+                'promoted': promoted,
+                'blob_removed': blob_orphaned
             }
 
         except Exception as e:
-            logger.error(f"Error uploading file {file_path}: {e}")
+            logger.error(f"Error deleting file {file_id}: {e}")
             return {'success': False, 'error': str(e)}
 
+    def replace_file(self, file_id: str, file_path: str, filename: str = None,
+                     new_file_id: str = None) -> Dict:
+        """Upload a new version of a file, then delete the old one.
+
+        The new version gets a new file_id (new_file_id, if given) but keeps
+        the category, tags and description. The old version stays searchable
+        until the new one is indexed, and is kept if the upload fails.
+        """
+        cursor = self.db.connection().execute(
+            'SELECT category, tags, description, processed FROM files WHERE id = ?', (file_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return {'success': False, 'error': 'File not found'}
+        if not row[3]:
+            return {'success': False, 'error': 'File is still being processed'}
+
+        result = self.upload_file(file_path, category=row[0], tags=json.loads(row[1] or '[]'),
+                                  description=row[2], file_id=new_file_id, filename=filename)
+        if not result['success']:
+            return result
+
+        removed = self.delete_file(file_id)
+        if not removed['success']:
+            logger.warning(f"Old version {file_id} was not deleted: {removed['error']}")
+        return {**result, 'replaced': file_id, 'old_version_deleted': removed['success']}
+
+    def _forget_vectors(self, chunk_rowids: List[int]):
+        """Drop deleted chunks from the vector index, if there is one"""
+        if not self.use_vectors or not chunk_rowids or not (self.vector_dir / 'model.npz').exists():
+            return
+        try:
+            self.vector_index.remove(chunk_rowids)
+        except Exception as e:
+            logger.warning(f"Vector index update failed: {e}")
+
+    def _register_duplicate(self, file_id: str, file_path: Path, file_type: str, file_size: int,
+                            content_hash: str, blob: Dict, category: str = None,
+                            tags: List[str] = None, description: str = None) -> Dict:
+        """Add a metadata row for a file whose content is already indexed"""
+        with self.db.transaction() as conn:
+            self._insert_duplicate_row(conn.cursor(), file_id, file_path, file_type, file_size,
+                                       content_hash, blob, category, tags, description)
+        self._notify_change()
+
+        logger.info(f"Duplicate content, reused existing blob for: {file_path.name}")
+        return {
+            'file_id': file_id,
+            'filename': file_path.name,
+            'file_type': file_type,
+            'chunks': blob['chunk_count'],
+            'duplicate_of': blob['blob_id'],
+            'success': True
+        }
+
+    def _discard_unused_blob(self, storage_path: Path):
+        """Delete a stored blob no files row refers to, e.g. a second copy of known content"""
+        with self.db.transaction() as conn:
+            conn.execute('DELETE FROM pending_uploads WHERE file_path = ?', (str(storage_path),))
+            in_use = conn.execute('SELECT 1 FROM files WHERE file_path = ? LIMIT 1',
+                                  (str(storage_path),)).fetchone() is not None
+            if not in_use:
+                Path(storage_path).unlink(missing_ok=True)
+
+    def _insert_duplicate_row(self, cursor, file_id: str, file_path: Path, file_type: str,
+                              file_size: int, content_hash: str, blob: Dict, category: str = None,
+                              tags: List[str] = None, description: str = None):
+        """Insert a processed metadata row pointing at an existing blob"""
+        cursor.execute('''
+                       INSERT INTO files (id, filename, original_name, file_path, file_type,
+                                          file_size, content_hash, category, tags, description,
+                                          processed, chunk_count, blob_id)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                       ''', (
+                           file_id, file_path.name, str(file_path), blob['file_path'],
+                           file_type, file_size, content_hash, category,
+                           json.dumps(tags or []), description, True, blob['chunk_count'],
+                           blob['blob_id']
+                       ))
+
     def clean_search_query(self, query: str) -> str:
         """Clean search query to avoid FTS5 syntax errors"""
         import re
@@ -426,10 +1667,21 @@ class FileManager:
 
         return ' '.join(cleaned_words) if cleaned_words else query
 
+    def match_terms(self, query: str) -> List[str]:
+        """Quoted FTS5 terms for query; empty if the token index can't serve it"""
+        return fts_terms(query, use_stemming=self.use_stemming)
+
+    def passage_anchor(self, query: str) -> Optional[str]:
+        """Folded stem of the longest query word, used to place passage windows"""
+        tokens = tokenize(query)
+        if not tokens:
+            return None
+        anchor = max(tokens, key=len)
+        return stem(anchor) if self.use_stemming else anchor
+
     def fallback_search(self, query: str, category: str = None, file_type: str = None) -> List[Dict]:
         """Fallback search using simple LIKE queries"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self.db.connection().cursor()
 
         try:
             search_query = """
@@ -471,94 +1723,349 @@ class FileManager:
                     'snippet': row[6] if row[6] else ""
                 })
 
-            conn.close()
             return search_results
 
         except Exception as e:
             logger.error(f"Fallback search error: {e}")
-            conn.close()
             return []
 
     def search_files(self, query: str, category: str = None, file_type: str = None) -> List[Dict]:
-        """Search through all files and their content - FIXED VERSION"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Search through all files and their content.
 
+        The folded token index answers first; substrings, partial numbers and
+        misspellings go to the trigram index; a LIKE scan is only left for
+        queries too short for either.
+        """
         try:
-            # Clean the query to avoid FTS5 syntax errors
-            cleaned_query = self.clean_search_query(query)
+            # Folded, quoted terms never trip over FTS5 syntax
+            terms = self.match_terms(query)
+            if terms:
+                results = self._search_index('file_search', ' '.join(terms), category, file_type)
+                if results:
+                    return results
+
+            trigram_matches = trigram_queries(query) if self.has_trigram_index else []
+            for match, fuzzy_word in trigram_matches:
+                # Overlapping trigram hits of the fuzzy query garble snippet()
+                results = self._search_index('chunk_trigrams', match, category, file_type,
+                                             highlight=fuzzy_word is None, fuzzy_word=fuzzy_word)
+                if results:
+                    return results
+            if trigram_matches:
+                # A LIKE scan can't find what the substring index didn't
+                return []
 
-            if not cleaned_query.strip():
-                return self.fallback_search(query, category, file_type)
+            return self.fallback_search(query, category, file_type)
 
-            # Check if query contains Azerbaijani characters or problematic symbols
-            has_azerbaijani = any(char in query for char in ['ə', 'ı', 'ö', 'ü', 'ğ', 'ş', 'ç'])
-            has_special_chars = any(char in query for char in ['"', "'", '?', '(', ')', '[', ']'])
+        except Exception as e:
+            logger.warning(f"FTS5 search failed: {e}, falling back to LIKE search")
+            return self.fallback_search(query, category, file_type)
 
-            if has_azerbaijani or has_special_chars:
-                # Use LIKE search for Azerbaijani or special characters
-                return self.fallback_search(query, category, file_type)
+    def _search_index(self, index: str, match: str, category: str = None,
+                      file_type: str = None, highlight: bool = True,
+                      fuzzy_word: str = None) -> List[Dict]:
+        """Run a MATCH against one full-text index, one row per file
+
+        fuzzy_word keeps only chunks with enough of its trigrams, see
+        text_normalizer.trigram_queries().
+        """
+        cursor = self.db.connection().cursor()
+        if highlight:
+            snippet = f"snippet({index}, 2, '<mark>', '</mark>', '...', 32)"
+        else:
+            snippet = "SUBSTR(c.content, 1, 300)"
+
+        search_query = f"""
+                       SELECT f.id, \
+                              f.filename, \
+                              f.file_type, \
+                              f.category, \
+                              f.description,
+                              f.chunk_count, \
+                              {snippet} as snippet,
+                              {index}.rank as score
+                       FROM {index}
+                                JOIN chunks c ON c.rowid = {index}.rowid
+                                JOIN files f ON f.id = c.file_id
+                       WHERE {index} MATCH ? \
+                       """
+        params = [match]
+
+        if fuzzy_word:
+            search_query += " AND az_trigram_hits(f.filename || ' ' || c.content, ?) >= ?"
+            params.extend([fuzzy_word, fuzzy_min_hits(fuzzy_word)])
+
+        # Add category filter if specified
+        if category:
+            search_query += " AND f.category = ?"
+            params.append(category)
+
+        # Add file type filter if specified
+        if file_type:
+            search_query += " AND f.file_type = ?"
+            params.append(file_type)
+
+        # One row per file, represented by its best ranked chunk
+        search_query = f"""
+                       SELECT id, filename, file_type, category, description, chunk_count, snippet
+                       FROM (
+                           SELECT *, ROW_NUMBER() OVER (PARTITION BY id ORDER BY score) as position
+                           FROM ({search_query})
+                       )
+                       WHERE position = 1
+                       ORDER BY score
+                       LIMIT 20
+                       """
 
-            # Try FTS5 search for simple queries
-            try:
-                search_query = """
-                               SELECT DISTINCT f.id, \
-                                               f.filename, \
-                                               f.file_type, \
-                                               f.category, \
-                                               f.description,
-                                               f.chunk_count, \
-                                               snippet(file_search, 2, '<mark>', '</mark>', '...', 32) as snippet
-                               FROM files f
-                                        JOIN file_search fs ON f.id = fs.file_id
-                               WHERE file_search MATCH ? \
-                               """
-                params = [cleaned_query]
-
-                # Add category filter if specified
-                if category:
-                    search_query += " AND f.category = ?"
-                    params.append(category)
-
-                # Add file type filter if specified
-                if file_type:
-                    search_query += " AND f.file_type = ?"
-                    params.append(file_type)
-
-                search_query += " ORDER BY f.upload_date DESC LIMIT 20"
-
-                cursor.execute(search_query, params)
-                results = cursor.fetchall()
-
-                search_results = []
-                for row in results:
-                    search_results.append({
-                        'file_id': row[0],
-                        'filename': row[1],
-                        'file_type': row[2],
-                        'category': row[3],
-                        'description': row[4],
-                        'chunk_count': row[5],
-                        'snippet': row[6] if row[6] else ""
-                    })
-
-                conn.close()
-                return search_results
-
-            except Exception as fts_error:
-                logger.warning(f"FTS5 search failed: {fts_error}, falling back to LIKE search")
-                conn.close()
-                return self.fallback_search(query, category, file_type)
+        cursor.execute(search_query, params)
+
+        search_results = []
+        for row in cursor.fetchall():
+            search_results.append({
+                'file_id': row[0],
+                'filename': row[1],
+                'file_type': row[2],
+                'category': row[3],
+                'description': row[4],
+                'chunk_count': row[5],
+                'snippet': row[6] if row[6] else ""
+            })
 
+        return search_results
+
+    def search_chunks(self, query: str, top_k: int = 10, weights: Dict[str, float] = None,
+                      max_per_file: int = 2, category: str = None, file_type: str = None,
+                      passage_length: int = 1000, hybrid: bool = None) -> List[Dict]:
+        """Return the top_k chunks ranked by FTS5 bm25().
+
+        weights overrides DEFAULT_BM25_WEIGHTS per column (filename, content,
+        category, tags); max_per_file caps how many chunks a single file may
+        contribute so one long document can't crowd out the rest. Queries the
+        token index can't answer are ranked on the trigram index instead.
+
+        With hybrid (the default when use_vectors is set and the vector index
+        is built) the bm25 ranking is fused with the vector index's by
+        reciprocal rank, so chunks that say the same thing in other words are
+        found too; score is then the fused score.
+        """
+        hybrid = self.use_vectors if hybrid is None else hybrid
+        # Each ranking contributes more candidates than are returned
+        candidates = top_k * self.HYBRID_CANDIDATES if hybrid else top_k
+        bm25_results = self._bm25_chunks(query, candidates, weights, max_per_file, category,
+                                         file_type, passage_length)
+        if not hybrid:
+            return bm25_results
+
+        try:
+            dense_results = self._dense_chunks(query, candidates, category, file_type, passage_length)
         except Exception as e:
-            logger.error(f"Search error: {e}")
-            conn.close()
-            return self.fallback_search(query, category, file_type)
+            logger.error(f"Vector search error: {e}")
+            dense_results = []
+        if not dense_results:
+            return bm25_results[:top_k]
+        return self.fuse_rankings([bm25_results, dense_results], top_k, max_per_file, self.RRF_K)
+
+    @staticmethod
+    def fuse_rankings(rankings: List[List[Dict]], top_k: int, max_per_file: int,
+                      k: int = 60) -> List[Dict]:
+        """Reciprocal rank fusion of chunk rankings.
+
+        A chunk scores the sum of 1 / (k + rank) over the rankings it is in,
+        so agreeing rankings reinforce each other without their raw scores
+        having to be comparable. The first ranking's copy of a chunk (and its
+        passage) is kept.
+        """
+        fused = {}
+        for ranking in rankings:
+            for rank, result in enumerate(ranking, start=1):
+                entry = fused.setdefault(result['chunk_id'], {**result, 'score': 0.0})
+                entry['score'] += 1.0 / (k + rank)
+
+        results = []
+        per_file = {}
+        for entry in sorted(fused.values(), key=lambda item: item['score'], reverse=True):
+            if per_file.get(entry['file_id'], 0) >= max_per_file:
+                continue
+            per_file[entry['file_id']] = per_file.get(entry['file_id'], 0) + 1
+            results.append(entry)
+            if len(results) == top_k:
+                break
+        return results
+
+    def _bm25_chunks(self, query: str, top_k: int, weights: Dict[str, float] = None,
+                     max_per_file: int = 2, category: str = None, file_type: str = None,
+                     passage_length: int = 1000) -> List[Dict]:
+        """Chunks ranked by the first full-text index that finds any"""
+        searches = []
+        terms = self.match_terms(query)
+        if terms:
+            # Any term may match; bm25 rewards chunks that match more of them
+            searches.append(('file_search', ' OR '.join(terms), None))
+        if self.has_trigram_index:
+            searches.extend(('chunk_trigrams', match, fuzzy_word)
+                            for match, fuzzy_word in trigram_queries(query))
+
+        column_weights = {**self.DEFAULT_BM25_WEIGHTS, **(weights or {})}
+        # Passages are centred on the longest (usually most specific) term
+        anchor = self.passage_anchor(query) or ''
+
+        for index, match, fuzzy_word in searches:
+            bm25_args = [column_weights.get(column, 0.0) for column in self.SEARCH_COLUMNS[index]]
+            try:
+                results = self._rank_chunks(index, match, bm25_args, anchor, top_k, max_per_file,
+                                            category, file_type, passage_length, fuzzy_word)
+            except Exception as e:
+                logger.error(f"Chunk search error: {e}")
+                continue
+            if results:
+                return results
+        return []
+
+    def _rank_chunks(self, index: str, match: str, bm25_args: List[float], anchor: str, top_k: int,
+                     max_per_file: int, category: str = None, file_type: str = None,
+                     passage_length: int = 1000, fuzzy_word: str = None) -> List[Dict]:
+        """Top chunks of one full-text index with a passage window each"""
+        score = f"bm25({index}, {', '.join('?' * len(bm25_args))})"
+        source = f"""
+                 SELECT f.id as file_id, f.filename, f.file_type, f.category, f.description,
+                        c.id as chunk_id, c.chunk_index, c.content, c.article, c.section,
+                        {score} as score
+                 FROM {index}
+                          JOIN chunks c ON c.rowid = {index}.rowid
+                          JOIN files f ON f.id = c.file_id
+                 WHERE {index} MATCH ?
+                 """
+        params = [*bm25_args, match]
+
+        if fuzzy_word:
+            source += " AND az_trigram_hits(f.filename || ' ' || c.content, ?) >= ?"
+            params.extend([fuzzy_word, fuzzy_min_hits(fuzzy_word)])
+
+        if category:
+            source += " AND f.category = ?"
+            params.append(category)
+
+        if file_type:
+            source += " AND f.file_type = ?"
+            params.append(file_type)
+
+        # Passage windows are only cut for the chunks that make the cut
+        search_query = f"""
+                       SELECT file_id, filename, file_type, category, description, chunk_id, chunk_index,
+                              score, offset, SUBSTR(content, MAX(offset - ?, 0) + 1, ?) as passage,
+                              article, section
+                       FROM (
+                           SELECT *, INSTR(az_fold(content), ?) - 1 as offset
+                           FROM (
+                               SELECT *, ROW_NUMBER() OVER (PARTITION BY file_id ORDER BY score, chunk_index) as position
+                               FROM ({source})
+                           )
+                           WHERE position <= ?
+                           ORDER BY score, chunk_index
+                           LIMIT ?
+                       )
+                       ORDER BY score, chunk_index
+                       """
+        params = [passage_length // 4, passage_length, anchor, *params, max_per_file, top_k]
+
+        cursor = self.db.connection().cursor()
+        cursor.execute(search_query, params)
+
+        results = []
+        for row in cursor.fetchall():
+            results.append({
+                'file_id': row[0],
+                'filename': row[1],
+                'file_type': row[2],
+                'category': row[3],
+                'description': row[4],
+                'chunk_id': row[5],
+                'chunk_index': row[6],
+                # bm25() is lower-is-better; expose it as higher-is-better
+                'score': -row[7],
+                'offset': row[8],
+                'passage': row[9] or "",
+                'article': row[10],
+                'section': row[11]
+            })
+        return results
+
+    def _dense_chunks(self, query: str, top_k: int, category: str = None, file_type: str = None,
+                      passage_length: int = 1000) -> List[Dict]:
+        """Chunks nearest to the query in the vector index, with passage windows"""
+        # Nothing to search before the model is first fitted, so don't load NumPy
+        if not (self.vector_dir / 'model.npz').exists():
+            return []
+        # Filtered-out chunks still take places in the vector ranking
+        hits = self.vector_index.search(query, top_k * 4 if category or file_type else top_k)
+        if not hits:
+            return []
 
-    def get_file_content(self, file_id: str, chunk_index: int = None) -> Dict:
-        """Get file content, optionally specific chunk"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        source = f"""
+                 SELECT f.id as file_id, f.filename, f.file_type, f.category, f.description,
+                        c.id as chunk_id, c.chunk_index, c.content, c.article, c.section, c.rowid as chunk_rowid
+                 FROM chunks c
+                          JOIN files f ON f.id = c.file_id
+                 WHERE c.rowid IN ({', '.join('?' * len(hits))}) AND f.processed
+                 """
+        params = [rowid for rowid, _ in hits]
+
+        if category:
+            source += " AND f.category = ?"
+            params.append(category)
+
+        if file_type:
+            source += " AND f.file_type = ?"
+            params.append(file_type)
+
+        search_query = f"""
+                       SELECT file_id, filename, file_type, category, description, chunk_id, chunk_index,
+                              chunk_rowid, offset, SUBSTR(content, MAX(offset - ?, 0) + 1, ?) as passage,
+                              article, section
+                       FROM (
+                           SELECT *, INSTR(az_fold(content), ?) - 1 as offset
+                           FROM ({source})
+                       )
+                       """
+        params = [passage_length // 4, passage_length, self.passage_anchor(query) or '', *params]
+
+        cursor = self.db.connection().cursor()
+        cursor.execute(search_query, params)
+        rows = {row[7]: row for row in cursor.fetchall()}
+
+        results = []
+        for rowid, similarity in hits:
+            row = rows.get(rowid)
+            if row is None:
+                continue
+            results.append({
+                'file_id': row[0],
+                'filename': row[1],
+                'file_type': row[2],
+                'category': row[3],
+                'description': row[4],
+                'chunk_id': row[5],
+                'chunk_index': row[6],
+                'score': similarity,
+                'offset': row[8],
+                'passage': row[9] or "",
+                'article': row[10],
+                'section': row[11]
+            })
+            if len(results) == top_k:
+                break
+        return results
+
+    def get_file_content(self, file_id: str, chunk_index: int = None, max_chars: int = None) -> Dict:
+        """Get file content, optionally specific chunk
+
+        max_chars reads chunks in order only until that much text is
+        collected, so a prefix of a long document never loads all of it.
+        """
+        cursor = self.db.connection().cursor()
+
+        # Duplicates share the chunks of the blob they point at
+        blob_id = self.resolve_blob_id(cursor, file_id)
 
         if chunk_index is not None:
             cursor.execute('''
@@ -566,7 +2073,7 @@ class FileManager:
                            FROM chunks
                            WHERE file_id = ?
                              AND chunk_index = ?
-                           ''', (file_id, chunk_index))
+                           ''', (blob_id, chunk_index))
             result = cursor.fetchone()
             content = result[0] if result else ""
         else:
@@ -575,9 +2082,17 @@ class FileManager:
                            FROM chunks
                            WHERE file_id = ?
                            ORDER BY chunk_index
-                           ''', (file_id,))
-            chunks = cursor.fetchall()
-            content = "\n\n".join([chunk[0] for chunk in chunks])
+                           ''', (blob_id,))
+            parts = []
+            length = 0
+            for chunk, in cursor:
+                parts.append(chunk)
+                length += len(chunk) + 2
+                if max_chars is not None and length >= max_chars:
+                    break
+            content = "\n\n".join(parts)
+            if max_chars is not None:
+                content = content[:max_chars]
 
         # Get file info
         cursor.execute('''
@@ -587,8 +2102,6 @@ class FileManager:
                        ''', (file_id,))
         file_info = cursor.fetchone()
 
-        conn.close()
-
         if file_info:
             return {
                 'content': content,
@@ -602,8 +2115,7 @@ class FileManager:
 
     def list_files(self, category: str = None) -> List[Dict]:
         """List all uploaded files"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self.db.connection().cursor()
 
         if category:
             cursor.execute('''
@@ -614,7 +2126,8 @@ class FileManager:
                                   category,
                                   description,
                                   upload_date,
-                                  chunk_count
+                                  chunk_count,
+                                  processed
                            FROM files
                            WHERE category = ?
                            ORDER BY upload_date DESC
@@ -628,7 +2141,8 @@ class FileManager:
                                   category,
                                   description,
                                   upload_date,
-                                  chunk_count
+                                  chunk_count,
+                                  processed
                            FROM files
                            ORDER BY upload_date DESC
                            ''')
@@ -643,32 +2157,372 @@ class FileManager:
                 'category': row[4],
                 'description': row[5],
                 'upload_date': row[6],
-                'chunk_count': row[7]
+                'chunk_count': row[7],
+                'processed': bool(row[8])
             })
 
-        conn.close()
         return files
 
-    def bulk_upload(self, directory_path: str, category: str = None) -> Dict:
+    def list_stored_files(self) -> List[Tuple[str, Optional[str], str]]:
+        """(filename, category, storage path) of every file, for archives"""
+        cursor = self.db.connection().execute('''
+                                              SELECT filename, category, file_path
+                                              FROM files
+                                              ORDER BY category, filename
+                                              ''')
+        return cursor.fetchall()
+
+    def get_processing_status(self, file_ids: List[str]) -> Dict[str, Dict]:
+        """Return the processed flag and chunk count of the given files"""
+        if not file_ids:
+            return {}
+
+        cursor = self.db.connection().cursor()
+        placeholders = ','.join('?' * len(file_ids))
+        cursor.execute(f'''
+                       SELECT id, processed, chunk_count
+                       FROM files
+                       WHERE id IN ({placeholders})
+                       ''', list(file_ids))
+        return {row[0]: {'processed': bool(row[1]), 'chunk_count': row[2]} for row in cursor.fetchall()}
+
+    def iter_supported_files(self, directory: Path):
+        """Yield every file under directory with a supported extension"""
+        for file_path in Path(directory).rglob('*'):
+            if file_path.is_file() and file_path.suffix.lower() in self.SUPPORTED_EXTENSIONS:
+                yield file_path
+
+    def bulk_upload(self, directory_path: str, category: str = None, workers: int = None,
+                    batch_size: int = 100) -> Dict:
         """Upload all files from a directory"""
         directory = Path(directory_path)
         if not directory.exists():
             return {'error': 'Directory not found'}
 
+        files = [{'path': str(file_path), 'category': category}
+                 for file_path in self.iter_supported_files(directory)]
+        return self.ingest_files(files, workers=workers, batch_size=batch_size)
+
+    def sync_directory(self, directory_path: str, category: str = None, workers: int = None,
+                       batch_size: int = 100) -> Dict:
+        """Bring the index in line with a directory, ingesting only what changed.
+
+        Unlike bulk_upload(), files already ingested by an earlier sync are
+        skipped when their size and mtime are unchanged, so a nightly sync
+        of a large tree mostly costs one stat per file.
+        """
+        plan = self.plan_sync(directory_path, category)
+        if 'error' in plan:
+            return plan
+        return self.apply_sync(plan, workers=workers, batch_size=batch_size)
+
+    def _scan_tree(self, directory: Path) -> Iterator[Tuple[str, os.stat_result]]:
+        """(path, stat) of every supported file under directory, one stat call each"""
+        pending = [str(directory)]
+        while pending:
+            try:
+                entries = os.scandir(pending.pop())
+            except OSError as e:
+                logger.warning(f"Cannot scan directory: {e}")
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                        elif (os.path.splitext(entry.name)[1].lower() in self.SUPPORTED_EXTENSIONS
+                              and entry.is_file()):
+                            yield entry.path, entry.stat()
+                    except OSError as e:
+                        logger.warning(f"Cannot stat {entry.path}: {e}")
+
+    def plan_sync(self, directory_path: str, category: str = None) -> Dict:
+        """Compare a directory with its sync manifest, without ingesting anything.
+
+        A file whose size and mtime match the manifest is unchanged. Any
+        other file is hashed: the same hash only refreshes its manifest row
+        ('touched'), a file ingested earlier by bulk_upload() from the same
+        path is taken over as is ('adopted'), everything else is queued in
+        'ingest'. Manifest paths no longer on disk are listed in 'deleted'.
+        Ingest items may be given a 'file_id' before apply_sync().
+        """
+        root = Path(directory_path).resolve()
+        if not root.is_dir():
+            return {'error': 'Directory not found'}
+
+        started = time.perf_counter()
+        conn = self.db.connection()
+        rows = conn.execute('''
+                            SELECT path, size, mtime_ns, content_hash, file_id, status
+                            FROM sync_manifest
+                            WHERE root = ?
+                            ''', (str(root),)).fetchall()
+        manifest = {row[0]: row[1:] for row in rows}
+        plan = {'root': str(root), 'category': category, 'started': started, 'scanned': 0,
+                'unchanged': 0, 'touched': [], 'adopted': [], 'ingest': [], 'deleted': []}
+        seen = set()
+
+        for path, stat in self._scan_tree(root):
+            plan['scanned'] += 1
+            seen.add(path)
+            known = manifest.get(path)
+            present = known is not None and known[4] == 'present'
+            if present and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+                plan['unchanged'] += 1
+                continue
+
+            item = {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                    'content_hash': self.calculate_file_hash(path)}
+            if present and known[2] == item['content_hash']:
+                plan['touched'].append({**item, 'file_id': known[3]})
+                continue
+            if known is None:
+                # Rows from before paths were stored resolved are resolved here
+                candidates = conn.execute('''
+                                          SELECT id, original_name
+                                          FROM files
+                                          WHERE content_hash = ?
+                                            AND processed
+                                          ''', (item['content_hash'],)).fetchall()
+                adopted = next((file_id for file_id, original_name in candidates
+                                if original_name == path or str(Path(original_name).resolve()) == path),
+                               None)
+                if adopted:
+                    plan['adopted'].append({**item, 'file_id': adopted})
+                    continue
+            plan['ingest'].append({**item, 'file_id': None,
+                                   'previous_file_id': known[3] if present else None})
+
+        plan['deleted'] = [path for path, known in manifest.items()
+                           if known[4] == 'present' and path not in seen]
+        return plan
+
+    def apply_sync(self, plan: Dict, workers: int = None, batch_size: int = 100,
+                   on_result: Callable[[Dict], None] = None) -> Dict:
+        """Ingest a plan_sync() plan and record the outcome in the manifest.
+
+        Files that fail to ingest keep their old manifest row, so the next
+        sync tries them again. Once a modified file is ingested its previous
+        version is deleted, and so are the files of deleted paths, whose
+        manifest rows are kept and marked 'deleted'.
+        """
+        for item in plan['ingest']:
+            item['file_id'] = item['file_id'] or self.generate_file_id(item['path'])
+        pending = {item['file_id']: item for item in plan['ingest']}
+        ingested = []
+
+        def record(outcome: Dict):
+            if outcome['success']:
+                ingested.append(pending[outcome['file_id']])
+            if on_result:
+                on_result(outcome)
+
+        ingest_result = None
+        if plan['ingest']:
+            specs = [{'path': item['path'], 'category': plan['category'], 'file_id': item['file_id']}
+                     for item in plan['ingest']]
+            ingest_result = self.ingest_files(specs, workers=workers, batch_size=batch_size,
+                                              on_result=record)
+
+        synced_at = datetime.now().isoformat()
+        with self.db.transaction() as conn:
+            conn.executemany('''
+                             INSERT INTO sync_manifest (path, root, size, mtime_ns, content_hash, file_id,
+                                                        previous_file_id, status, synced_at)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, 'present', ?)
+                             ON CONFLICT (path) DO UPDATE SET size             = excluded.size,
+                                                              mtime_ns         = excluded.mtime_ns,
+                                                              content_hash     = excluded.content_hash,
+                                                              file_id          = excluded.file_id,
+                                                              previous_file_id = COALESCE(excluded.previous_file_id,
+                                                                                          previous_file_id),
+                                                              status           = 'present',
+                                                              synced_at        = excluded.synced_at
+                             ''', [
+                                 (item['path'], plan['root'], item['size'], item['mtime_ns'],
+                                  item['content_hash'], item['file_id'], item.get('previous_file_id'),
+                                  synced_at)
+                                 for item in plan['touched'] + plan['adopted'] + ingested
+                             ])
+            conn.executemany('''
+                             UPDATE sync_manifest
+                             SET status    = 'deleted',
+                                 synced_at = ?
+                             WHERE path = ?
+                             ''', [(synced_at, path) for path in plan['deleted']])
+            stale = [item['previous_file_id'] for item in ingested if item['previous_file_id']]
+            for path in plan['deleted']:
+                row = conn.execute('SELECT file_id FROM sync_manifest WHERE path = ?', (path,)).fetchone()
+                if row and row[0]:
+                    stale.append(row[0])
+
+        removed = sum(1 for file_id in stale if self.delete_file(file_id)['success'])
+        modified = sum(1 for item in ingested if item['previous_file_id'])
+        elapsed = time.perf_counter() - plan['started']
+        logger.info(f"Synced {plan['root']}: {plan['scanned']} files, {len(ingested)} ingested, "
+                    f"{len(plan['deleted'])} deleted in {elapsed:.2f}s")
+        return {
+            'success': len(ingested) == len(plan['ingest']),
+            'scanned': plan['scanned'],
+            'unchanged': plan['unchanged'] + len(plan['touched']) + len(plan['adopted']),
+            'new': len(ingested) - modified,
+            'modified': modified,
+            'deleted': len(plan['deleted']),
+            'removed': removed,
+            'failed': len(plan['ingest']) - len(ingested),
+            'elapsed_seconds': round(elapsed, 3),
+            'ingest': ingest_result
+        }
+
+    def ingest_files(self, files: List[Dict], workers: int = None, batch_size: int = 100,
+                     on_result: Callable[[Dict], None] = None) -> Dict:
+        """Ingest many files with extraction fanned out to a process pool.
+
+        Each spec needs a 'path' and may carry 'file_id', 'category', 'tags'
+        and 'description'. Workers hash, store, extract and chunk; this
+        process is the only writer and commits batch_size files per
+        transaction. workers defaults to the CPU count, 1 runs everything
+        in-process. on_result is called with the result of every file.
+        Paths are recorded resolved, as plan_sync() compares them.
+        """
+        workers = workers or os.cpu_count() or 1
+        specs = [{**spec, 'path': str(Path(spec['path']).resolve()),
+                  'file_id': spec.get('file_id') or self.generate_file_id(spec['path'])}
+                 for spec in files]
         results = {'successful': [], 'failed': []}
-        supported_extensions = {'.pdf', '.docx', '.xlsx', '.txt', '.md', '.html'}
+        total_bytes = 0
+        started = time.perf_counter()
+
+        extractor_args = (str(self.storage_dir), self._processed_hashes(), self.processor, self.chunker)
+        if workers > 1 and len(specs) > 1:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_bulk_worker,
+                                           initargs=extractor_args)
+            prepared_files = self._prepare_in_pool(executor, specs, workers * 4)
+        else:
+            executor = None
+            prepared_files = map(BulkExtractor(*extractor_args).prepare, specs)
 
-        for file_path in directory.rglob('*'):
-            if file_path.is_file() and file_path.suffix.lower() in supported_extensions:
-                result = self.upload_file(str(file_path), category=category)
-                if result.get('success'):
-                    results['successful'].append(result)
-                else:
-                    results['failed'].append({'file': str(file_path), 'error': result.get('error')})
+        try:
+            batch = []
+            for prepared in prepared_files:
+                total_bytes += prepared['file_size']
+                batch.append(prepared)
+                if len(batch) >= batch_size:
+                    self._write_batch(batch, results, on_result)
+                    batch = []
+            if batch:
+                self._write_batch(batch, results, on_result)
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+        elapsed = time.perf_counter() - started
+        total_processed = len(results['successful']) + len(results['failed'])
+        throughput = {
+            'workers': workers,
+            'elapsed_seconds': round(elapsed, 3),
+            'total_bytes': total_bytes,
+            'files_per_second': round(total_processed / elapsed, 2) if elapsed else 0.0,
+            'mb_per_second': round(total_bytes / (1024 * 1024) / elapsed, 2) if elapsed else 0.0
+        }
+        logger.info(f"Bulk ingested {total_processed} files in {throughput['elapsed_seconds']}s "
+                    f"({throughput['files_per_second']} files/s, {throughput['mb_per_second']} MB/s)")
 
         return {
-            'total_processed': len(results['successful']) + len(results['failed']),
+            'total_processed': total_processed,
             'successful': len(results['successful']),
             'failed': len(results['failed']),
+            'throughput': throughput,
             'details': results
-        }
\ No newline at end of file
+        }
+
+    @staticmethod
+    def _prepare_in_pool(executor: ProcessPoolExecutor, specs: List[Dict], window: int):
+        """Yield prepared files as workers finish them, keeping at most window in flight"""
+        pending = set()
+        specs = iter(specs)
+        while True:
+            for spec in specs:
+                pending.add(executor.submit(_prepare_in_worker, spec))
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+    def _processed_hashes(self) -> frozenset:
+        cursor = self.db.connection().cursor()
+        cursor.execute('SELECT DISTINCT content_hash FROM files WHERE processed')
+        return frozenset(row[0] for row in cursor.fetchall())
+
+    def _write_batch(self, batch: List[Dict], results: Dict, on_result: Callable[[Dict], None] = None):
+        """Insert a batch of prepared files in a single transaction"""
+        outcomes = []
+        with self.db.transaction() as conn:
+            cursor = conn.cursor()
+            # Releasing the outermost savepoint would commit each file on its own
+            if not conn.in_transaction:
+                cursor.execute('BEGIN')
+            for prepared in batch:
+                if prepared.get('error'):
+                    outcomes.append({'file_id': prepared['file_id'], 'filename': prepared['filename'],
+                                     'success': False, 'error': prepared['error']})
+                    continue
+
+                # A failing file only rolls back its own rows
+                cursor.execute('SAVEPOINT bulk_file')
+                try:
+                    outcomes.append(self._write_prepared(cursor, prepared))
+                    cursor.execute('RELEASE bulk_file')
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO bulk_file')
+                    cursor.execute('RELEASE bulk_file')
+                    outcomes.append({'file_id': prepared['file_id'], 'filename': prepared['filename'],
+                                     'success': False, 'error': str(e)})
+
+        self._record_indexed_chunks(sum(outcome['chunks'] for outcome in outcomes
+                                        if outcome['success'] and 'duplicate_of' not in outcome))
+        self._embed_chunks([outcome['file_id'] for outcome in outcomes
+                            if outcome['success'] and 'duplicate_of' not in outcome])
+        if any(outcome['success'] for outcome in outcomes):
+            self._notify_change()
+
+        for prepared, outcome in zip(batch, outcomes):
+            if outcome['success'] and 'duplicate_of' in outcome:
+                self._discard_unused_blob(Path(prepared['storage_path']))
+            if outcome['success']:
+                results['successful'].append(outcome)
+            else:
+                logger.error(f"Error uploading file {prepared['path']}: {outcome['error']}")
+                results['failed'].append({'file': prepared['path'], 'error': outcome['error']})
+            if on_result:
+                on_result(outcome)
+
+    def _write_prepared(self, cursor, prepared: Dict) -> Dict:
+        file_id = prepared['file_id']
+        file_path = Path(prepared['path'])
+        content_hash = prepared['content_hash']
+        outcome = {'file_id': file_id, 'filename': prepared['filename'],
+                   'file_type': prepared['file_type'], 'success': True}
+
+        # Same content already indexed, including earlier in this batch
+        blob = self.find_blob(content_hash)
+        if blob:
+            self._insert_duplicate_row(cursor, file_id, file_path, prepared['file_type'],
+                                       prepared['file_size'], content_hash, blob,
+                                       prepared.get('category'), prepared.get('tags'),
+                                       prepared.get('description'))
+            return {**outcome, 'chunks': blob['chunk_count'], 'duplicate_of': blob['blob_id']}
+
+        chunks = prepared['chunks']
+        if chunks is None:
+            raise FileNotFoundError(f"Stored content for {file_path.name} is missing")
+
+        self._insert_file_row(cursor, file_id, file_path, Path(prepared['storage_path']),
+                              prepared['file_type'], prepared['file_size'], content_hash,
+                              prepared.get('category'), prepared.get('tags'), prepared.get('description'))
+        self._insert_chunks(cursor, file_id, chunks)
+        self._mark_processed(cursor, file_id, len(chunks))
+        return {**outcome, 'chunks': len(chunks)}
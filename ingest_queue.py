@@ -0,0 +1,239 @@
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionQueue:
+    """Runs document ingestion on a worker pool and tracks per-file progress.
+
+    Submitting returns a job id straight away; get_job() reports each file
+    as queued, indexing (its files row exists but is not processed yet),
+    done or failed.
+    """
+
+    def __init__(self, file_manager, max_workers: int = 2, run_async: bool = True,
+                 max_jobs: int = 500, bulk_workers: int = None):
+        self.file_manager = file_manager
+        # Processes used to extract directory jobs, None means one per CPU
+        self.bulk_workers = bulk_workers
+        # Serverless hosts freeze the process after the response, so they
+        # can run jobs inline instead
+        self.run_async = run_async
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='ingest') if run_async else None
+        self.jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit_files(self, files: List[Dict], owner=None) -> str:
+        """Queue files for ingestion.
+
+        Each entry needs a 'path' and may carry 'filename', 'category',
+        'tags' and 'description', or 'replaces' with the id of a file it is
+        a new version of (see FileManager.replace_file). owner identifies
+        the submitting user and is kept on the job.
+        """
+        job = self._new_job('upload', owner)
+        for spec in files:
+            entry = self._add_entry(job, spec['path'], spec.get('filename'))
+            self._dispatch(self._process_file, job, entry, spec)
+        self._finish_if_done(job)
+        return job['job_id']
+
+    def submit_directory(self, directory_path: str, category: str = None, sync: bool = False,
+                         owner=None) -> str:
+        """Queue every supported file under a directory for parallel bulk ingestion.
+
+        With sync only files that are new or changed since the last sync of
+        the directory are ingested (see FileManager.sync_directory).
+        """
+        job = self._new_job('sync' if sync else 'bulk_upload', owner)
+        job['directory'] = directory_path
+        self._dispatch(self._sync_directory if sync else self._scan_directory, job, directory_path, category)
+        return job['job_id']
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """Return a snapshot of a job's progress"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = {**job, 'files': [dict(entry) for entry in job['files']]}
+
+        # The processed flag tells queued files apart from ones mid-indexing
+        pending = [entry['file_id'] for entry in snapshot['files'] if entry['status'] == 'processing']
+        for file_id, status in self.file_manager.get_processing_status(pending).items():
+            for entry in snapshot['files']:
+                if entry['file_id'] == file_id and not status['processed']:
+                    entry['status'] = 'indexing'
+
+        total = snapshot['total']
+        finished = snapshot['successful'] + snapshot['failed']
+        snapshot['progress'] = round(finished / total, 3) if total else (1.0 if snapshot['scanned'] else 0.0)
+        return snapshot
+
+    def shutdown(self, wait: bool = True):
+        if self.executor:
+            self.executor.shutdown(wait=wait)
+
+    def _new_job(self, kind: str, owner=None) -> Dict:
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'kind': kind,
+            'owner': owner,
+            'status': 'queued',
+            'created_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'scanned': kind not in ('bulk_upload', 'sync'),
+            'total': 0,
+            'successful': 0,
+            'failed': 0,
+            'files': []
+        }
+        with self._lock:
+            self.jobs[job['job_id']] = job
+            # Forget the oldest jobs once the history is full
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        return job
+
+    def _add_entry(self, job: Dict, path: str, filename: str = None) -> Dict:
+        filename = filename or Path(path).name
+        entry = {
+            'filename': filename,
+            'file_id': self.file_manager.generate_file_id(filename),
+            'status': 'queued',
+            'chunks': None,
+            'error': None
+        }
+        with self._lock:
+            job['files'].append(entry)
+            job['total'] += 1
+        return entry
+
+    def _dispatch(self, func, *args):
+        if self.executor:
+            self.executor.submit(self._run_safely, func, *args)
+        else:
+            self._run_safely(func, *args)
+
+    @staticmethod
+    def _run_safely(func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            logger.error(f"Ingestion task failed: {e}")
+
+    def _scan_directory(self, job: Dict, directory_path: str, category: str = None):
+        with self._lock:
+            job['status'] = 'running'
+        try:
+            entries = {}
+            specs = []
+            for file_path in self.file_manager.iter_supported_files(Path(directory_path)):
+                entry = self._add_entry(job, str(file_path))
+                entry['status'] = 'processing'
+                entries[entry['file_id']] = entry
+                specs.append({'path': str(file_path), 'category': category, 'file_id': entry['file_id']})
+            with self._lock:
+                job['scanned'] = True
+
+            def record(outcome: Dict):
+                self._record_result(job, entries[outcome['file_id']], outcome)
+
+            result = self.file_manager.ingest_files(specs, workers=self.bulk_workers, on_result=record)
+            with self._lock:
+                job['throughput'] = result['throughput']
+        finally:
+            with self._lock:
+                job['scanned'] = True
+            self._finish_if_done(job)
+
+    def _sync_directory(self, job: Dict, directory_path: str, category: str = None):
+        with self._lock:
+            job['status'] = 'running'
+        try:
+            plan = self.file_manager.plan_sync(directory_path, category)
+            if 'error' in plan:
+                with self._lock:
+                    job['status'] = 'failed'
+                    job['error'] = plan['error']
+                    job['finished_at'] = datetime.now().isoformat()
+                return
+
+            # Only files that need ingesting get a progress entry
+            entries = {}
+            for item in plan['ingest']:
+                entry = self._add_entry(job, item['path'])
+                entry['status'] = 'processing'
+                item['file_id'] = entry['file_id']
+                entries[entry['file_id']] = entry
+            with self._lock:
+                job['scanned'] = True
+
+            def record(outcome: Dict):
+                self._record_result(job, entries[outcome['file_id']], outcome)
+
+            result = self.file_manager.apply_sync(plan, workers=self.bulk_workers, on_result=record)
+            with self._lock:
+                job['sync'] = {key: result[key] for key in
+                               ('scanned', 'unchanged', 'new', 'modified', 'deleted', 'removed',
+                                'elapsed_seconds')}
+                if result['ingest']:
+                    job['throughput'] = result['ingest']['throughput']
+        finally:
+            with self._lock:
+                job['scanned'] = True
+            self._finish_if_done(job)
+
+    def _process_file(self, job: Dict, entry: Dict, spec: Dict):
+        with self._lock:
+            job['status'] = 'running'
+            entry['status'] = 'processing'
+
+        try:
+            if spec.get('replaces'):
+                result = self.file_manager.replace_file(spec['replaces'], spec['path'],
+                                                        filename=spec.get('filename'),
+                                                        new_file_id=entry['file_id'])
+            else:
+                result = self.file_manager.upload_file(
+                    spec['path'],
+                    category=spec.get('category'),
+                    tags=spec.get('tags'),
+                    description=spec.get('description'),
+                    file_id=entry['file_id'],
+                    filename=spec.get('filename')
+                )
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+
+        self._record_result(job, entry, result)
+        self._finish_if_done(job)
+
+    def _record_result(self, job: Dict, entry: Dict, result: Dict):
+        with self._lock:
+            if result.get('success'):
+                entry['status'] = 'done'
+                entry['chunks'] = result.get('chunks')
+                job['successful'] += 1
+            else:
+                entry['status'] = 'failed'
+                entry['error'] = result.get('error')
+                job['failed'] += 1
+
+    def _finish_if_done(self, job: Dict):
+        with self._lock:
+            if not job['scanned'] or job['successful'] + job['failed'] < job['total']:
+                return
+            if job['finished_at']:
+                return
+            job['finished_at'] = datetime.now().isoformat()
+            job['status'] = 'completed_with_errors' if job['failed'] else 'completed'
@@ -0,0 +1,266 @@
+import hashlib
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """A model call failed; status is the HTTP-like code when known"""
+
+    def __init__(self, message: str, status: int = None):
+        super().__init__(message)
+        self.status = status
+
+
+class LLMTimeoutError(LLMError):
+    """No answer, or no next streamed piece, within the timeout"""
+
+
+class LLMRateLimitError(LLMError):
+    """Still rate limited (429) after all retries"""
+
+
+class LLMBusyError(LLMError):
+    """Every concurrency slot stayed taken for the whole timeout"""
+
+
+class GeminiBackend:
+    """Google Gemini through google-generativeai"""
+
+    def __init__(self, api_key: str, model_name: str = 'gemini-2.0-flash-exp'):
+        import google.generativeai as genai
+        self.genai = genai
+        genai.configure(api_key=api_key)
+        self.model = genai.GenerativeModel(model_name)
+
+    def generate(self, prompt: str, generation_config: Dict) -> str:
+        response = self.model.generate_content(
+            prompt, generation_config=self.genai.types.GenerationConfig(**generation_config))
+        return response.text
+
+    def stream(self, prompt: str, generation_config: Dict) -> Iterator[str]:
+        response = self.model.generate_content(
+            prompt, generation_config=self.genai.types.GenerationConfig(**generation_config), stream=True)
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunks without text parts, e.g. the final safety rating
+                continue
+            if text:
+                yield text
+
+
+class StubBackend:
+    """Local stand-in for load tests: canned answer after a fixed latency"""
+
+    def __init__(self, response: str = "Bu test cavabıdır.", latency: float = 0.0):
+        self.response = response
+        self.latency = latency
+
+    def generate(self, prompt: str, generation_config: Dict) -> str:
+        time.sleep(self.latency)
+        return self.response
+
+    def stream(self, prompt: str, generation_config: Dict) -> Iterator[str]:
+        words = self.response.split(' ')
+        for i, word in enumerate(words):
+            time.sleep(self.latency / len(words))
+            yield word if i == len(words) - 1 else word + ' '
+
+
+def make_backend(name: str, api_key: str = None):
+    """Backend by configuration name ('gemini' or 'stub')"""
+    if name == 'gemini':
+        return GeminiBackend(api_key)
+    if name == 'stub':
+        return StubBackend()
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+class LLMClient:
+    """Calls a model backend with timeouts, retries and bounded concurrency.
+
+    Calls run on a private thread pool, so a hanging upstream costs the
+    caller at most `timeout` seconds. At most max_concurrency calls reach
+    the backend at once; 429 and 5xx errors are retried with exponential
+    backoff and jitter, and identical prompts already in flight share one
+    backend call instead of starting another.
+    """
+
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, backend, max_concurrency: int = 4, timeout: float = 30.0,
+                 max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # Timed-out calls keep their thread until the backend returns,
+        # so the pool has room beyond the concurrency limit
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2,
+                                            thread_name_prefix='llm')
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.metrics = {'calls': 0, 'coalesced': 0, 'retries': 0, 'timeouts': 0, 'failures': 0}
+
+    def generate(self, prompt: str, generation_config: Dict) -> str:
+        """Complete answer for a prompt"""
+        key = hashlib.sha1(f"{prompt}\x00{json.dumps(generation_config, sort_keys=True)}"
+                           .encode('utf-8')).hexdigest()
+        with self._lock:
+            future = self._in_flight.get(key)
+            coalesced = future is not None
+            if coalesced:
+                self.metrics['coalesced'] += 1
+            else:
+                future = Future()
+                self._in_flight[key] = future
+        if coalesced:
+            return self._wait(future)
+
+        self._count('calls')
+        try:
+            self._acquire_slot()
+        except LLMError as e:
+            self._settle(key, future, error=e)
+            raise
+
+        deadline = time.monotonic() + self.timeout
+        call = self._executor.submit(self._generate_with_retries, prompt, generation_config, deadline)
+        call.add_done_callback(lambda done: self._slots.release())
+        call.add_done_callback(lambda done: self._settle(key, future, call=done))
+        return self._wait(future)
+
+    def stream(self, prompt: str, generation_config: Dict) -> Iterator[str]:
+        """Yield the answer in pieces; each piece must arrive within the timeout.
+
+        Failures before the first piece are retried like generate();
+        once text has been yielded an error is raised to the caller.
+        """
+        self._count('calls')
+        self._acquire_slot()
+        pieces = queue.Queue()
+        done = object()
+
+        def produce():
+            attempt = 0
+            started = False
+            try:
+                while True:
+                    try:
+                        for text in self.backend.stream(prompt, generation_config):
+                            started = True
+                            pieces.put(text)
+                        break
+                    except Exception as e:
+                        if started or not self._should_retry(e, attempt):
+                            raise
+                        self._count('retries')
+                        time.sleep(self._backoff(attempt))
+                        attempt += 1
+                pieces.put(done)
+            except Exception as e:
+                pieces.put(e)
+            finally:
+                self._slots.release()
+
+        self._executor.submit(produce)
+        while True:
+            try:
+                item = pieces.get(timeout=self.timeout)
+            except queue.Empty:
+                self._count('timeouts')
+                raise LLMTimeoutError(f"No response from the model within {self.timeout}s")
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                self._count('failures')
+                raise self._wrap(item)
+            yield item
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self.metrics, 'in_flight': len(self._in_flight),
+                    'max_concurrency': self.max_concurrency, 'timeout': self.timeout}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _generate_with_retries(self, prompt: str, generation_config: Dict, deadline: float) -> str:
+        attempt = 0
+        while True:
+            try:
+                return self.backend.generate(prompt, generation_config)
+            except Exception as e:
+                delay = self._backoff(attempt)
+                # Don't sleep past the point where the caller has given up
+                if not self._should_retry(e, attempt) or time.monotonic() + delay >= deadline:
+                    raise
+                self._count('retries')
+                logger.warning(f"Model call failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def _wait(self, future: Future) -> str:
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self._count('timeouts')
+            raise LLMTimeoutError(f"No response from the model within {self.timeout}s")
+
+    def _settle(self, key: str, future: Future, call: Future = None, error: Exception = None):
+        """Hand the backend result to every caller waiting on this prompt"""
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if call is not None:
+            error = call.exception()
+            if error is None:
+                future.set_result(call.result())
+                return
+            self._count('failures')
+            error = self._wrap(error)
+        future.set_exception(error)
+
+    def _acquire_slot(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count('timeouts')
+            raise LLMBusyError(f"All {self.max_concurrency} model slots busy for {self.timeout}s")
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        return attempt < self.max_retries and self._status(error) in self.RETRYABLE_STATUS
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.backoff_base * 2 ** attempt, self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    @staticmethod
+    def _status(error: Exception):
+        """HTTP status of an error from google-api-core, requests or LLMError"""
+        for attribute in ('status', 'code', 'status_code'):
+            value = getattr(error, attribute, None)
+            if isinstance(value, int):
+                return value
+        return None
+
+    def _wrap(self, error: Exception) -> LLMError:
+        if isinstance(error, LLMError):
+            return error
+        status = self._status(error)
+        if status == 429:
+            return LLMRateLimitError(str(error), status)
+        return LLMError(str(error), status)
+
+    def _count(self, metric: str):
+        with self._lock:
+            self.metrics[metric] += 1
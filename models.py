@@ -1,11 +1,16 @@
-import google.generativeai as genai
-import json
 import sqlite3
 import hashlib
 import os
-from datetime import datetime
 from file_manager import FileManager
+from database import get_connection_manager
+from context_builder import ContextBuilder
+from static_index import StaticKnowledgeIndex
+from response_cache import ResponseCache
+from conversation_store import ConversationStore
+from text_normalizer import tokenize
+from llm_client import LLMClient, LLMRateLimitError, LLMTimeoutError, GeminiBackend
 import logging
+from typing import Iterator
 
 logger = logging.getLogger(__name__)
 
@@ -13,8 +18,10 @@ logger = logging.getLogger(__name__)
 class EnhancedKnowledgeBase:
     """Enhanced knowledge base that integrates with file management system"""
 
-    def __init__(self, file_manager: FileManager):
+    def __init__(self, file_manager: FileManager, static_data_path: str = None):
         self.file_manager = file_manager
+        # A JSON data file of the same shape replaces these built-in entries
+        self.static_data_path = static_data_path
         self.static_data = {
             "structure": {
                 "nazirlik": "Nazirlik aşağıdakı əsas şöbələrdən ibarətdir: İdarəetmə Şöbəsi, Maliyyə Şöbəsi, İnsan Resursları, Texniki Dəstək və Layihə İdarəetməsi.",
@@ -95,40 +102,47 @@ Hörmətlə,
 [Ad Soyad]"""
             }
         }
+        if static_data_path:
+            self.static_index = StaticKnowledgeIndex.from_file(static_data_path)
+            self.static_data = self.static_index.data
+        else:
+            self.static_index = StaticKnowledgeIndex(self.static_data)
+
+    def reload_static_data(self, path: str = None) -> int:
+        """Recompile the static knowledge from its data file; returns the entry count"""
+        self.static_data_path = path or self.static_data_path
+        if not self.static_data_path:
+            raise ValueError("No static knowledge data file configured")
+        self.static_index.load_file(self.static_data_path)
+        self.static_data = self.static_index.data
+        return len(self.static_index.entries)
+
+    def search_static_entries(self, query: str) -> list:
+        """Static knowledge base entries matching the query, best first"""
+        return self.static_index.search(query)
 
     def search_static_data(self, query: str) -> str:
         """Search through static knowledge base"""
-        query_lower = query.lower()
-        relevant_info = []
-
-        for category, items in self.static_data.items():
-            for key, value in items.items():
-                if any(term in key.lower() or term in str(value).lower()
-                       for term in query_lower.split()):
-                    if isinstance(value, dict):
-                        relevant_info.append(f"{key}: {json.dumps(value, ensure_ascii=False)}")
-                    else:
-                        relevant_info.append(f"{key}: {value}")
-
+        relevant_info = [f"{entry['label']}: {entry['text']}" for entry in self.search_static_entries(query)]
         return "\n".join(relevant_info) if relevant_info else ""
 
     def search_documents(self, query: str, max_results: int = 5) -> str:
         """Search through uploaded documents"""
         try:
-            search_results = self.file_manager.search_files(query)
+            # Best ranked passages, at most two per document
+            search_results = self.file_manager.search_chunks(query, top_k=max_results, passage_length=300)
             if not search_results:
                 return ""
 
             document_info = []
-            for i, result in enumerate(search_results[:max_results]):
-                # Get relevant content from the document
-                file_content = self.file_manager.get_file_content(result['file_id'])
-
+            for result in search_results:
+                # Article chunks say where in the code the passage comes from
+                location = f" — {result['article']}" if result.get('article') else ""
                 doc_info = f"""
-Sənəd: {result['filename']} (Növ: {result['file_type']})
+Sənəd: {result['filename']} (Növ: {result['file_type']}){location}
 Kateqoriya: {result.get('category', 'Təyin edilməyib')}
 Təsvir: {result.get('description', 'Təsvir yoxdur')}
-Əlaqəli məzmun: {result.get('snippet', file_content.get('content', '')[:300])}...
+Əlaqəli məzmun: {result['passage']}...
 """
                 document_info.append(doc_info)
 
@@ -157,13 +171,13 @@ Təsvir: {result.get('description', 'Təsvir yoxdur')}
 
         return "\n".join(all_results) if all_results else "Heç bir məlumat tapılmadı."
 
-    def get_document_by_name(self, filename: str) -> dict:
-        """Get specific document by filename"""
+    def get_document_by_name(self, filename: str, max_chars: int = None) -> dict:
+        """Get specific document by filename, or its first max_chars characters"""
         try:
             files = self.file_manager.list_files()
             for file_info in files:
                 if filename.lower() in file_info['filename'].lower():
-                    return self.file_manager.get_file_content(file_info['file_id'])
+                    return self.file_manager.get_file_content(file_info['file_id'], max_chars=max_chars)
             return {'error': 'Sənəd tapılmadı'}
         except Exception as e:
             logger.error(f"Error getting document: {e}")
@@ -176,6 +190,7 @@ class UserManager:
     def __init__(self):
         try:
             self.db_path = '/tmp/users.db' if os.path.exists('/tmp') else 'users.db'
+            self.db = get_connection_manager(self.db_path)
             self.init_db()
             self.add_demo_users()
         except Exception as e:
@@ -184,9 +199,12 @@ class UserManager:
 
     def init_db(self):
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
+            # Skip the write transaction when the table is already there
+            if self.db.connection().execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone():
+                return
+            with self.db.transaction() as conn:
+                conn.execute('''
                            CREATE TABLE IF NOT EXISTS users
                            (
                                id
@@ -217,8 +235,6 @@ class UserManager:
                                CURRENT_TIMESTAMP
                            )
                            ''')
-            conn.commit()
-            conn.close()
             print(f"✅ Database created successfully at {self.db_path}")
         except Exception as e:
             print(f"❌ Database creation failed: {e}")
@@ -236,19 +252,21 @@ class UserManager:
                 ('analitik', 'data123', 'Leyla Həsənova', 'analyst')
             ]
 
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            for username, password, name, role in demo_users:
-                password_hash = hashlib.sha256(password.encode()).hexdigest()
-                cursor.execute('''
-                               INSERT
-                               OR IGNORE INTO users (username, password_hash, name, role)
-                    VALUES (?, ?, ?, ?)
-                               ''', (username, password_hash, name, role))
-
-            conn.commit()
-            conn.close()
+            existing = {row[0] for row in self.db.connection().execute(
+                'SELECT username FROM users WHERE username IN (?, ?, ?)',
+                [user[0] for user in demo_users])}
+            demo_users = [user for user in demo_users if user[0] not in existing]
+            if not demo_users:
+                return
+
+            with self.db.transaction() as conn:
+                for username, password, name, role in demo_users:
+                    password_hash = hashlib.sha256(password.encode()).hexdigest()
+                    conn.execute('''
+                                 INSERT
+                                 OR IGNORE INTO users (username, password_hash, name, role)
+                        VALUES (?, ?, ?, ?)
+                                 ''', (username, password_hash, name, role))
             print("✅ Demo users added successfully")
         except Exception as e:
             print(f"❌ Adding demo users failed: {e}")
@@ -256,8 +274,7 @@ class UserManager:
 
     def authenticate(self, username, password):
         password_hash = hashlib.sha256(password.encode()).hexdigest()
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self.db.connection().cursor()
         cursor.execute('''
                        SELECT id, username, name, role
                        FROM users
@@ -265,7 +282,6 @@ class UserManager:
                          AND password_hash = ?
                        ''', (username, password_hash))
         user = cursor.fetchone()
-        conn.close()
 
         if user:
             return {
@@ -278,32 +294,45 @@ class UserManager:
 
     def create_user(self, username, password, name, role):
         password_hash = hashlib.sha256(password.encode()).hexdigest()
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
 
         try:
-            cursor.execute('''
-                           INSERT INTO users (username, password_hash, name, role)
-                           VALUES (?, ?, ?, ?)
-                           ''', (username, password_hash, name, role))
-            conn.commit()
+            with self.db.transaction() as conn:
+                conn.execute('''
+                             INSERT INTO users (username, password_hash, name, role)
+                             VALUES (?, ?, ?, ?)
+                             ''', (username, password_hash, name, role))
             return True
         except sqlite3.IntegrityError:
             return False
-        finally:
-            conn.close()
 
 
 class EnhancedAIAssistant:
     """Enhanced AI Assistant with better document handling and context management"""
 
-    def __init__(self, knowledge_base: EnhancedKnowledgeBase, gemini_api_key: str):
+    ERROR_RESPONSE = "Üzr istəyirəm, hazırda texniki problem var. Zəhmət olmasa sonra yenidən cəhd edin."
+    RATE_LIMIT_RESPONSE = "Hazırda sorğular çox olduğu üçün cavab verə bilmirəm. Zəhmət olmasa bir dəqiqə sonra yenidən cəhd edin."
+    TIMEOUT_RESPONSE = "Cavab hazırlamaq gözləniləndən uzun çəkdi. Zəhmət olmasa sualı yenidən göndərin."
+
+    GENERATION_CONFIG = {
+        'temperature': 0.4,  # Lower for accuracy
+        'top_k': 40,
+        'top_p': 0.95,
+        'max_output_tokens': 1024,
+    }
+
+    def __init__(self, knowledge_base: EnhancedKnowledgeBase, gemini_api_key: str,
+                 context_token_budget: int = 3000, response_cache: ResponseCache = None,
+                 llm_client: LLMClient = None, conversation_store: ConversationStore = None):
         self.kb = knowledge_base
-        # Configure Gemini API
-        genai.configure(api_key=gemini_api_key)
-        # Initialize Gemini model
-        self.model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        self.conversation_history = {}  # Store conversation context per user
+        # Estimated tokens of knowledge base and document context per prompt
+        self.context_token_budget = context_token_budget
+        # Answers to repeated questions; emptied when documents change
+        self.response_cache = response_cache or ResponseCache()
+        self.kb.file_manager.add_change_listener(self.response_cache.clear)
+        # Model calls with timeouts, retries and a concurrency limit; Gemini by default
+        self.llm = llm_client or LLMClient(GeminiBackend(gemini_api_key))
+        # Recent turns and a summary of older ones, per user
+        self.conversations = conversation_store or ConversationStore()
 
     def get_role_context(self, role: str) -> str:
         contexts = {
@@ -321,28 +350,31 @@ class EnhancedAIAssistant:
         }
         return role_names.get(role, role)
 
-    def maintain_conversation_context(self, user_id: str, message: str, response: str):
-        """Maintain conversation context for better follow-up questions"""
-        if user_id not in self.conversation_history:
-            self.conversation_history[user_id] = []
+    # Folded words that point back at earlier turns ("bəs", "həmin", "onu", ...)
+    FOLLOW_UP_WORDS = {
+        'bes', 'bu', 'bunu', 'buna', 'bunun', 'o', 'onu', 'ona', 'onun', 'hemin',
+        'evvelki', 'yuxaridaki', 'daha', 'elave', 'niye', 'nece'
+    }
 
-        self.conversation_history[user_id].append({
-            'user_message': message,
-            'ai_response': response,
-            'timestamp': datetime.now().isoformat()
-        })
+    def is_follow_up(self, user_message: str, conversation_context: str) -> bool:
+        """Whether a message only makes sense together with the conversation before it"""
+        if not conversation_context:
+            return False
+        words = tokenize(user_message, min_length=1)
+        return len(words) <= 2 or any(word in self.FOLLOW_UP_WORDS for word in words)
 
-        # Keep only last 5 interactions to manage memory
-        if len(self.conversation_history[user_id]) > 5:
-            self.conversation_history[user_id] = self.conversation_history[user_id][-5:]
+    def maintain_conversation_context(self, user_id: str, message: str, response: str):
+        """Maintain conversation context for better follow-up questions"""
+        self.conversations.append(user_id, message, response)
 
     def get_conversation_context(self, user_id: str) -> str:
         """Get recent conversation context"""
-        if user_id not in self.conversation_history:
-            return ""
-
         context_parts = []
-        for interaction in self.conversation_history[user_id][-3:]:  # Last 3 interactions
+        summary = self.conversations.summary(user_id)
+        if summary:
+            context_parts.append(f"Əvvəlki suallar:\n{summary}")
+
+        for interaction in self.conversations.recent(user_id, 3):  # Last 3 interactions
             context_parts.append(f"İstifadəçi: {interaction['user_message']}")
             context_parts.append(f"AI: {interaction['ai_response'][:200]}...")
 
@@ -385,61 +417,86 @@ class EnhancedAIAssistant:
 
     # In models.py - Replace the generate_enhanced_response method with this EXACT code:
 
-    def generate_enhanced_response(self, user_message: str, user_info: dict) -> str:
-        """Enhanced response generation with FIXED document search"""
-        try:
-            user_id = str(user_info['id'])
-
-            # DEBUG: Print what we're searching for
-            print(f"DEBUG: User asked: '{user_message}'")
-
-            # Get conversation context
-            conversation_context = self.get_conversation_context(user_id)
-
-            # Detect document requests
-            doc_request = self.detect_document_request(user_message)
-
-            # Get context information from knowledge base - THIS IS THE KEY FIX
-            print("DEBUG: Starting knowledge base search...")
-            context_info = self.kb.search(user_message)
-            print(f"DEBUG: Knowledge base returned: {len(context_info)} characters")
-
-            # ADDITIONAL: Force document search for legal terms
-            legal_terms = ['cinayət', 'məcəllə', 'cəza', 'məsuliyyət', 'maddə', 'qanun', 'hüquq', 'yaş']
-            if any(term in user_message.lower() for term in legal_terms):
-                print("DEBUG: Legal query detected, forcing document search...")
-                # Force search in documents
-                doc_results = self.kb.file_manager.search_files(user_message)
-                print(f"DEBUG: Direct file search found {len(doc_results)} results")
-
-                if doc_results:
-                    additional_context = "\n=== CİNAYƏT MƏCƏLLƏSİ MƏZMUNU ===\n"
-                    for result in doc_results[:5]:  # Top 5 results
-                        content = self.kb.file_manager.get_file_content(result['file_id'])
-                        if content and not content.get('error'):
-                            additional_context += f"\nFayl: {result['filename']}\n"
-                            additional_context += content.get('content', '')[:1000] + "...\n"
-                    context_info += additional_context
-
-            # Get role context
-            role_context = self.get_role_context(user_info['role'])
-
-            # Handle specific document requests
-            document_content = ""
-            if doc_request['has_document_request'] and doc_request['specific_filename']:
-                doc_result = self.kb.get_document_by_name(doc_request['specific_filename'])
-                if not doc_result.get('error'):
-                    document_content = f"\n=== XÜSUSI SƏNƏD MƏZMUNU ===\n{doc_result.get('content', '')[:2000]}..."
-
-            # Create enhanced prompt with better structure
-            system_prompt = f"""
+    def build_context(self, user_message: str, doc_request: dict) -> str:
+        """Collect context from every source and fit it into the token budget"""
+        builder = ContextBuilder(self.context_token_budget)
+
+        # A document the user asked for by name goes first, up to half the
+        # budget; only the chunks that fit are read
+        if doc_request['has_document_request'] and doc_request['specific_filename']:
+            max_tokens = self.context_token_budget // 2
+            doc_result = self.kb.get_document_by_name(
+                doc_request['specific_filename'], max_chars=int(max_tokens * ContextBuilder.CHARS_PER_TOKEN))
+            if not doc_result.get('error'):
+                builder.add(doc_result.get('content', ''), 1.0, 'requested',
+                            label=f"Xüsusi sənəd: {doc_result['filename']}", pinned=True,
+                            max_tokens=max_tokens)
+
+        builder.add_ranked(self.kb.search_static_entries(user_message), 'static')
+
+        # One ranked search serves both general and legal questions
+        doc_results = self.kb.file_manager.search_chunks(user_message, top_k=10, passage_length=1500)
+        builder.add_ranked([{
+            'text': result['passage'],
+            'score': result['score'],
+            'label': f"Sənəd: {result['filename']}" + (f" — {result['article']}" if result.get('article') else "")
+        } for result in doc_results], 'documents')
+
+        context = builder.build()
+        logger.debug(f"Context {builder.stats['tokens']}/{builder.stats['budget']} tokens, "
+                     f"{builder.stats['selected']} of {builder.stats['candidates']} passages, "
+                     f"{builder.stats['duplicates']} duplicates dropped")
+        return context or "Heç bir məlumat tapılmadı."
+
+    def prepare_response(self, user_message: str, user_info: dict) -> dict:
+        """Build the prompt for a message, or find its answer in the cache.
+
+        Returns 'user_id', 'cache_key' and either 'cached' (the stored
+        answer) or 'prompt'. Follow-up questions are answered from a prompt
+        with the user's details and conversation and are never cached
+        (cache_key is None); other prompts only carry the role, so users
+        with the same role share their answers.
+        """
+        user_id = str(user_info['id'])
+
+        logger.debug(f"User asked: '{user_message}'")
+
+        # Get conversation context
+        conversation_context = self.get_conversation_context(user_id)
+
+        # Detect document requests
+        doc_request = self.detect_document_request(user_message)
+
+        # Knowledge base, document passages and any requested document,
+        # deduplicated and trimmed to the token budget
+        context_info = self.build_context(user_message, doc_request)
+
+        if self.is_follow_up(user_message, conversation_context):
+            cache_key = None
+            user_details = f"""- Ad: {user_info['name']}
+    - Rol: {self.get_role_display_name(user_info['role'])}
+    - İstifadəçi adı: {user_info['username']}"""
+        else:
+            # The same question from the same role over the same context
+            # gets the same answer, so the prompt carries nothing more
+            cache_key = self.response_cache.make_key(user_message, user_info['role'], context_info)
+            cached_response = self.response_cache.get(cache_key)
+            if cached_response is not None:
+                logger.debug("Answered from response cache")
+                return {'user_id': user_id, 'cache_key': cache_key, 'cached': cached_response}
+            conversation_context = ""
+            user_details = f"- Rol: {self.get_role_display_name(user_info['role'])}"
+
+        # Get role context
+        role_context = self.get_role_context(user_info['role'])
+
+        # Create enhanced prompt with better structure
+        system_prompt = f"""
     Sən Azərbaycan Respublikası nazirlik işçiləri üçün AI onboarding asistantısan. 
     Sənin əlində Azərbaycan Respublikasının Cinayət Məcəlləsi və digər rəsmi sənədlər var.
 
     👤 İSTİFADƏÇİ MƏLUMATLARI:
-    - Ad: {user_info['name']}
-    - Rol: {self.get_role_display_name(user_info['role'])}
-    - İstifadəçi adı: {user_info['username']}
+    {user_details}
 
     🎯 ROL ƏSASLI İCAZƏLƏR:
     {role_context}
@@ -450,8 +507,6 @@ class EnhancedAIAssistant:
     📚 MÖVCUD SƏNƏD MƏLUMATLARI:
     {context_info}
 
-    {document_content}
-
     ❓ YENİ SUAL: "{user_message}"
 
     📋 CAVAB QAYDLARI:
@@ -465,30 +520,63 @@ class EnhancedAIAssistant:
     8. Qısa və dəqiq cavab ver (2-5 cümlə)
 
     CAVAB:"""
+        return {'user_id': user_id, 'cache_key': cache_key, 'prompt': system_prompt}
 
-            # Generate response using Gemini
-            response = self.model.generate_content(
-                system_prompt,
-                generation_config=genai.types.GenerationConfig(
-                    temperature=0.4,  # Lower for accuracy
-                    top_k=40,
-                    top_p=0.95,
-                    max_output_tokens=1024,
-                )
-            )
-
-            response_text = response.text
-            print(f"DEBUG: AI response generated: {len(response_text)} characters")
-
-            # Maintain conversation context
-            self.maintain_conversation_context(user_id, user_message, response_text)
+    def finish_response(self, prepared: dict, user_message: str, response_text: str):
+        """Cache a complete answer and add it to the conversation history"""
+        if 'prompt' in prepared and prepared['cache_key'] is not None:
+            self.response_cache.put(prepared['cache_key'], response_text)
+        self.maintain_conversation_context(prepared['user_id'], user_message, response_text)
 
+    def generate_enhanced_response(self, user_message: str, user_info: dict) -> str:
+        """Enhanced response generation with FIXED document search"""
+        try:
+            prepared = self.prepare_response(user_message, user_info)
+            if 'cached' in prepared:
+                response_text = prepared['cached']
+            else:
+                response_text = self.llm.generate(prepared['prompt'], self.GENERATION_CONFIG)
+                logger.debug(f"AI response generated: {len(response_text)} characters")
+
+            self.finish_response(prepared, user_message, response_text)
             return response_text
 
         except Exception as e:
             logger.error(f"AI Error: {e}")
-            print(f"DEBUG: Exception occurred: {e}")
-            return "Üzr istəyirəm, hazırda texniki problem var. Zəhmət olmasa sonra yenidən cəhd edin."
+            logger.debug("AI error traceback", exc_info=True)
+            return self.error_response(e)
+
+    def error_response(self, error: Exception) -> str:
+        """Apology text telling the user whether retrying soon can help"""
+        if isinstance(error, LLMRateLimitError):
+            return self.RATE_LIMIT_RESPONSE
+        if isinstance(error, LLMTimeoutError):
+            return self.TIMEOUT_RESPONSE
+        return self.ERROR_RESPONSE
+
+    def stream_enhanced_response(self, user_message: str, user_info: dict) -> Iterator[str]:
+        """Yield the answer in pieces as Gemini produces them.
+
+        The conversation history and cache are only updated once the whole
+        answer has been streamed; on failure the apology text is yielded.
+        """
+        parts = []
+        try:
+            prepared = self.prepare_response(user_message, user_info)
+            if 'cached' in prepared:
+                parts.append(prepared['cached'])
+                yield prepared['cached']
+            else:
+                for text in self.llm.stream(prepared['prompt'], self.GENERATION_CONFIG):
+                    parts.append(text)
+                    yield text
+                logger.debug(f"AI response streamed: {sum(len(part) for part in parts)} characters")
+
+            self.finish_response(prepared, user_message, "".join(parts))
+
+        except Exception as e:
+            logger.error(f"AI Error: {e}")
+            yield ("\n\n" if parts else "") + self.error_response(e)
 
     def generate_response(self, user_message: str, user_info: dict) -> str:
         """Wrapper method for backward compatibility"""
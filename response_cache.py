@@ -0,0 +1,76 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from text_normalizer import tokenize
+
+
+class ResponseCache:
+    """LRU cache of AI answers with a time-to-live.
+
+    Entries are keyed on the normalized question, the user's role and a
+    fingerprint of the context the answer was generated from, so users with
+    the same role share answers while the retrieved documents are
+    unchanged. Cached prompts must not depend on anything else (the user's
+    name, the conversation). clear() is registered as a FileManager change listener to drop everything when
+    documents are added or removed.
+    """
+
+    def __init__(self, max_entries: int = 500, ttl_seconds: int = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(question: str, role: str, context: str) -> str:
+        """Cache key; case, diacritics and punctuation of the question don't matter"""
+        normalized = " ".join(tokenize(question, min_length=1))
+        fingerprint = hashlib.sha1(context.encode('utf-8')).hexdigest()
+        return hashlib.sha1("\x00".join([role, normalized, fingerprint]).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, response: str):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry, e.g. after the indexed documents changed"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
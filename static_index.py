@@ -0,0 +1,95 @@
+import json
+import math
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List
+
+from text_normalizer import MIN_STEM_LENGTH, stem, tokenize
+
+
+class StaticKnowledgeIndex:
+    """Inverted index over the static knowledge base ({category: {key: value}}).
+
+    Entries are tokenized with the same Azerbaijani folding as the document
+    search, once, when the data is loaded. A query only touches the postings
+    of its own terms: like the full-text search, each term is stemmed and
+    matched as a prefix, so "məzuniyyətə" finds "məzuniyyət". Matches in an
+    entry's key count double, and rare terms count more than common ones.
+    """
+
+    LABEL_WEIGHT = 2.0
+    # Longest list of vocabulary words one query term may expand to
+    MAX_PREFIX_EXPANSIONS = 50
+
+    def __init__(self, data: Dict = None):
+        self._lock = threading.Lock()
+        self.load(data or {})
+
+    @classmethod
+    def from_file(cls, path: str) -> 'StaticKnowledgeIndex':
+        index = cls()
+        index.load_file(path)
+        return index
+
+    def load_file(self, path: str):
+        """Replace the indexed data with a JSON file of the same shape"""
+        with open(path, encoding='utf-8') as f:
+            self.load(json.load(f))
+
+    def load(self, data: Dict):
+        """Build the index for data, then swap it in for searches"""
+        entries = []
+        postings = defaultdict(dict)
+        for category, items in data.items():
+            for key, value in items.items():
+                text = json.dumps(value, ensure_ascii=False) if isinstance(value, dict) else str(value)
+                entry_id = len(entries)
+                entries.append({'category': category, 'label': key, 'text': text})
+                for token in tokenize(text):
+                    postings[token].setdefault(entry_id, 1.0)
+                for token in tokenize(key.replace('_', ' ')):
+                    postings[token][entry_id] = self.LABEL_WEIGHT
+
+        with self._lock:
+            self.data = data
+            self.entries = entries
+            self.postings = dict(postings)
+            self.vocabulary = sorted(postings)
+
+    def search(self, query: str, limit: int = None) -> List[Dict]:
+        """Matching entries ({'category', 'label', 'text', 'score'}), best first"""
+        with self._lock:
+            entries, postings, vocabulary = self.entries, self.postings, self.vocabulary
+
+        scores = defaultdict(float)
+        for term in dict.fromkeys(tokenize(query)):
+            matched = {}
+            for word in self._expand(term, vocabulary):
+                for entry_id, weight in postings[word].items():
+                    matched[entry_id] = max(matched.get(entry_id, 0.0), weight)
+            if not matched:
+                continue
+            idf = math.log(1 + len(entries) / len(matched))
+            for entry_id, weight in matched.items():
+                scores[entry_id] += idf * weight
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        if limit:
+            ranked = ranked[:limit]
+        return [{**entries[entry_id], 'score': round(score, 4)} for entry_id, score in ranked]
+
+    def _expand(self, term: str, vocabulary: List[str]) -> List[str]:
+        """Indexed words the query term matches"""
+        if len(term) < MIN_STEM_LENGTH:
+            position = bisect_left(vocabulary, term)
+            return [term] if position < len(vocabulary) and vocabulary[position] == term else []
+
+        prefix = stem(term)
+        words = []
+        position = bisect_left(vocabulary, prefix)
+        while (position < len(vocabulary) and vocabulary[position].startswith(prefix)
+               and len(words) < self.MAX_PREFIX_EXPANSIONS):
+            words.append(vocabulary[position])
+            position += 1
+        return words
@@ -0,0 +1,65 @@
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StorageSweeper:
+    """Runs FileManager.sweep_storage() on a background thread every interval_seconds.
+
+    Deleted documents, failed uploads and request temp files leave blobs
+    and index pages behind; the sweep removes them and keeps the full-text
+    index merged and the database file compact. An interval of 0 starts no
+    thread, run_once() can still be called (e.g. from an admin route).
+    """
+
+    def __init__(self, file_manager, interval_seconds: float = 3600, temp_dir: str = None,
+                 min_age_seconds: float = 3600):
+        self.file_manager = file_manager
+        self.interval_seconds = interval_seconds
+        self.temp_dir = temp_dir
+        self.min_age_seconds = min_age_seconds
+        self.runs = 0
+        self.last_run: Optional[str] = None
+        self.last_result: Optional[Dict] = None
+        # One sweep at a time, whether scheduled or requested
+        self._run_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if interval_seconds > 0:
+            self._thread = threading.Thread(target=self._loop, name='storage-sweeper', daemon=True)
+            self._thread.start()
+
+    def run_once(self) -> Dict:
+        with self._run_lock:
+            try:
+                result = self.file_manager.sweep_storage(temp_dir=self.temp_dir,
+                                                         min_age_seconds=self.min_age_seconds)
+            except Exception as e:
+                logger.error(f"Storage sweep failed: {e}")
+                result = {'success': False, 'error': str(e)}
+            self.runs += 1
+            self.last_run = datetime.now().isoformat()
+            self.last_result = result
+            return result
+
+    def stats(self) -> Dict:
+        return {
+            'interval_seconds': self.interval_seconds,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'runs': self.runs,
+            'last_run': self.last_run,
+            'last_result': self.last_result
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._stop.set()
+        if self._thread and wait:
+            self._thread.join()
+
+    def _loop(self):
+        # The first sweep waits a full interval, so start-up stays quick
+        while not self._stop.wait(self.interval_seconds):
+            self.run_once()
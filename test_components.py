@@ -62,6 +62,822 @@ def test_ai_assistant():
         traceback.print_exc()
         return False
 
+def test_duplicate_upload():
+    try:
+        print("🔧 Testing duplicate upload...")
+        import tempfile
+        from pathlib import Path
+        from file_manager import FileManager
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_manager = FileManager(storage_dir=f"{tmp}/documents", db_path=f"{tmp}/index.db")
+            source = Path(tmp) / "qayda.txt"
+            source.write_text("İş saatları 09:00-18:00", encoding="utf-8")
+
+            first = file_manager.upload_file(str(source))
+            second = file_manager.upload_file(str(source))
+
+            assert first['success'] and second['success']
+            assert second['duplicate_of'] == first['file_id']
+
+            # Streamed uploads land in storage directly and dedupe the same way
+            import io
+            blob_path = file_manager.receive_upload(io.BytesIO(source.read_bytes()), "qayda_2.txt")
+            third = file_manager.upload_file(str(blob_path), filename="qayda_2.txt")
+            assert third['filename'] == "qayda_2.txt" and third['duplicate_of'] == first['file_id']
+            assert len(list(Path(tmp, "documents").iterdir())) == 1
+
+            # The same content under another suffix reuses the blob too
+            renamed = Path(tmp) / "qayda.md"
+            renamed.write_bytes(source.read_bytes())
+            fourth = file_manager.upload_file(str(renamed))
+            blob_path = file_manager.receive_upload(io.BytesIO(source.read_bytes()), "qayda.html")
+            fifth = file_manager.upload_file(str(blob_path), filename="qayda.html")
+            assert fourth['duplicate_of'] == fifth['duplicate_of'] == first['file_id']
+            assert len(list(Path(tmp, "documents").iterdir())) == 1
+            assert file_manager.get_file_content(second['file_id'])['content'] == "İş saatları 09:00-18:00"
+        print("✅ Duplicate upload works!")
+        return True
+    except Exception as e:
+        print(f"❌ Duplicate upload failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_ingestion_queue():
+    try:
+        print("🔧 Testing ingestion queue...")
+        import tempfile
+        import time
+        from pathlib import Path
+        from file_manager import FileManager
+        from ingest_queue import IngestionQueue
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_manager = FileManager(storage_dir=f"{tmp}/documents", db_path=f"{tmp}/index.db")
+            queue = IngestionQueue(file_manager, max_workers=2)
+            source_dir = Path(tmp) / "incoming"
+            source_dir.mkdir()
+            for i in range(3):
+                (source_dir / f"emr_{i}.txt").write_text(f"Əmr nömrəsi {i}", encoding="utf-8")
+            (source_dir / "skip.bin").write_bytes(b"\x00")
+
+            job_id = queue.submit_directory(str(source_dir), category="Əmrlər")
+            for _ in range(100):
+                job = queue.get_job(job_id)
+                if job['status'].startswith('completed'):
+                    break
+                time.sleep(0.05)
+            queue.shutdown()
+
+            assert job['status'] == 'completed' and job['total'] == 3
+            assert job['throughput']['files_per_second'] > 0
+            assert all(f['status'] == 'done' for f in job['files'])
+            assert all(f['processed'] for f in file_manager.list_files())
+
+            # A new version is queued the same way and keeps the category
+            old = file_manager.list_files()[0]
+            (source_dir / "yeni.txt").write_text("Yeni əmr", encoding="utf-8")
+            inline = IngestionQueue(file_manager, run_async=False)
+            job = inline.get_job(inline.submit_files([{'path': str(source_dir / "yeni.txt"),
+                                                        'replaces': old['file_id']}]))
+            assert job['status'] == 'completed'
+            files = {f['file_id']: f for f in file_manager.list_files()}
+            assert old['file_id'] not in files and len(files) == 3
+            assert files[job['files'][0]['file_id']]['category'] == "Əmrlər"
+        print("✅ Ingestion queue works!")
+        return True
+    except Exception as e:
+        print(f"❌ Ingestion queue failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_streaming_chunker():
+    try:
+        print("🔧 Testing streaming chunker...")
+        from file_manager import DocumentChunker
+
+        chunker = DocumentChunker(max_chunk_size=10, overlap_size=3)
+        words = [f"söz{i}" for i in range(47)]
+        pages = [' '.join(words[i:i + 6]) + "\n" for i in range(0, len(words), 6)]
+
+        streamed = [chunk['content'] for chunk in chunker.chunk_stream(pages, "doc")]
+        whole = [chunk['content'] for chunk in chunker.chunk_text(' '.join(words), "doc")]
+        assert streamed == whole and len(streamed) == 7
+        assert streamed[1].split()[:3] == streamed[0].split()[-3:]
+        # An overlap as large as the chunk would never move forward
+        for sizes in [(10, 10), (10, 12), (10, -1)]:
+            try:
+                DocumentChunker(*sizes)
+            except ValueError:
+                continue
+            raise AssertionError(f"DocumentChunker{sizes} was accepted")
+        print("✅ Streaming chunker works!")
+        return True
+    except Exception as e:
+        print(f"❌ Streaming chunker failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_excel_chunks():
+    try:
+        print("🔧 Testing Excel chunks...")
+        import tempfile
+        import openpyxl
+        from file_manager import DocumentProcessor, DocumentChunker
+
+        with tempfile.TemporaryDirectory() as tmp:
+            workbook = openpyxl.Workbook(write_only=True)
+            sheet = workbook.create_sheet("Ştat")
+            sheet.append(["Ad", "Vəzifə"])
+            for i in range(40):
+                sheet.append([f"İşçi {i}", "Mütəxəssis"])
+            workbook.save(f"{tmp}/stat.xlsx")
+
+            processor = DocumentProcessor(excel_max_rows=31)
+            chunks = list(DocumentChunker(max_chunk_size=40, overlap_size=0).chunk_document(
+                processor, f"{tmp}/stat.xlsx", "excel", "doc"))
+            assert len(chunks) > 1
+            assert all(chunk['content'].startswith("Sheet: Ştat\nAd | Vəzifə\n") for chunk in chunks)
+            assert "truncated after 31 rows" in chunks[-1]['content']
+            assert "İşçi 30" not in chunks[-1]['content']
+        print("✅ Excel chunks work!")
+        return True
+    except Exception as e:
+        print(f"❌ Excel chunks failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_legal_chunker():
+    try:
+        print("🔧 Testing legal chunker...")
+        from file_manager import LegalDocumentChunker
+
+        blocks = [
+            ('paragraph', "Fəsil 3. Cinayət məsuliyyəti"),
+            ('paragraph', "Maddə 20. Cinayət məsuliyyətinin yaşı"),
+            ('paragraph', "20.1. On altı yaşı tamam olmuş şəxslər məsuliyyətə cəlb edilir."),
+            ('paragraph', "Maddə 21. Anlaqsızlıq"),
+            ('paragraph', "Maddə 20-də göstərilən hallar istisna olmaqla..."),
+        ]
+        chunks = list(LegalDocumentChunker().chunk_blocks(blocks, "doc"))
+
+        assert [chunk['article'] for chunk in chunks] == ["Maddə 20", "Maddə 21"]
+        assert all(chunk['section'] == "Fəsil 3. Cinayət məsuliyyəti" for chunk in chunks)
+        assert chunks[0]['content'].startswith("Fəsil 3.")
+        assert chunks[1]['content'].endswith("istisna olmaqla...")
+        print("✅ Legal chunker works!")
+        return True
+    except Exception as e:
+        print(f"❌ Legal chunker failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_context_builder():
+    try:
+        print("🔧 Testing context builder...")
+        from context_builder import ContextBuilder
+
+        passage = "Cinayət məsuliyyətinə on altı yaşı tamam olmuş şəxslər cəlb edilir. " * 5
+        builder = ContextBuilder(token_budget=200)
+        builder.add_ranked([
+            {'text': passage, 'score': 8.0, 'label': "Sənəd: a.docx"},
+            {'text': passage + "Əlavə qeyd.", 'score': 7.0, 'label': "Sənəd: b.docx"},
+            {'text': "Başqa mövzu " * 200, 'score': 2.0, 'label': "Sənəd: c.docx"}
+        ], 'documents')
+        builder.add("Tələb olunan sənəd", 0.1, 'requested', label="Xüsusi sənəd", pinned=True)
+        context = builder.build()
+
+        assert context.startswith("[Xüsusi sənəd]")
+        assert "[Sənəd: a.docx]" in context and "[Sənəd: b.docx]" not in context
+        assert builder.stats['duplicates'] == 1
+        assert builder.stats['tokens'] <= 200
+        assert ContextBuilder.estimate_tokens(context) <= 200
+        print("✅ Context builder works!")
+        return True
+    except Exception as e:
+        print(f"❌ Context builder failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_response_cache():
+    try:
+        print("🔧 Testing response cache...")
+        import tempfile
+        from pathlib import Path
+        from file_manager import FileManager
+        from models import EnhancedKnowledgeBase, EnhancedAIAssistant
+        from llm_client import LLMClient, StubBackend
+
+        class CountingModel(StubBackend):
+            calls = 0
+
+            def generate(self, prompt, generation_config):
+                CountingModel.calls += 1
+                return super().generate(prompt, generation_config)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_manager = FileManager(f"{tmp}/storage", f"{tmp}/index.db")
+            ai_assistant = EnhancedAIAssistant(EnhancedKnowledgeBase(file_manager), "test_key",
+                                               llm_client=LLMClient(CountingModel("İş saatı 09:00-18:00")))
+            user = {'id': 1, 'name': "Test", 'username': "test", 'role': 'analyst'}
+
+            first = ai_assistant.generate_enhanced_response("İş saatları nədir?", user)
+            second = ai_assistant.generate_enhanced_response("İş saatları NƏDİR", user)
+            assert first == second and CountingModel.calls == 1
+            ai_assistant.generate_enhanced_response("İş saatları nədir?", {**user, 'role': 'admin'})
+            assert CountingModel.calls == 2
+
+            # Another user with the same role shares the answer
+            other = {**user, 'id': 2, 'name': "Digər", 'username': "diger"}
+            prepared = ai_assistant.prepare_response("İş saatları nədir?", other)
+            assert prepared['cached'] == first
+            assert ai_assistant.generate_enhanced_response("İş saatları nədir?", other) == first
+            assert CountingModel.calls == 2
+
+            # Follow-ups depend on the conversation and are never cached
+            prepared = ai_assistant.prepare_response("Bəs şənbə günü?", user)
+            assert prepared['cache_key'] is None and "Test" in prepared['prompt']
+            ai_assistant.generate_enhanced_response("Bəs şənbə günü?", user)
+            ai_assistant.generate_enhanced_response("Bəs şənbə günü?", user)
+            assert CountingModel.calls == 4
+
+            # New documents invalidate cached answers
+            document = Path(tmp) / "qayda.txt"
+            document.write_text("İş saatları dəyişdi.", encoding="utf-8")
+            assert file_manager.upload_file(str(document))['success']
+            ai_assistant.generate_enhanced_response("İş saatları nədir?", user)
+            assert CountingModel.calls == 5
+
+            stats = ai_assistant.response_cache.stats()
+            assert stats['hits'] == 3 and stats['invalidations'] == 1
+        print("✅ Response cache works!")
+        return True
+    except Exception as e:
+        print(f"❌ Response cache failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_streaming_chat():
+    try:
+        print("🔧 Testing streaming chat...")
+        import tempfile
+        from file_manager import FileManager
+        from models import EnhancedKnowledgeBase, EnhancedAIAssistant
+        from llm_client import LLMClient, StubBackend
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_manager = FileManager(f"{tmp}/storage", f"{tmp}/index.db")
+            ai_assistant = EnhancedAIAssistant(EnhancedKnowledgeBase(file_manager), "test_key",
+                                               llm_client=LLMClient(StubBackend("İş saatı 09:00-dır.")))
+            user = {'id': 7, 'name': "Test", 'username': "test", 'role': 'analyst'}
+
+            stream = ai_assistant.stream_enhanced_response("İş saatları nədir?", user)
+            assert next(stream) == "İş "
+            # History is only written once the answer is complete
+            assert not ai_assistant.conversations.recent('7')
+            assert "".join(stream) == "saatı 09:00-dır."
+            assert ai_assistant.conversations.recent('7')[-1]['ai_response'] == "İş saatı 09:00-dır."
+        print("✅ Streaming chat works!")
+        return True
+    except Exception as e:
+        print(f"❌ Streaming chat failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_llm_client():
+    try:
+        print("🔧 Testing LLM client...")
+        import threading
+        from llm_client import LLMClient, LLMError, LLMTimeoutError, StubBackend
+
+        class FlakyBackend(StubBackend):
+            calls = 0
+
+            def generate(self, prompt, generation_config):
+                FlakyBackend.calls += 1
+                if FlakyBackend.calls == 1:
+                    raise LLMError("Resource exhausted", status=429)
+                return super().generate(prompt, generation_config)
+
+        client = LLMClient(FlakyBackend("Cavab", latency=0.2), backoff_base=0.01)
+        answers = []
+        callers = [threading.Thread(target=lambda: answers.append(client.generate("sual", {})))
+                   for _ in range(4)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        # One retried backend call served all four identical prompts
+        assert answers == ["Cavab"] * 4 and FlakyBackend.calls == 2
+        assert client.stats()['coalesced'] == 3 and client.stats()['retries'] == 1
+
+        slow = LLMClient(StubBackend("Gec", latency=1.0), timeout=0.1)
+        try:
+            slow.generate("sual", {})
+            assert False, "expected a timeout"
+        except LLMTimeoutError:
+            pass
+        assert "".join(LLMClient(StubBackend("İş saatı 09:00")).stream("sual", {})) == "İş saatı 09:00"
+        print("✅ LLM client works!")
+        return True
+    except Exception as e:
+        print(f"❌ LLM client failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_conversation_store():
+    try:
+        print("🔧 Testing conversation store...")
+        import tempfile
+        from conversation_store import ConversationStore
+
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ConversationStore(f"{tmp}/conversations.db", max_turns=4, recent_turns=2)
+            for i in range(5):
+                store.append('1', f"Sual {i}", f"Cavab {i}. Ətraflı izah.")
+
+            # Turns 0-2 were folded into the summary when the fifth arrived
+            assert [turn['user_message'] for turn in store.recent('1')] == ["Sual 3", "Sual 4"]
+            assert "Sual 0 → Cavab 0" in store.summary('1') and "Ətraflı" not in store.summary('1')
+
+            # Another worker (or a restart) sees the same conversation
+            other_worker = ConversationStore(f"{tmp}/conversations.db", max_turns=4, recent_turns=2)
+            assert other_worker.recent('1', 1)[0]['user_message'] == "Sual 4"
+            other_worker.append('1', "Sual 5", "Cavab 5")
+            assert store.recent('1', 1)[0]['user_message'] == "Sual 5"
+
+            small = ConversationStore(max_users=2)
+            for user_id in ('a', 'b', 'c'):
+                small.append(user_id, "Salam", "Salam!")
+            assert len(small._conversations) == 2 and not small.recent('a')
+        print("✅ Conversation store works!")
+        return True
+    except Exception as e:
+        print(f"❌ Conversation store failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_static_index():
+    try:
+        print("🔧 Testing static knowledge index...")
+        import json
+        import tempfile
+        from pathlib import Path
+        from file_manager import FileManager
+        from models import EnhancedKnowledgeBase
+
+        with tempfile.TemporaryDirectory() as tmp:
+            knowledge_base = EnhancedKnowledgeBase(FileManager(f"{tmp}/storage", f"{tmp}/index.db"))
+            # Case, dotted İ and inflected forms all match
+            assert knowledge_base.search_static_entries("İŞ SAATLARI nədir?")[0]['label'] == "iş_saatları"
+            assert knowledge_base.search_static_entries("məzuniyyətə")[0]['label'].startswith("məzuniyyət")
+            assert knowledge_base.search_static_entries("qwerty") == []
+
+            data_file = Path(tmp) / "knowledge.json"
+            data_file.write_text(json.dumps({"regulations": {"geyim": "Geyim qaydası: işgüzar geyim."}},
+                                            ensure_ascii=False), encoding="utf-8")
+            assert knowledge_base.reload_static_data(str(data_file)) == 1
+            assert knowledge_base.search_static_entries("geyim")[0]['label'] == "geyim"
+            assert knowledge_base.search_static_entries("iş saatları") == []
+        print("✅ Static knowledge index works!")
+        return True
+    except Exception as e:
+        print(f"❌ Static knowledge index failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_lazy_startup():
+    try:
+        print("🔧 Testing lazy start-up...")
+        import subprocess
+        import sys
+
+        # A fresh interpreter, like a serverless cold start
+        check = ("import sys, app; "
+                 "heavy = [m for m in ('google.generativeai', 'PyPDF2', 'docx', 'openpyxl', 'bs4') if m in sys.modules]; "
+                 "assert not heavy, heavy; "
+                 "assert app.ai_assistant is None and app.file_manager is None")
+        result = subprocess.run([sys.executable, '-c', check], capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr[-500:]
+        print("✅ Lazy start-up works!")
+        return True
+    except Exception as e:
+        print(f"❌ Lazy start-up failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_vector_search():
+    try:
+        print("🔧 Testing vector search...")
+        import tempfile
+        from pathlib import Path
+        from file_manager import FileManager
+
+        documents = {
+            "cinayet.txt": "Cinayət məsuliyyəti on altı yaşı tamam olmuş şəxslərə aiddir. "
+                           "Yaş həddi ağır cinayətlərdə on dörd yaşdır.",
+            "yetkinlik.txt": "Yetkinlik yaşına çatmayanların cinayət məsuliyyəti xüsusi qaydada müəyyən edilir.",
+            "ceza.txt": "Cəza çəkmə müəssisələrində məhkumların hüquqları qorunur. Cəza müddəti məhkəmə təyin edir.",
+            "mezuniyyet.txt": "Əmək məzuniyyəti iyirmi bir təqvim günüdür. Məzuniyyət işçinin ərizəsi ilə verilir.",
+            "maas.txt": "Əmək haqqı ayda iki dəfə ödənilir. Maaş bank kartına köçürülür.",
+            "vergi.txt": "Vergi bəyannaməsi ilin sonunda təqdim edilir. Vergi dərəcəsi iyirmi faizdir.",
+            "nikah.txt": "Nikah yaşı on səkkiz yaşdır. Nikah qeydiyyat orqanında bağlanır.",
+            "usaq.txt": "Uşaq hüquqları dövlət tərəfindən qorunur. Uşaqların təhsil hüququ var.",
+            "torpaq.txt": "Torpaq mülkiyyəti dövlət reyestrində qeydə alınır.",
+        }
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_manager = FileManager(f"{tmp}/storage", f"{tmp}/index.db")
+            index = file_manager.vector_index
+            index.MIN_FIT_CHUNKS = 5
+            for name, text in documents.items():
+                path = Path(tmp) / name
+                path.write_text(text, encoding="utf-8")
+                assert file_manager.upload_file(str(path))['success']
+
+            # Fitted once enough chunks were in, the rest embedded as they came
+            assert index.stats()['fitted_on'] == 5
+            assert index.stats()['vectors'] == len(documents)
+            assert file_manager.rebuild_vector_index()['fitted_on'] == len(documents)
+
+            # Fused results hold the best of both rankings, with passages
+            question = "neçə yaşdan cinayətə görə cəza verilir"
+            keyword_best = file_manager.search_chunks(question, hybrid=False)[0]['chunk_id']
+            dense_best = file_manager._dense_chunks(question, 1)[0]['chunk_id']
+            results = file_manager.search_chunks(question, top_k=4)
+            assert {keyword_best, dense_best} <= {result['chunk_id'] for result in results}
+            assert len(results) == 4 and all(result['passage'] for result in results)
+
+            # Agreeing rankings win; max_per_file still applies
+            a, b, c = ({'chunk_id': name, 'file_id': name[0]} for name in ("a1", "b1", "a2"))
+            fused = FileManager.fuse_rankings([[a, b, c], [c, a]], top_k=3, max_per_file=1)
+            assert [result['chunk_id'] for result in fused] == ["a1", "b1"]
+
+            # Approximate search over IVF lists finds the same chunks
+            index.IVF_MIN_VECTORS = 5
+            assert file_manager.rebuild_vector_index()['ivf_lists'] > 0
+            assert index.search("məzuniyyət", 3) == index.search("məzuniyyət", 3, exact=True)
+
+            rowid = index.search("maaş", 1)[0][0]
+            index.remove([rowid])
+            assert rowid not in [hit[0] for hit in index.search("maaş", 5)]
+        print("✅ Vector search works!")
+        return True
+    except Exception as e:
+        print(f"❌ Vector search failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_text_cache():
+    try:
+        print("🔧 Testing extracted text cache...")
+        import tempfile
+        from pathlib import Path
+        from file_manager import FileManager, DocumentChunker
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_manager = FileManager(f"{tmp}/storage", f"{tmp}/index.db", use_vectors=False)
+            source = Path(tmp) / "qayda.txt"
+            source.write_text("Maddə 1. " + " ".join(f"söz{i}" for i in range(40)) + " məzuniyyət",
+                              encoding="utf-8")
+            upload = file_manager.upload_file(str(source))
+            assert upload['success'] and upload['chunks'] == 1
+            assert file_manager.text_cache.stats()['entries'] == 1
+
+            # Re-chunking reads the cache; the parsers must not run again
+            def no_parsing(*args):
+                raise AssertionError("document parsed again")
+            file_manager.processor.parse_text = no_parsing
+            result = file_manager.rechunk_documents(DocumentChunker(max_chunk_size=10, overlap_size=2))
+            assert result['success'] and result['extracted'] == 0
+            assert result['chunks'] == file_manager.list_files()[0]['chunk_count'] > 1
+            hits = file_manager.search_chunks("məzuniyyət")
+            assert len(hits) == 1 and hits[0]['chunk_index'] == result['chunks'] - 1
+            # The old chunk left the full-text indexes with its row
+            for index in file_manager.search_index_tables():
+                file_manager.db.connection().execute(
+                    f"INSERT INTO {index} ({index}) VALUES ('integrity-check')")
+
+            # A new extractor version is a cache miss
+            file_manager.processor.EXTRACTOR_VERSION += 1
+            result = file_manager.rechunk_documents()
+            assert not result['success'] and "parsed again" in result['failed'][0]['error']
+
+            # A parser failing part way keeps the text read so far but is not cached
+            def fails_midway(*args):
+                yield "Maddə 1. məzuniyyət"
+                raise ValueError("corrupt page")
+            file_manager.processor.parse_text = fails_midway
+            result = file_manager.rechunk_documents(DocumentChunker(max_chunk_size=10, overlap_size=2))
+            assert result['success'] and result['extracted'] == 1 and result['chunks'] == 1
+            assert file_manager.text_cache.stats()['entries'] == 1
+            del file_manager.processor.parse_text
+            result = file_manager.rechunk_documents()
+            assert result['success'] and result['extracted'] == 1
+            assert file_manager.text_cache.stats()['entries'] == 2
+        print("✅ Extracted text cache works!")
+        return True
+    except Exception as e:
+        print(f"❌ Extracted text cache failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_directory_sync():
+    try:
+        print("🔧 Testing directory sync...")
+        import os
+        import tempfile
+        from pathlib import Path
+        from file_manager import FileManager
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_manager = FileManager(f"{tmp}/storage", f"{tmp}/index.db", use_vectors=False)
+            share = Path(tmp) / "share"
+            (share / "emrler").mkdir(parents=True)
+            for name, text in [("qayda.txt", "İş saatları"), ("emrler/emr_1.txt", "Əmr 1"),
+                               ("emrler/emr_2.txt", "Əmr 2")]:
+                (share / name).write_text(text, encoding="utf-8")
+            # Ingested before syncing was used, by an unresolved path: taken
+            # over, not ingested again
+            assert file_manager.bulk_upload(f"{share}/emrler/../emrler", workers=1)['successful'] == 2
+
+            first = file_manager.sync_directory(str(share), workers=1)
+            assert (first['new'], first['unchanged']) == (1, 2)
+            again = file_manager.sync_directory(str(share), workers=1)
+            assert again['unchanged'] == 3 and again['ingest'] is None
+            assert len(file_manager.list_files()) == 3
+
+            (share / "qayda.txt").write_text("İş saatları 09:00-18:00", encoding="utf-8")
+            stat = (share / "emrler/emr_1.txt").stat()
+            os.utime(share / "emrler/emr_1.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            (share / "emrler/emr_2.txt").unlink()
+            (share / "yeni.txt").write_text("Yeni sənəd", encoding="utf-8")
+
+            result = file_manager.sync_directory(str(share), workers=1)
+            assert (result['new'], result['modified'], result['deleted'], result['unchanged']) == (1, 1, 1, 1)
+            statuses = dict(file_manager.db.connection().execute(
+                "SELECT path, status FROM sync_manifest").fetchall())
+            assert statuses[str((share / "emrler/emr_2.txt").resolve())] == 'deleted'
+            # The old qayda.txt and the deleted emr_2.txt are gone from the index
+            assert result['removed'] == 2 and len(file_manager.list_files()) == 3
+            assert file_manager.search_chunks("09:00")[0]['filename'] == "qayda.txt"
+            assert file_manager.sync_directory(str(share), workers=1)['ingest'] is None
+        print("✅ Directory sync works!")
+        return True
+    except Exception as e:
+        print(f"❌ Directory sync failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_document_lifecycle():
+    try:
+        print("🔧 Testing document delete and replace...")
+        import io
+        import os
+        import json
+        import tempfile
+        from pathlib import Path
+        from file_manager import FileManager, DocumentChunker, store_blob
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_manager = FileManager(f"{tmp}/storage", f"{tmp}/index.db", use_vectors=False)
+            source = Path(tmp) / "mezuniyyet.txt"
+            source.write_text("Məzuniyyət qaydaları", encoding="utf-8")
+            other = Path(tmp) / "ezamiyyet.txt"
+            other.write_text("Ezamiyyət xərcləri", encoding="utf-8")
+            owner = file_manager.upload_file(str(source))
+            copy = file_manager.upload_file(str(source), category="HR", filename="kopya.txt")
+            travel = file_manager.upload_file(str(other), tags=["maliyyə"])
+            conn = file_manager.db.connection()
+            blob_path = Path(conn.execute("SELECT file_path FROM files WHERE id = ?",
+                                          (owner['file_id'],)).fetchone()[0])
+
+            # The copy takes over the shared chunks and is found under its own name
+            deleted = file_manager.delete_file(owner['file_id'])
+            assert deleted['promoted'] == copy['file_id'] and not deleted['blob_removed']
+            assert file_manager.search_files("qaydaları")[0]['filename'] == "kopya.txt"
+
+            deleted = file_manager.delete_file(copy['file_id'])
+            assert deleted['chunks_removed'] == 1 and deleted['blob_removed']
+            assert not file_manager.search_files("qaydaları") and not blob_path.exists()
+            assert not file_manager.delete_file(copy['file_id'])['success']
+
+            replaced = file_manager.replace_file(travel['file_id'], str(source), filename="ezamiyyet.txt")
+            assert replaced['replaced'] == travel['file_id']
+            rows = conn.execute("SELECT tags, file_path FROM files").fetchall()
+            assert len(rows) == 1 and json.loads(rows[0][0]) == ["maliyyə"]
+            assert not file_manager.search_files("xərcləri")
+            for index in file_manager.search_index_tables():
+                file_manager.db.connection().execute(
+                    f"INSERT INTO {index} ({index}) VALUES ('integrity-check')")
+
+            # Orphaned blobs, partial uploads and temp files are swept
+            (file_manager.storage_dir / ("0" * 32 + ".txt")).write_text("köhnə")
+            (file_manager.storage_dir / ".incoming-abc").write_text("yarım")
+            os.makedirs(f"{tmp}/temp/upload")
+            Path(f"{tmp}/temp/upload/a.txt").write_text("müvəqqəti")
+            # Received but still queued for ingestion: kept
+            waiting = file_manager.receive_upload(io.BytesIO("növbədə".encode()), "novbe.txt")
+            # Left unprocessed by an upload that died hours ago: removed
+            dead_path, dead_hash, dead_size = store_blob(io.BytesIO("yarımçıq".encode()),
+                                                         file_manager.storage_dir, ".txt")
+            with file_manager.db.transaction() as tx:
+                file_manager._insert_file_row(tx.cursor(), "dead", Path("yarimciq.txt"), dead_path,
+                                              "txt", dead_size, dead_hash)
+                file_manager._write_chunk_rows(tx.cursor(), "dead",
+                                               list(DocumentChunker().chunk_text("yarımçıq mətn", "dead")))
+                tx.execute("UPDATE files SET upload_date = datetime('now', '-1 day') WHERE id = 'dead'")
+            assert not file_manager.delete_file("dead")['success']
+            swept = file_manager.sweep_storage(temp_dir=f"{tmp}/temp", min_age_seconds=0)
+            assert (swept['stale_removed'], swept['blobs_removed'], swept['temp_removed']) == (1, 2, 1)
+            assert conn.execute("SELECT COUNT(*) FROM chunks WHERE file_id = 'dead'").fetchone()[0] == 0
+            assert os.listdir(f"{tmp}/temp") == []
+            assert sorted(os.listdir(file_manager.storage_dir)) == sorted([Path(rows[0][1]).name, waiting.name])
+            assert file_manager.upload_file(str(waiting), filename="novbe.txt")['success']
+            assert conn.execute("SELECT COUNT(*) FROM pending_uploads").fetchone()[0] == 0
+            assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+            assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+        print("✅ Document delete and replace work!")
+        return True
+    except Exception as e:
+        print(f"❌ Document lifecycle failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_zip_stream():
+    try:
+        print("🔧 Testing streaming ZIP export...")
+        import io
+        import os
+        import tempfile
+        import zipfile
+        from pathlib import Path
+        from zip_stream import stream_zip
+
+        with tempfile.TemporaryDirectory() as tmp:
+            report = Path(tmp) / "hesabat.docx"
+            report.write_bytes(os.urandom(300_000))
+            notes = Path(tmp) / "qeyd.txt"
+            notes.write_text("Qaydalar " * 20000, encoding="utf-8")
+            entries = [("Ümumi/hesabat.docx", str(report)), ("Ümumi/qeyd.txt", str(notes)),
+                       ("Ümumi/qeyd.txt", str(notes)), ("Ümumi/yoxdur.pdf", f"{tmp}/yoxdur.pdf"),
+                       ("metadata.json", b'{"total_files": 3}')]
+
+            # Pieces leave as they are written, none holds a whole file
+            pieces = list(stream_zip(entries, read_size=64 * 1024))
+            assert len(pieces) > 5 and max(len(piece) for piece in pieces) < 100 * 1024
+
+            with zipfile.ZipFile(io.BytesIO(b"".join(pieces))) as archive:
+                assert archive.testzip() is None
+                members = {info.filename: info for info in archive.infolist()}
+                assert sorted(members) == ["metadata.json", "Ümumi/hesabat.docx",
+                                           "Ümumi/qeyd (2).txt", "Ümumi/qeyd.txt"]
+                assert members["Ümumi/hesabat.docx"].compress_type == zipfile.ZIP_STORED
+                assert members["Ümumi/qeyd.txt"].compress_type == zipfile.ZIP_DEFLATED
+                assert archive.read("Ümumi/hesabat.docx") == report.read_bytes()
+                assert archive.read("Ümumi/qeyd (2).txt") == notes.read_bytes()
+        print("✅ Streaming ZIP export works!")
+        return True
+    except Exception as e:
+        print(f"❌ Streaming ZIP export failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_trigram_search():
+    try:
+        print("🔧 Testing substring and typo search...")
+        import tempfile
+        from pathlib import Path
+        from file_manager import FileManager
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_manager = FileManager(f"{tmp}/storage", f"{tmp}/index.db", use_vectors=False)
+            for name, text in [("mecelle.txt", "Maddə 20. Cinayət məsuliyyətinin yaşı"),
+                               ("is.txt", "İş saatları 09:00-dan 18:00-dək davam edir"),
+                               ("ezam.txt", "Ezamiyyət xərcləri mühasibatlıq tərəfindən ödənilir")]:
+                (Path(tmp) / name).write_text(text, encoding="utf-8")
+                file_manager.upload_file(str(Path(tmp) / name))
+            assert file_manager.has_trigram_index
+
+            # Part of a word, and a word with one wrong letter
+            assert [r['filename'] for r in file_manager.search_files("suliyyəti")] == ["mecelle.txt"]
+            assert [r['filename'] for r in file_manager.search_files("mühasibatlig")] == ["ezam.txt"]
+            assert [r['filename'] for r in file_manager.search_chunks("ezamiyyat", hybrid=False)] == ["ezam.txt"]
+            # Sharing a few trigrams with every document is not a match
+            for query in ["telefon nömrəsi lazımdır", "Pensiya neçədir?", "xyzabc"]:
+                assert file_manager.search_files(query) == [], query
+                assert file_manager.search_chunks(query, hybrid=False) == [], query
+        print("✅ Substring and typo search works!")
+        return True
+    except Exception as e:
+        print(f"❌ Substring and typo search failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_bm25_ranking():
+    try:
+        print("🔧 Testing bm25 chunk ranking...")
+        import tempfile
+        from pathlib import Path
+        from file_manager import FileManager, DocumentChunker
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_manager = FileManager(f"{tmp}/storage", f"{tmp}/index.db", use_vectors=False)
+            file_manager.chunker = DocumentChunker(max_chunk_size=20, overlap_size=0)
+            documents = [
+                # Uploaded first, but only mentions the term in passing
+                ("qeyd.txt", " ".join(["söz"] * 15) + " ezamiyyət"),
+                ("emr.txt", "ezamiyyət xərcləri ezamiyyət günləri ezamiyyət"),
+                # Only the filename matches
+                ("ezamiyyət.txt", "Xərclər mühasibatlıq tərəfindən ödənilir"),
+                # Six chunks that all match
+                ("uzun.txt", " ".join(["ezamiyyət " + " ".join(["söz"] * 19)] * 6)),
+            ]
+            ids = {}
+            for name, text in documents:
+                source = Path(tmp) / name
+                source.write_text(text, encoding="utf-8")
+                ids[name] = file_manager.upload_file(str(source))['file_id']
+
+            # bm25 puts the dense match above the earlier upload
+            ranked = [hit['file_id'] for hit in file_manager.search_chunks("ezamiyyət", top_k=20)]
+            assert ranked.index(ids["emr.txt"]) < ranked.index(ids["qeyd.txt"])
+
+            # Column weights decide between a filename and a content match
+            by_name = file_manager.search_chunks("ezamiyyət", top_k=20,
+                                                 weights={'filename': 50.0, 'content': 0.1})
+            assert by_name[0]['file_id'] == ids["ezamiyyət.txt"]
+            by_content = [hit['file_id'] for hit in file_manager.search_chunks(
+                "ezamiyyət", top_k=20, weights={'filename': 0.0, 'content': 1.0})]
+            assert by_content[0] == ids["emr.txt"]
+            assert by_content.index(ids["emr.txt"]) < by_content.index(ids["ezamiyyət.txt"])
+
+            # One long file can't take more than max_per_file places
+            for max_per_file in (1, 2, 4):
+                hits = file_manager.search_chunks("ezamiyyət", top_k=20, max_per_file=max_per_file)
+                assert [hit['file_id'] for hit in hits].count(ids["uzun.txt"]) == max_per_file
+                assert len(hits) == 3 + max_per_file
+        print("✅ bm25 chunk ranking works!")
+        return True
+    except Exception as e:
+        print(f"❌ bm25 chunk ranking failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+def test_azerbaijani_search():
+    try:
+        print("🔧 Testing Azerbaijani search...")
+        import tempfile
+        from pathlib import Path
+        from file_manager import FileManager
+
+        with tempfile.TemporaryDirectory() as tmp:
+            file_manager = FileManager(storage_dir=f"{tmp}/documents", db_path=f"{tmp}/index.db")
+            source = Path(tmp) / "mecelle.txt"
+            source.write_text("Maddə 20. Cinayət məsuliyyətinin yaşı", encoding="utf-8")
+            file_manager.upload_file(str(source))
+            assert file_manager.maintain_search_index(optimize=True)['success']
+
+            for query in ["CİNAYƏT məsuliyyəti", "cinayet mesuliyyeti", "yaşı"]:
+                results = file_manager.search_files(query)
+                assert results and "<mark>" in results[0]['snippet'], query
+
+            # A failed index write rolls the whole upload back
+            file_manager.db.connection().execute("DROP TABLE chunk_trigrams")
+            other = Path(tmp) / "qayda.txt"
+            other.write_text("İş saatları", encoding="utf-8")
+            assert not file_manager.upload_file(str(other))['success']
+            conn = file_manager.db.connection()
+            assert conn.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 1
+            assert conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0] == 1
+            conn.execute("INSERT INTO file_search (file_search) VALUES ('integrity-check')")
+        print("✅ Azerbaijani search works!")
+        return True
+    except Exception as e:
+        print(f"❌ Azerbaijani search failed: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
 if __name__ == "__main__":
     print("🧪 Component Testing Started")
     print("=" * 40)
@@ -70,7 +886,27 @@ if __name__ == "__main__":
         ("UserManager", test_user_manager),
         ("FileManager", test_file_manager),
         ("KnowledgeBase", test_knowledge_base),
-        ("AI Assistant", test_ai_assistant)
+        ("AI Assistant", test_ai_assistant),
+        ("Duplicate upload", test_duplicate_upload),
+        ("Ingestion queue", test_ingestion_queue),
+        ("Streaming chunker", test_streaming_chunker),
+        ("Excel chunks", test_excel_chunks),
+        ("Legal chunker", test_legal_chunker),
+        ("Context builder", test_context_builder),
+        ("Response cache", test_response_cache),
+        ("Streaming chat", test_streaming_chat),
+        ("LLM client", test_llm_client),
+        ("Conversation store", test_conversation_store),
+        ("Static knowledge index", test_static_index),
+        ("Lazy start-up", test_lazy_startup),
+        ("Vector search", test_vector_search),
+        ("Extracted text cache", test_text_cache),
+        ("Directory sync", test_directory_sync),
+        ("Document lifecycle", test_document_lifecycle),
+        ("Streaming ZIP", test_zip_stream),
+        ("Trigram search", test_trigram_search),
+        ("bm25 ranking", test_bm25_ranking),
+        ("Azerbaijani search", test_azerbaijani_search)
     ]
     
     results = {}
@@ -0,0 +1,103 @@
+import gzip
+import json
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Set
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractedTextCache:
+    """Extracted document text on disk, gzip-compressed, one file per blob and extraction.
+
+    An entry is keyed on the blob's content hash plus a key naming the
+    extraction (stream kind, extractor version and the settings that change
+    its output), so a new extractor version simply misses. Entries hold the
+    same units the extractor yields - PDF pages, DOCX (kind, text) blocks,
+    spreadsheet (sheet, row) pairs - one JSON line each, so chunkers can
+    re-read a document without the parsers and without loading it whole.
+    """
+
+    SUFFIX = '.jsonl.gz'
+
+    def __init__(self, cache_dir: str, compresslevel: int = 6):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.compresslevel = compresslevel
+        # Per process; entries written by other workers count as hits
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, content_hash: str, key: str) -> Path:
+        # Two-level fan-out keeps directories small for large corpora
+        return self.cache_dir / content_hash[:2] / f"{content_hash}.{key}{self.SUFFIX}"
+
+    def contains(self, content_hash: str, key: str) -> bool:
+        return self.path(content_hash, key).exists()
+
+    def read_through(self, content_hash: str, key: str, extract: Callable[[], Iterable]) -> Iterator:
+        """Yield the cached units, or extract them and cache them on the way.
+
+        The entry is only stored once extract() has been read to the end and
+        produced something, so an interrupted or failed extraction leaves no
+        partial entry behind.
+        """
+        path = self.path(content_hash, key)
+        if path.exists():
+            self.hits += 1
+            yield from self._read(path)
+            return
+
+        self.misses += 1
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}.part")
+        units = 0
+        try:
+            with gzip.open(partial_path, 'wt', encoding='utf-8', compresslevel=self.compresslevel) as f:
+                for unit in extract():
+                    f.write(json.dumps(unit, ensure_ascii=False) + "\n")
+                    units += 1
+                    yield unit
+            if units:
+                os.replace(partial_path, path)
+        finally:
+            partial_path.unlink(missing_ok=True)
+
+    def remove(self, content_hash: str):
+        """Drop every cached extraction of a blob"""
+        for path in (self.cache_dir / content_hash[:2]).glob(f"{content_hash}.*{self.SUFFIX}"):
+            path.unlink(missing_ok=True)
+
+    def prune(self, keep: Set[str], min_age_seconds: float = 3600) -> int:
+        """Drop entries of content hashes not in keep, and abandoned partial writes.
+
+        Only files older than min_age_seconds go, so an extraction that is
+        still running keeps its entry. Returns the number of files removed.
+        """
+        cutoff = time.time() - min_age_seconds
+        removed = 0
+        for path in self.cache_dir.glob('*/*'):
+            stale = path.name.endswith('.part') or (path.name.endswith(self.SUFFIX)
+                                                    and path.name.split('.', 1)[0] not in keep)
+            try:
+                if stale and path.stat().st_mtime <= cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def stats(self) -> Dict:
+        sizes = [path.stat().st_size for path in self.cache_dir.glob(f"*/*{self.SUFFIX}")]
+        return {'entries': len(sizes), 'bytes': sum(sizes), 'hits': self.hits, 'misses': self.misses}
+
+    @staticmethod
+    def _read(path: Path) -> Iterator:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                unit = json.loads(line)
+                # JSON has no tuples; block and row units are pairs
+                yield tuple(unit) if isinstance(unit, list) else unit
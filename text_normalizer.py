@@ -0,0 +1,115 @@
+import re
+from typing import List, Optional, Tuple
+
+# Azerbaijani-aware folding. Both dotted and dotless i collapse to "i" and
+# the remaining letters lose their diacritics, so "CİNAYƏT", "cinayət" and
+# "cinayet" all index to the same token. Every mapping is one character to
+# one character, which keeps folded text token-aligned with the original.
+AZ_FOLD_TABLE = str.maketrans({
+    'İ': 'i', 'I': 'i', 'ı': 'i',
+    'Ə': 'e', 'ə': 'e',
+    'Ö': 'o', 'ö': 'o',
+    'Ü': 'u', 'ü': 'u',
+    'Ğ': 'g', 'ğ': 'g',
+    'Ş': 's', 'ş': 's',
+    'Ç': 'c', 'ç': 'c',
+})
+
+# Common inflectional suffixes in folded form, longest first
+AZ_SUFFIXES = sorted({
+    'a', 'e', 'i', 'u',
+    'lar', 'ler',
+    'larin', 'lerin', 'lari', 'leri', 'larda', 'lerde', 'lardan', 'lerden',
+    'nin', 'nun', 'in', 'un', 'inin', 'unun', 'ini', 'unu', 'ina', 'ine', 'una', 'une',
+    'da', 'de', 'dan', 'den', 'ta', 'te', 'tan', 'ten',
+    'ya', 'ye', 'na', 'ne',
+    'ni', 'nu', 'si', 'su', 'sini', 'sunu', 'sina', 'sine', 'sinin', 'sunun',
+    'miz', 'muz', 'niz', 'nuz', 'imiz', 'umuz', 'iniz', 'unuz',
+    'dir', 'dur', 'tir', 'tur',
+    'liq', 'lik', 'luq', 'luk',
+}, key=len, reverse=True)
+
+MIN_STEM_LENGTH = 4
+
+# Shorter words share too many trigrams with unrelated ones to match fuzzily
+FUZZY_MIN_LENGTH = 5
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def fold(text: str) -> str:
+    """Lowercase with Azerbaijani rules and strip diacritics"""
+    if text is None:
+        return None
+    return text.translate(AZ_FOLD_TABLE).lower()
+
+
+def stem(token: str) -> str:
+    """Strip the longest inflectional suffix that leaves a usable stem"""
+    for suffix in AZ_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LENGTH:
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str, min_length: int = 2) -> List[str]:
+    """Split folded text into word tokens"""
+    return [token for token in TOKEN_PATTERN.findall(fold(text)) if len(token) >= min_length]
+
+
+def fts_terms(query: str, use_stemming: bool = True) -> List[str]:
+    """Turn a user query into quoted FTS5 terms for the folded index.
+
+    With stemming each term becomes a prefix query, so "cinayətin" also
+    matches "cinayət" and "cinayətlər".
+    """
+    terms = []
+    for token in tokenize(query):
+        if use_stemming and len(token) >= MIN_STEM_LENGTH:
+            terms.append(f'"{stem(token)}"*')
+        else:
+            terms.append(f'"{token}"')
+    return list(dict.fromkeys(terms))
+
+
+def trigram_queries(query: str) -> List[Tuple[str, Optional[str]]]:
+    """MATCH expressions for a trigram index, strictest first.
+
+    Each comes with the word it is fuzzy on, or None. The first matches the
+    folded query as a substring. A single word of FUZZY_MIN_LENGTH or more
+    letters also gets a fuzzy expression matching any of its trigrams; a
+    hit must then contain at least fuzzy_min_hits() of them, so a misspelled
+    word still finds its closest chunks while sharing one gram finds nothing.
+    """
+    words = tokenize(query, min_length=1)
+    text = ' '.join(words)
+    if len(text) < 3:
+        return []
+
+    queries = [(f'"{text}"', None)]
+    if len(words) == 1 and len(text) >= FUZZY_MIN_LENGTH:
+        queries.append((' OR '.join(f'"{gram}"' for gram in trigrams(text)), text))
+    return queries
+
+
+def trigrams(word: str) -> List[str]:
+    return sorted({word[i:i + 3] for i in range(len(word) - 2)})
+
+
+def fuzzy_min_hits(word: str) -> int:
+    """Trigrams of word a fuzzy hit must contain: one typo destroys at most three"""
+    return max(2, len(trigrams(word)) - 3)
+
+
+def trigram_hits(text: str, word: str) -> int:
+    """How many of word's trigrams occur in the folded text"""
+    if not text:
+        return 0
+    folded = fold(text)
+    return sum(1 for gram in trigrams(word) if gram in folded)
+
+
+def register_sql_functions(conn):
+    """Expose the folding to SQL as az_fold(text) and az_trigram_hits(text, word)"""
+    conn.create_function('az_fold', 1, fold, deterministic=True)
+    conn.create_function('az_trigram_hits', 2, trigram_hits, deterministic=True)
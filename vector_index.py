@@ -0,0 +1,473 @@
+import json
+import logging
+import math
+import os
+import random
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from text_normalizer import tokenize
+
+try:
+    import fcntl
+except ImportError:  # Windows: the thread lock still serializes writers in one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def embedding_terms(text: str) -> List[str]:
+    """Word prefixes of the folded text, so inflections share dimensions.
+
+    Azerbaijani is agglutinative: the first five letters of a word mostly
+    identify it ("cinayətə", "cinayətlərdə"), and the first three tie a
+    short root to its forms ("yaş", "yaşı", "yaşdan").
+    """
+    terms = []
+    for token in tokenize(text):
+        terms.append(token[:5])
+        if len(token) > 3:
+            terms.append('^' + token[:3])
+    return terms
+
+
+class TfidfSvdEmbedder:
+    """Dense text vectors from TF-IDF reduced with a truncated SVD (LSA).
+
+    Needs nothing but NumPy. Words that occur in the same chunks end up
+    close together, so a paraphrase can match a chunk it shares few exact
+    words with. Any object with fit(texts), embed(texts), save(path) and
+    load(path) can stand in for it.
+    """
+
+    def __init__(self, dim: int = 128, max_features: int = 20000, oversample: int = 10,
+                 power_iterations: int = 2, seed: int = 0):
+        self.dim = dim
+        self.max_features = max_features
+        self.oversample = oversample
+        self.power_iterations = power_iterations
+        self.seed = seed
+        self.vocabulary: Dict[str, int] = {}
+        self.idf = None
+        self.projection = None  # vocabulary x dim
+
+    @property
+    def fitted(self) -> bool:
+        return self.projection is not None
+
+    def fit(self, texts: List[str]):
+        documents = [Counter(embedding_terms(text)) for text in texts]
+        df = Counter(term for document in documents for term in document)
+        # Terms seen in one chunk only carry no co-occurrence signal
+        min_df = 2 if len(documents) >= 50 else 1
+        terms = [term for term, count in df.most_common(self.max_features) if count >= min_df]
+        self.vocabulary = {term: i for i, term in enumerate(sorted(terms))}
+        if not self.vocabulary:
+            raise ValueError("No indexable words to fit the embedding model on")
+        n = len(documents)
+        self.idf = np.ones(len(self.vocabulary), dtype=np.float32)
+        for term, i in self.vocabulary.items():
+            self.idf[i] = math.log((1 + n) / (1 + df[term])) + 1
+
+        indptr, indices, data = self._tfidf(documents)
+        rank = max(1, min(self.dim, n - 1, len(self.vocabulary) - 1))
+        self.projection = self._randomized_svd(indptr, indices, data, len(self.vocabulary), rank)
+        self.dim = rank
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """L2-normalized float32 rows; texts with no known word give zeros"""
+        indptr, indices, data = self._tfidf([Counter(embedding_terms(text)) for text in texts])
+        vectors = _csr_matmul(indptr, indices, data, self.projection)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    def save(self, path: Path):
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        with open(path, 'wb') as f:
+            np.savez(f, terms=np.array(terms, dtype=object), idf=self.idf,
+                     projection=self.projection)
+
+    def load(self, path: Path):
+        with np.load(path, allow_pickle=True) as model:
+            self.vocabulary = {term: i for i, term in enumerate(model['terms'].tolist())}
+            self.idf = model['idf']
+            self.projection = model['projection']
+        self.dim = self.projection.shape[1]
+
+    def _tfidf(self, documents: List[Counter]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Row-normalized TF-IDF matrix in CSR form"""
+        indptr = [0]
+        indices = []
+        data = []
+        for document in documents:
+            row = [(self.vocabulary[term], 1 + math.log(count))
+                   for term, count in document.items() if term in self.vocabulary]
+            if row:
+                columns, tf = zip(*row)
+                weights = np.asarray(tf, dtype=np.float32) * self.idf[list(columns)]
+                weights /= np.linalg.norm(weights)
+                indices.extend(columns)
+                data.extend(weights.tolist())
+            indptr.append(len(indices))
+        return (np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64),
+                np.asarray(data, dtype=np.float32))
+
+    def _randomized_svd(self, indptr, indices, data, columns: int, rank: int) -> np.ndarray:
+        """Top right singular vectors of the sparse matrix, as columns x rank"""
+        rng = np.random.default_rng(self.seed)
+        omega = rng.standard_normal((columns, rank + self.oversample)).astype(np.float32)
+        sample = _csr_matmul(indptr, indices, data, omega)
+        for _ in range(self.power_iterations):
+            sample, _ = np.linalg.qr(sample)
+            sample, _ = np.linalg.qr(_csr_rmatmul(indptr, indices, data, sample, columns))
+            sample = _csr_matmul(indptr, indices, data, sample)
+        basis, _ = np.linalg.qr(sample)
+        # B = Q^T X is small: (rank + oversample) x columns
+        small = _csr_rmatmul(indptr, indices, data, basis, columns).T
+        _, _, vt = np.linalg.svd(small, full_matrices=False)
+        return np.ascontiguousarray(vt[:rank].T, dtype=np.float32)
+
+
+def _csr_matmul(indptr, indices, data, matrix: np.ndarray, block: int = 1024) -> np.ndarray:
+    """X @ matrix for a CSR matrix X, a block of rows at a time"""
+    rows = len(indptr) - 1
+    out = np.zeros((rows, matrix.shape[1]), dtype=np.float32)
+    for start in range(0, rows, block):
+        stop = min(rows, start + block)
+        low, high = indptr[start], indptr[stop]
+        if low == high:
+            continue
+        products = data[low:high, None] * matrix[indices[low:high]]
+        starts = indptr[start:stop] - low
+        filled = np.diff(indptr[start:stop + 1]) > 0
+        out[start:stop][filled] = np.add.reduceat(products, starts[filled], axis=0)
+    return out
+
+
+def _csr_rmatmul(indptr, indices, data, matrix: np.ndarray, columns: int, block: int = 1024) -> np.ndarray:
+    """X.T @ matrix for a CSR matrix X, a block of rows at a time"""
+    rows = len(indptr) - 1
+    out = np.zeros((columns, matrix.shape[1]), dtype=np.float32)
+    for start in range(0, rows, block):
+        stop = min(rows, start + block)
+        low, high = indptr[start], indptr[stop]
+        if low == high:
+            continue
+        row_ids = np.repeat(np.arange(start, stop), np.diff(indptr[start:stop + 1]))
+        order = np.argsort(indices[low:high], kind='stable')
+        sorted_columns = indices[low:high][order]
+        products = (data[low:high, None] * matrix[row_ids])[order]
+        unique_columns, starts = np.unique(sorted_columns, return_index=True)
+        out[unique_columns] += np.add.reduceat(products, starts, axis=0)
+    return out
+
+
+class VectorIndex:
+    """Chunk embeddings in a memory-mapped float32 matrix with exact and IVF search.
+
+    Files in `directory`: model.npz (the embedder), vectors.f32 (one row per
+    chunk), ids.i64 (the chunk rowid of each row, -1 once removed) and
+    ivf.npz (inverted file lists). Rows are only ever appended; fit()
+    rewrites everything and swaps it in. Once there are IVF_MIN_VECTORS rows
+    an inverted file over spherical k-means clusters lets a query score only
+    the nprobe closest clusters plus rows added since the lists were built.
+    """
+
+    MIN_FIT_CHUNKS = 20
+    FIT_SAMPLE = 4000
+    # Refit once the corpus has grown this much since the model was fitted
+    REFIT_GROWTH = 2.0
+    IVF_MIN_VECTORS = 5000
+    IVF_NPROBE = 8
+    # Rebuild the IVF lists when this share of rows is not in them yet
+    IVF_MAX_TAIL = 0.25
+    EMBED_BATCH = 512
+    # Cosine similarity below which a chunk is not considered related at all
+    MIN_SIMILARITY = 0.05
+
+    def __init__(self, directory: str, embedder_factory: Callable[[], object] = TfidfSvdEmbedder):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.embedder_factory = embedder_factory
+        self._lock = threading.RLock()
+        self._embedder = None
+        self._model_mtime = None
+        self._meta = {}
+        self._vectors = None
+        self._ids = None
+        self._ivf = None
+        self._ivf_mtime = None
+
+    @property
+    def meta_path(self) -> Path:
+        return self.directory / 'meta.json'
+
+    def needs_fit(self, corpus_size: int) -> bool:
+        """Whether fit() should run before adding chunks to a corpus this size"""
+        fitted_on = self._load_meta().get('fitted_on', 0)
+        if not fitted_on:
+            return corpus_size >= self.MIN_FIT_CHUNKS
+        return corpus_size >= fitted_on * self.REFIT_GROWTH
+
+    def fit(self, chunks: Callable[[], Iterable[Tuple[int, str]]]):
+        """Fit the model on a sample of the corpus and embed all of it.
+
+        chunks() must return a fresh iterable of (chunk rowid, text) each
+        time it is called; it is read twice.
+        """
+        with self._lock, self._file_lock():
+            sample = []
+            seen = 0
+            rng = random.Random(0)
+            # Reservoir sample, so the model doesn't only see the oldest documents
+            for _, text in chunks():
+                seen += 1
+                if len(sample) < self.FIT_SAMPLE:
+                    sample.append(text)
+                else:
+                    slot = rng.randrange(seen)
+                    if slot < self.FIT_SAMPLE:
+                        sample[slot] = text
+            if not sample:
+                return
+
+            embedder = self.embedder_factory()
+            embedder.fit(sample)
+            embedder.save(self.directory / 'model.npz.tmp')
+
+            vectors_tmp = self.directory / 'vectors.f32.tmp'
+            ids_tmp = self.directory / 'ids.i64.tmp'
+            with open(vectors_tmp, 'wb') as vectors_file, open(ids_tmp, 'wb') as ids_file:
+                for rowids, texts in self._batches(chunks()):
+                    vectors_file.write(embedder.embed(texts).astype(np.float32).tobytes())
+                    ids_file.write(np.asarray(rowids, dtype=np.int64).tobytes())
+
+            os.replace(self.directory / 'model.npz.tmp', self.directory / 'model.npz')
+            os.replace(vectors_tmp, self.directory / 'vectors.f32')
+            os.replace(ids_tmp, self.directory / 'ids.i64')
+            (self.directory / 'ivf.npz').unlink(missing_ok=True)
+            self._write_meta({'fitted_on': seen, 'dim': embedder.dim})
+            self._reset()
+            logger.info(f"Vector index fitted on {len(sample)} of {seen} chunks")
+            self._maybe_build_ivf()
+
+    def add(self, chunks: Iterable[Tuple[int, str]]) -> int:
+        """Embed and append chunks; does nothing until the model is fitted"""
+        with self._lock:
+            embedder = self._load_embedder()
+            if embedder is None:
+                return 0
+            added = 0
+            with self._file_lock():
+                with open(self.directory / 'vectors.f32', 'ab') as vectors_file, \
+                        open(self.directory / 'ids.i64', 'ab') as ids_file:
+                    for rowids, texts in self._batches(chunks):
+                        vectors_file.write(embedder.embed(texts).astype(np.float32).tobytes())
+                        ids_file.write(np.asarray(rowids, dtype=np.int64).tobytes())
+                        added += len(rowids)
+                self._vectors = None
+                self._maybe_build_ivf()
+            return added
+
+    def remove(self, chunk_rowids: Iterable[int]):
+        """Stop returning these chunks; their rows are dropped at the next fit()"""
+        with self._lock, self._file_lock():
+            ids_path = self.directory / 'ids.i64'
+            if not ids_path.exists() or ids_path.stat().st_size == 0:
+                return
+            ids = np.memmap(ids_path, dtype=np.int64, mode='r+')
+            removed = np.isin(ids, np.fromiter(chunk_rowids, dtype=np.int64))
+            if removed.any():
+                ids[removed] = -1
+                ids.flush()
+            del ids
+            self._ids = None
+
+    def search(self, query: str, top_k: int = 10, exact: bool = False,
+               nprobe: int = None) -> List[Tuple[int, float]]:
+        """(chunk rowid, cosine similarity) of the closest chunks, best first"""
+        with self._lock:
+            embedder = self._load_embedder()
+            vectors, ids = self._load_vectors()
+            if embedder is None or vectors is None or not len(ids):
+                return []
+            ivf = None if exact else self._load_ivf(len(ids))
+
+        query_vector = embedder.embed([query])[0]
+        if not query_vector.any():
+            return []
+
+        if ivf is None:
+            rows = None
+            scores = vectors @ query_vector
+        else:
+            probe = min(nprobe or self.IVF_NPROBE, len(ivf['centroids']))
+            lists = np.argpartition(-(ivf['centroids'] @ query_vector), probe - 1)[:probe]
+            offsets = ivf['offsets']
+            rows = np.concatenate([ivf['order'][offsets[i]:offsets[i + 1]] for i in lists]
+                                  + [np.arange(int(ivf['rows']), len(ids))])
+            scores = vectors[rows] @ query_vector
+
+        # Removed rows (id -1) and unrelated chunks drop out
+        candidate_ids = ids if rows is None else ids[rows]
+        scores = np.where((candidate_ids >= 0) & (scores >= self.MIN_SIMILARITY), scores, -np.inf)
+        count = min(top_k, int(np.isfinite(scores).sum()))
+        if count == 0:
+            return []
+        best = np.argpartition(-scores, count - 1)[:count]
+        best = best[np.argsort(-scores[best])]
+        return [(int(candidate_ids[i]), float(scores[i])) for i in best]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            vectors, ids = self._load_vectors()
+            ivf = self._load_ivf(len(ids)) if ids is not None else None
+            return {
+                'fitted_on': self._load_meta().get('fitted_on', 0),
+                'vectors': int((ids >= 0).sum()) if ids is not None else 0,
+                'removed': int((ids < 0).sum()) if ids is not None else 0,
+                'dim': int(vectors.shape[1]) if vectors is not None else 0,
+                'ivf_lists': len(ivf['centroids']) if ivf else 0
+            }
+
+    def _batches(self, chunks: Iterable[Tuple[int, str]]) -> Iterator[Tuple[List[int], List[str]]]:
+        rowids, texts = [], []
+        for rowid, text in chunks:
+            rowids.append(rowid)
+            texts.append(text)
+            if len(rowids) == self.EMBED_BATCH:
+                yield rowids, texts
+                rowids, texts = [], []
+        if rowids:
+            yield rowids, texts
+
+    def _load_meta(self) -> Dict:
+        if self.meta_path.exists():
+            self._meta = json.loads(self.meta_path.read_text())
+        return self._meta
+
+    def _write_meta(self, meta: Dict):
+        tmp = self.directory / 'meta.json.tmp'
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.meta_path)
+        self._meta = meta
+
+    def _load_embedder(self):
+        """The fitted model, reloaded when another process refitted it"""
+        model_path = self.directory / 'model.npz'
+        if not model_path.exists():
+            return None
+        mtime = model_path.stat().st_mtime_ns
+        if self._embedder is None or mtime != self._model_mtime:
+            embedder = self.embedder_factory()
+            embedder.load(model_path)
+            self._embedder = embedder
+            self._model_mtime = mtime
+            self._vectors = None
+        return self._embedder
+
+    def _load_vectors(self) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Map the vector and id files; re-mapped when rows were appended"""
+        vectors_path = self.directory / 'vectors.f32'
+        ids_path = self.directory / 'ids.i64'
+        embedder = self._load_embedder()
+        if embedder is None or not vectors_path.exists() or not ids_path.exists():
+            return None, None
+        dim = embedder.dim
+        # A writer may be between its two appends; only whole pairs count
+        rows = min(vectors_path.stat().st_size // (4 * dim), ids_path.stat().st_size // 8)
+        if self._vectors is None or len(self._vectors) != rows or self._ids is None:
+            if rows == 0:
+                self._vectors = np.zeros((0, dim), dtype=np.float32)
+                self._ids = np.zeros(0, dtype=np.int64)
+            else:
+                self._vectors = np.memmap(vectors_path, dtype=np.float32, mode='r', shape=(rows, dim))
+                self._ids = np.array(np.memmap(ids_path, dtype=np.int64, mode='r', shape=(rows,)))
+        return self._vectors, self._ids
+
+    def _load_ivf(self, rows: int) -> Optional[Dict]:
+        ivf_path = self.directory / 'ivf.npz'
+        if not ivf_path.exists():
+            return None
+        mtime = ivf_path.stat().st_mtime_ns
+        if self._ivf is None or mtime != self._ivf_mtime:
+            with np.load(ivf_path) as ivf:
+                self._ivf = {name: ivf[name] for name in ivf.files}
+            self._ivf_mtime = mtime
+        return self._ivf if int(self._ivf['rows']) <= rows else None
+
+    def _maybe_build_ivf(self):
+        vectors, ids = self._load_vectors()
+        if vectors is None or len(ids) < self.IVF_MIN_VECTORS:
+            return
+        ivf = self._load_ivf(len(ids))
+        if ivf is not None and len(ids) - int(ivf['rows']) <= self.IVF_MAX_TAIL * int(ivf['rows']):
+            return
+
+        rows = len(ids)
+        lists = int(min(1024, max(8, math.sqrt(rows))))
+        centroids = self._kmeans(vectors, lists)
+        assignment = np.empty(rows, dtype=np.int64)
+        for start in range(0, rows, 8192):
+            block = np.asarray(vectors[start:start + 8192])
+            assignment[start:start + 8192] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.searchsorted(assignment[order], np.arange(lists + 1))
+
+        tmp = self.directory / 'ivf.npz.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, centroids=centroids, order=order, offsets=offsets, rows=np.int64(rows))
+        os.replace(tmp, self.directory / 'ivf.npz')
+        self._ivf = None
+        logger.info(f"Vector index: built {lists} IVF lists over {rows} rows")
+
+    @staticmethod
+    def _kmeans(vectors: np.ndarray, clusters: int, iterations: int = 10) -> np.ndarray:
+        """Spherical k-means on a sample of the rows"""
+        rng = np.random.default_rng(0)
+        sample_size = min(len(vectors), clusters * 40)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+        centroids = sample[rng.choice(sample_size, clusters, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(clusters):
+                members = sample[assignment == cluster]
+                # An empty cluster gets a random point to start over from
+                centroid = members.sum(axis=0) if len(members) else sample[rng.integers(sample_size)]
+                norm = np.linalg.norm(centroid)
+                centroids[cluster] = centroid / norm if norm > 0 else centroid
+        return centroids.astype(np.float32)
+
+    def _reset(self):
+        self._embedder = None
+        self._vectors = None
+        self._ids = None
+        self._ivf = None
+
+    def _file_lock(self):
+        return _FileLock(self.directory / '.lock')
+
+
+class _FileLock:
+    """Exclusive lock between processes writing the same index"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.file = open(self.path, 'a')
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
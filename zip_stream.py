@@ -0,0 +1,89 @@
+import os
+import zipfile
+import logging
+from typing import Iterable, Iterator, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Formats that are compressed already (Office files are ZIP archives
+# themselves); deflating them again costs CPU and saves next to nothing
+STORED_EXTENSIONS = {'.docx', '.xlsx', '.pdf', '.zip', '.gz', '.png', '.jpg', '.jpeg'}
+
+# Bytes read from a source file per write; bounds what is held in memory
+READ_SIZE = 1024 * 1024
+
+
+class _StreamSink:
+    """Write-only file object that holds what ZipFile writes until it is drained.
+
+    It has no tell() or seek(), so ZipFile writes each member's sizes and
+    CRC in a data descriptor after its data instead of going back to the
+    local header.
+    """
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data: bytes) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def stream_zip(entries: Iterable[Tuple[str, Union[str, bytes]]],
+               read_size: int = READ_SIZE) -> Iterator[bytes]:
+    """Yield a ZIP archive piece by piece while it is being written.
+
+    entries are (name in the archive, source) pairs, where source is a file
+    path or the bytes of a generated member. Files are read read_size bytes
+    at a time and every compressed block is yielded straight away, so memory
+    stays bounded however large the archive gets and the client receives
+    data from the first file on. STORED_EXTENSIONS are stored as they are,
+    missing files are skipped and repeated names get a " (2)" suffix.
+    """
+    sink = _StreamSink()
+    names: Set[str] = set()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, source in entries:
+            name = _unique_name(name, names)
+            if isinstance(source, bytes):
+                archive.writestr(name, source)
+            else:
+                try:
+                    info = zipfile.ZipInfo.from_file(source, name, strict_timestamps=False)
+                    src = open(source, 'rb')
+                except OSError as e:
+                    logger.warning(f"Skipping {source} in ZIP: {e}")
+                    names.discard(name)
+                    continue
+                stored = os.path.splitext(name)[1].lower() in STORED_EXTENSIONS
+                info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                with src, archive.open(info, 'w') as member:
+                    for block in iter(lambda: src.read(read_size), b''):
+                        member.write(block)
+                        data = sink.drain()
+                        if data:
+                            yield data
+            data = sink.drain()
+            if data:
+                yield data
+    # The central directory is written on close
+    yield sink.drain()
+
+
+def _unique_name(name: str, names: Set[str]) -> str:
+    candidate = name
+    stem, suffix = os.path.splitext(name)
+    counter = 2
+    while candidate in names:
+        candidate = f"{stem} ({counter}){suffix}"
+        counter += 1
+    names.add(candidate)
+    return candidate